@@ -3,6 +3,7 @@ from pymongo import MongoClient
 from mohan.Similarity import Similarity
 from kahi_dspace_works.utils import get_doi, process_affiliation, is_similarity_reg, thesis_types
 from kahi_dspace_works.process_one import process_one
+from kahi_impactu_utils.Verifier import WorkVerifier
 from joblib import Parallel, delayed
 
 
@@ -73,6 +74,8 @@ class Kahi_dspace_works(KahiBase):
             self.thresholds = {"author_thd": 65,
                                "paper_thd_low": 90, "paper_thd_high": 95}
 
+        self.verifier = WorkVerifier(self.thresholds, verbose=self.verbose)
+
         print("INFO: Creating index for full_name in person collection")
         self.db["person"].create_index("full_name")
 
@@ -110,6 +113,7 @@ class Kahi_dspace_works(KahiBase):
                     similarity=False,
                     thresholds=self.thresholds,
                     verbose=self.verbose,
+                    verifier=self.verifier,
                 )
                 for work in list(work_cursor) if get_doi(work)
             )
@@ -132,6 +136,7 @@ class Kahi_dspace_works(KahiBase):
                     similarity=True,
                     thresholds=self.thresholds,
                     verbose=self.verbose,
+                    verifier=self.verifier,
                 )
                 for work in list(work_cursor) if is_similarity_reg(work))
 
@@ -154,4 +159,6 @@ class Kahi_dspace_works(KahiBase):
             dspace_collection = dsapce_db[repository["collection_name"]]
             self.process_repository(affiliation, base_url, dspace_collection)
 
+        if self.verbose > 0:
+            self.verifier.report()
         return 0
@@ -1,7 +1,8 @@
 from kahi_impactu_utils.Utils import compare_author
 from kahi_dspace_works.parser import parse_dspace
-from kahi_dspace_works.utils import set_source, get_doi, check_work, str_normilize, title_similarity
-from bson import ObjectId
+from kahi_dspace_works.utils import set_source, get_doi, title_similarity
+from kahi_impactu_utils.String import str_normilize
+from kahi_impactu_utils.Verifier import WorkVerifier
 from unidecode import unidecode
 
 
@@ -194,7 +195,7 @@ def process_one_insert(entry, affiliation, db, collection, es_handler, verbose):
             print("No elasticsearch index provided")
 
 
-def process_one(dspace_reg, affiliation, base_url, db, collection, empty_work, es_handler, similarity, thresholds, verbose=0):
+def process_one(dspace_reg, affiliation, base_url, db, collection, empty_work, es_handler, similarity, thresholds, verbose=0, verifier=None):
     """
     Dspace record is parsed and processed to be inserted/updated in the works collection.
 
@@ -216,8 +217,12 @@ def process_one(dspace_reg, affiliation, base_url, db, collection, empty_work, e
         elasticsearch handler.
     similarity : bool
         if True, it will search for similar works in the works collection.
+    thresholds : dict
+        thresholds to consider a work as similar.
     verbose : int
         verbosity level.
+    verifier : WorkVerifier | None
+        verifier of the elasticsearch hits shared by the workers, if None one is created with the thresholds.
     """
     if collection.find_one({"external_ids.id": dspace_reg["_id"]}):
         if verbose > 4:
@@ -283,22 +288,14 @@ def process_one(dspace_reg, affiliation, base_url, db, collection, empty_work, e
             hits=20
         )
         if responses:
-            found = False
-            for response in responses:
-                found = check_work(
-                    work["title"], authors, response, thresholds)
-                if found:
-                    colav_reg = collection.find_one(
-                        {"_id": ObjectId(response["_id"])})
-                    if colav_reg:
-                        process_one_update(
-                            entry, colav_reg, db, collection, verbose)
-                        return
-                    else:
-                        if verbose > 4:
-                            print("Register with {} not found in mongodb".format(
-                                response["_id"]))
-                        return
+            if verifier is None:
+                verifier = WorkVerifier(thresholds, verbose=verbose)
+            found, colav_reg = verifier.find_match(
+                collection, work["title"], authors, responses)
+            if colav_reg:
+                process_one_update(
+                    entry, colav_reg, db, collection, verbose)
+                return
             if not found:
                 process_one_insert(entry, affiliation, db,
                                    collection, es_handler, verbose)
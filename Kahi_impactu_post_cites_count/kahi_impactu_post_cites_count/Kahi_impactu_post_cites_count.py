@@ -1,6 +1,7 @@
 from kahi.KahiBase import KahiBase
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
 from joblib import Parallel, delayed
+from time import time
 
 
 class Kahi_impactu_post_cites_count(KahiBase):
@@ -26,6 +27,8 @@ class Kahi_impactu_post_cites_count(KahiBase):
             impactu_post_cites_count:
                 num_jobs: 20
                 verbose: 5
+                engine: single_pass # optional, default query
+                bulk_size: 1000 # optional, used by the single_pass engine
         ```
         """
         self.config = config
@@ -34,6 +37,10 @@ class Kahi_impactu_post_cites_count(KahiBase):
 
         self.n_jobs = self.config["impactu_post_cites_count"]["num_jobs"]
         self.verbose = self.config["impactu_post_cites_count"]["verbose"]
+        self.engine = self.config["impactu_post_cites_count"]["engine"] if "engine" in self.config["impactu_post_cites_count"].keys(
+        ) else "query"
+        self.bulk_size = self.config["impactu_post_cites_count"]["bulk_size"] if "bulk_size" in self.config["impactu_post_cites_count"].keys(
+        ) else 1000
 
         self.client = MongoClient(self.mongodb_url)
         self.db = self.client[self.database_name]
@@ -257,7 +264,130 @@ class Kahi_impactu_post_cites_count(KahiBase):
             )
             client.close()
 
+    def add_counts(self, counts, ids, citations_count, products=True):
+        """
+        Method to add the citations (and the product) of a work to the counters of the given ids.
+        """
+        for idx in ids:
+            if idx not in counts:
+                counts[idx] = {"citations_count": {}, "products_count": 0}
+            if products:
+                counts[idx]["products_count"] += 1
+            for cites in citations_count:
+                if not isinstance(cites.get("count"), (int, float)):
+                    continue
+                source = cites.get("source")
+                counts[idx]["citations_count"][source] = counts[idx]["citations_count"].get(
+                    source, 0) + cites["count"]
+
+    def write_counts(self, collection, ids, counts, products_counts=None):
+        """
+        Method to write the counts of the given ids with bulk writes,
+        the ids without works are saved with empty counts.
+        """
+        ops = []
+        for idx in ids:
+            count = counts.get(idx, {"citations_count": {}, "products_count": 0})
+            rec = {"citations_count": [{"source": source, "count": value}
+                                       for source, value in count["citations_count"].items()]}
+            if products_counts is None:
+                rec["products_count"] = count["products_count"]
+            else:
+                rec["products_count"] = products_counts.get(
+                    idx, {"products_count": 0})["products_count"]
+            ops.append(UpdateOne({"_id": idx}, {"$set": rec}, upsert=True))
+            if len(ops) >= self.bulk_size:
+                collection.bulk_write(ops, ordered=False)
+                ops = []
+        if ops:
+            collection.bulk_write(ops, ordered=False)
+
+    def run_cites_count_single_pass(self):
+        """
+        Method to run the cites and products count calculation for each person, institution,
+        faculty, department, group and source reading the works collection once.
+
+        The citations of the faculties, departments and groups are counted over the works
+        of the authors affiliated to them (as in count_cites_products_faculty_department_group),
+        the products are counted over the works with the unit in the authors affiliations.
+        """
+        start = time()
+        units_ids = [reg["_id"] for reg in self.affiliations_collection.find(
+            {"types.type": {"$in": ["department", "faculty", "group"]}}, {"_id"})]
+        units_set = set(units_ids)
+        person_units = {}
+        for person in self.person_collection.find({"affiliations.id": {"$in": units_ids}}, {"affiliations.id": 1}):
+            person_units[person["_id"]] = [aff["id"] for aff in person["affiliations"]
+                                           if aff.get("id") in units_set]
+
+        person_counts = {}
+        affiliations_counts = {}
+        units_counts = {}
+        sources_counts = {}
+        count = 0
+        for work in self.works_collection.find({}, {"authors.id": 1, "authors.affiliations.id": 1, "source.id": 1, "citations_count": 1}, batch_size=10000):
+            count += 1
+            citations_count = work.get("citations_count") or []
+            authors_ids = set()
+            affiliations_ids = set()
+            units = set()
+            for author in work.get("authors", []):
+                if author.get("id"):
+                    authors_ids.add(author["id"])
+                    units.update(person_units.get(author["id"], []))
+                for aff in author.get("affiliations", []):
+                    if aff.get("id"):
+                        affiliations_ids.add(aff["id"])
+            self.add_counts(person_counts, authors_ids, citations_count)
+            self.add_counts(affiliations_counts,
+                            affiliations_ids, citations_count)
+            self.add_counts(units_counts, units,
+                            citations_count, products=False)
+            if work.get("source", {}).get("id"):
+                self.add_counts(
+                    sources_counts, [work["source"]["id"]], citations_count)
+            if self.verbose > 4 and count % 100000 == 0:
+                print(f"INFO: {count} works counted")
+        if self.verbose > 0:
+            print(
+                f"INFO: {count} works counted in {time() - start:.0f}s")
+
+        person_ids = [reg["_id"]
+                      for reg in self.person_collection.find({}, {"_id"})]
+        if self.verbose > 0:
+            print("Saving cites and products count for {} authors".format(
+                len(person_ids)))
+        self.write_counts(self.person_collection, person_ids, person_counts)
+        del person_ids, person_counts
+
+        aff_ids = [reg["_id"] for reg in self.affiliations_collection.find(
+            {"types.type": {"$nin": ["department", "faculty", "group"]}}, {"_id"})]
+        if self.verbose > 0:
+            print("Saving cites count and products for {} institutions".format(
+                len(aff_ids)))
+        self.write_counts(self.affiliations_collection,
+                          aff_ids, affiliations_counts)
+
+        if self.verbose > 0:
+            print("Saving cites and products count for {} faculties, departments and groups".format(
+                len(units_ids)))
+        self.write_counts(self.affiliations_collection,
+                          units_ids, units_counts, affiliations_counts)
+
+        souces_ids = [reg["_id"]
+                      for reg in self.sources_collection.find({}, {"_id"})]
+        if self.verbose > 0:
+            print("Saving cites and products count for {} sources".format(
+                len(souces_ids)))
+        self.write_counts(self.sources_collection, souces_ids, sources_counts)
+        if self.verbose > 0:
+            print(
+                f"INFO: cites and products count finished in {time() - start:.0f}s")
+
     def run(self):
-        self.run_cites_count()
+        if self.engine == "single_pass":
+            self.run_cites_count_single_pass()
+        else:
+            self.run_cites_count()
         self.client.close()
         return 0
@@ -6,9 +6,11 @@ from spacy import cli, load
 from kahi_impactu_postcalculations.process_one import network_creation_process_one, top_words_process_one, count_works_one, load_nlp_models
 from kahi_impactu_postcalculations.indexes import create_indexes
 from kahi_impactu_postcalculations.denormalization import denormalize
-from kahi_impactu_postcalculations.typing import process_type
-from kahi_impactu_postcalculations.topics import process_topic
-from kahi_impactu_postcalculations.person_persistent_ids import process_person_id
+from kahi_impactu_postcalculations.typing import process_type, compile_types, process_types_table, functors
+from kahi_impactu_postcalculations.topics import process_topic, process_topics_all
+from kahi_impactu_postcalculations.person_persistent_ids import process_person_id, migrate_person_ids
+from kahi_impactu_postcalculations.networks import network_creation_all
+from kahi_impactu_postcalculations.top_words import lemmatize_works, top_words_all
 from pathlib import Path
 import pandas as pd
 import gc
@@ -44,6 +46,26 @@ class Kahi_impactu_postcalculations(KahiBase):
 
         self.author_count = self.config["impactu_postcalculations"][
             "author_count"] if "author_count" in self.config["impactu_postcalculations"] else 6
+        self.network_engine = self.config["impactu_postcalculations"][
+            "network_engine"] if "network_engine" in self.config["impactu_postcalculations"] else "query"
+        self.incremental_denormalization = self.config["impactu_postcalculations"][
+            "incremental_denormalization"] if "incremental_denormalization" in self.config["impactu_postcalculations"] else False
+        self.top_words_engine = self.config["impactu_postcalculations"][
+            "top_words_engine"] if "top_words_engine" in self.config["impactu_postcalculations"] else "query"
+        self.nlp_batch_size = self.config["impactu_postcalculations"][
+            "nlp_batch_size"] if "nlp_batch_size" in self.config["impactu_postcalculations"] else 1000
+        self.types_engine = self.config["impactu_postcalculations"][
+            "types_engine"] if "types_engine" in self.config["impactu_postcalculations"] else "query"
+        self.types_batch_size = self.config["impactu_postcalculations"][
+            "types_batch_size"] if "types_batch_size" in self.config["impactu_postcalculations"] else 1000
+        self.topics_engine = self.config["impactu_postcalculations"][
+            "topics_engine"] if "topics_engine" in self.config["impactu_postcalculations"] else "query"
+        self.topics_batch_size = self.config["impactu_postcalculations"][
+            "topics_batch_size"] if "topics_batch_size" in self.config["impactu_postcalculations"] else 100
+        self.person_ids_engine = self.config["impactu_postcalculations"][
+            "person_ids_engine"] if "person_ids_engine" in self.config["impactu_postcalculations"] else "query"
+        self.person_ids_batch_size = self.config["impactu_postcalculations"][
+            "person_ids_batch_size"] if "person_ids_batch_size" in self.config["impactu_postcalculations"] else 1000
         self._check_and_install_spacy_models()
         self.types_file = str(
             Path(__file__).parent.resolve()) + "/Tipos_ImpactU_Definitivo.xlsx"
@@ -76,6 +98,8 @@ class Kahi_impactu_postcalculations(KahiBase):
 
         self.types["Tipo"] = self.types["Tipo"].apply(
             lambda x: " ".join(x.split()).strip() if isinstance(x, str) else x)
+        # (source, Tipo) -> Tipo ImpactU, used by the table engine
+        self.types_table = compile_types(self.types, functors.keys())
 
     def _check_and_install_spacy_models(self):
         """
@@ -126,12 +150,28 @@ class Kahi_impactu_postcalculations(KahiBase):
             },
                 {"$project": {"types": 1}},
             ]
+            if self.types_engine == "table":
+                if source not in functors.keys():
+                    print(f"WARNING: types of {source} are not supported")
+                    continue
+                data = db["works"].aggregate(
+                    pipe, allowDiskUse=True, batchSize=self.types_batch_size)
+                typed, missing = process_types_table(
+                    db, data, source, self.types_table, self.types_batch_size, verbose=self.verbose > 4)
+                if self.verbose > 0:
+                    print(
+                        f"INFO: {typed} works typed for {source}, {missing} without impactu type")
+                continue
             data = db["works"].aggregate(pipe)
             Parallel(n_jobs=self.n_jobs, verbose=10, backend="threading")(delayed(process_type)(db, work, source, self.types
                                                                                                 ) for work in data)
 
     def process_person_ids(self, client):
         db = client[self.database_name]
+        if self.person_ids_engine == "bulk":
+            migrate_person_ids(db, self.person_priority,
+                               batch_size=self.person_ids_batch_size, verbose=self.verbose)
+            return
         for source in self.person_priority:
             print("INFO: PERSISTENT ID SOURCE  ", source)
             # Paso 1: Buscar todos los documentos 'person' (con o sin COD_RH)
@@ -169,7 +209,7 @@ class Kahi_impactu_postcalculations(KahiBase):
         self.process_types(db)
 
         print(f"INFO: Denormalizing data in {self.database_name}")
-        denormalize(db)
+        denormalize(db, incremental=self.incremental_denormalization)
 
         print(f"INFO: Creating indexes in db {self.database_name} for backend")
         db["works"].create_index("authors.id")
@@ -186,20 +226,107 @@ class Kahi_impactu_postcalculations(KahiBase):
                 "topics": 1,
             },
         )
-        Parallel(
-            n_jobs=self.n_jobs,
-            verbose=10,
-            backend="threading",
-        )(
-            delayed(process_topic)(
+        if self.topics_engine == "batch":
+            process_topics_all(
                 db["works"],
                 openalex_db["topics"],
-                work,
+                works_cursor,
                 self.inference_endpoint,
+                batch_size=self.topics_batch_size,
+                n_jobs=self.n_jobs,
+                verbose=self.verbose
             )
-            for work in works_cursor
-        )
+        else:
+            Parallel(
+                n_jobs=self.n_jobs,
+                verbose=10,
+                backend="threading",
+            )(
+                delayed(process_topic)(
+                    db["works"],
+                    openalex_db["topics"],
+                    work,
+                    self.inference_endpoint,
+                )
+                for work in works_cursor
+            )
+
+        if self.network_engine == "single_pass":
+            self.process_networks(db, impactu_client[self.impactu_database_name])
+        else:
+            self.process_networks_by_query(client, impactu_client, db)
+
+        if self.top_words_engine == "pipe":
+            self.process_top_words_pipe(db, impactu_client[self.impactu_database_name])
+        else:
+            self.process_top_words(client, impactu_client, db)
+
+    def process_top_words_pipe(self, db, impactu_db):
+        """
+        Extract the top words of affiliations and authors lemmatizing the title of every work once.
+
+        Parameters
+        ----------
+        db : pymongo.database.Database
+            The kahi database.
+        impactu_db : pymongo.database.Database
+            The database where the top words are saved.
+        """
+        print("INFO: Lemmatizing works titles for top words")
+        lemmas = lemmatize_works(db, self.es_model, self.en_model, self.stopwords,
+                                 batch_size=self.nlp_batch_size, verbose=self.verbose)
 
+        print("INFO: Creating top words for affiliations")
+        affiliations_ids = [aff["_id"]
+                            for aff in db["affiliations"].find({}, {"_id": 1})]
+        top_words_all(db, impactu_db, affiliations_ids, "affiliations",
+                      lemmas, n_jobs=self.n_jobs, verbose=self.verbose)
+
+        print("INFO: Creating top words for person")
+        authors_ids = [author["_id"]
+                       for author in db["person"].find({}, {"_id": 1})]
+        top_words_all(db, impactu_db, authors_ids, "person",
+                      lemmas, n_jobs=self.n_jobs, verbose=self.verbose)
+
+    def process_networks(self, db, impactu_db):
+        """
+        Create the co-authorship networks of affiliations and authors reading the works collection once per network type.
+
+        Parameters
+        ----------
+        db : pymongo.database.Database
+            The kahi database.
+        impactu_db : pymongo.database.Database
+            The database where the networks are saved.
+        """
+        print("INFO: Getting authors and affiliations ids")
+        institutions_ids = [reg["_id"] for reg in db["works"].aggregate([
+            {"$project": {"authors.affiliations.id": 1}},
+            {"$unwind": "$authors"},
+            {"$unwind": "$authors.affiliations"},
+            {"$group": {"_id": "$authors.affiliations.id"}}
+        ], allowDiskUse=True) if reg["_id"]]
+        institutions_ids = [aff["_id"] for aff in db["affiliations"].find(
+            {"_id": {"$in": institutions_ids}, "types.type": {"$nin": ["faculty", "department", "group"]}}, {"_id": 1})]
+        print("INFO: Creating affiliations networks")
+        network_creation_all(db, impactu_db, institutions_ids,
+                             self.author_count, "affiliations", verbose=self.verbose)
+        del institutions_ids
+
+        authors_ids = [reg["_id"] for reg in db["works"].aggregate([
+            {"$project": {"authors.id": 1}},
+            {"$unwind": "$authors"},
+            {"$group": {"_id": "$authors.id"}}
+        ], allowDiskUse=True) if reg["_id"]]
+        print(f"INFO: total authors {len(authors_ids)}")
+        print("INFO: Creating authors networks")
+        network_creation_all(db, impactu_db, authors_ids,
+                             self.author_count, "person", verbose=self.verbose)
+
+    def process_networks_by_query(self, client, impactu_client, db):
+        """
+        Create the co-authorship networks of affiliations and authors with queries for every affiliation and author.
+        """
         # Getting the list of institutions ids with works
         print("INFO: Getting authors and affiliations ids")
         institutions_ids = []
@@ -257,6 +384,11 @@ class Kahi_impactu_postcalculations(KahiBase):
                         "person",
                         self.backend
                     ) for idx in authors_ids)
+
+    def process_top_words(self, client, impactu_client, db):
+        """
+        Extract the top words of affiliations and authors.
+        """
         # Getting the top words for each institution
         print("INFO: Creating top words for institutions")
         affiliations_cursor = list(db["affiliations"].find({}, {"_id": 1}))
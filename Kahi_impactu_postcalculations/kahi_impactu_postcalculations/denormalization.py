@@ -1,4 +1,43 @@
-def set_works_authors_affiliations_country(collection) -> None:
+from time import time
+
+
+def match_stage(match):
+    """
+    Function to get the $match stage to restrict a pipeline to some documents
+
+    Parameters
+    ----------
+    match : dict
+        Filter of the documents to process, None to process the whole collection
+
+    Returns
+    -------
+    list
+        List with the $match stage, empty if match is None
+    """
+    return [{"$match": match}] if match else []
+
+
+def and_match(query, match):
+    """
+    Function to restrict a query to the documents of a filter
+
+    Parameters
+    ----------
+    query : dict
+        Query of the update
+    match : dict
+        Filter of the documents to process, None to process the whole collection
+
+    Returns
+    -------
+    dict
+        Query restricted to the filter
+    """
+    return {"$and": [query, match]} if match else query
+
+
+def set_works_authors_affiliations_country(collection, match=None) -> None:
     """
     Method to set the country of the affiliations of the authors of the works
 
@@ -6,6 +45,8 @@ def set_works_authors_affiliations_country(collection) -> None:
     ----------
     collection : pymongo.collection.Collection
         Collection where the works are stored
+    match : dict, optional
+        Filter of the documents to process, None to process the whole collection
     """
     pipeline = [
         {
@@ -90,10 +131,10 @@ def set_works_authors_affiliations_country(collection) -> None:
             }
         },
     ]
-    collection.aggregate(pipeline)  # works collections
+    collection.aggregate(match_stage(match) + pipeline)  # works collections
 
 
-def set_works_authors_affiliations_country_code(collection) -> None:
+def set_works_authors_affiliations_country_code(collection, match=None) -> None:
     """
     Method to set the country code of the affiliations of the authors of the works
 
@@ -101,6 +142,8 @@ def set_works_authors_affiliations_country_code(collection) -> None:
     ----------
     collection : pymongo.collection.Collection
         Collection where the works are stored
+    match : dict, optional
+        Filter of the documents to process, None to process the whole collection
     """
     pipeline = [
         {
@@ -185,10 +228,10 @@ def set_works_authors_affiliations_country_code(collection) -> None:
             }
         },
     ]
-    collection.aggregate(pipeline)
+    collection.aggregate(match_stage(match) + pipeline)
 
 
-def set_works_groups_ranking(collection) -> None:
+def set_works_groups_ranking(collection, match=None) -> None:
     """
     Function to set the ranking of the groups of the works
 
@@ -196,6 +239,8 @@ def set_works_groups_ranking(collection) -> None:
     ----------
     collection : pymongo.collection.Collection
         Collection where the works are stored
+    match : dict, optional
+        Filter of the documents to process, None to process the whole collection
     """
     pipeline = [
         {
@@ -284,10 +329,10 @@ def set_works_groups_ranking(collection) -> None:
             }
         },
     ]
-    collection.aggregate(pipeline)
+    collection.aggregate(match_stage(match) + pipeline)
 
 
-def set_works_authors_ranking(collection) -> None:
+def set_works_authors_ranking(collection, match=None) -> None:
     """
     Function to set the ranking of the authors
 
@@ -295,6 +340,8 @@ def set_works_authors_ranking(collection) -> None:
     ----------
     collection : pymongo.collection.Collection
         Collection where the works are stored
+    match : dict, optional
+        Filter of the documents to process, None to process the whole collection
     """
     pipeline = [
         {
@@ -383,10 +430,10 @@ def set_works_authors_ranking(collection) -> None:
             }
         },
     ]
-    collection.aggregate(pipeline)
+    collection.aggregate(match_stage(match) + pipeline)
 
 
-def set_works_citations_count_openalex(collection) -> None:
+def set_works_citations_count_openalex(collection, match=None) -> None:
     """
     Function to set the OpenAlex citations count in works
 
@@ -394,6 +441,8 @@ def set_works_citations_count_openalex(collection) -> None:
     ----------
     collection : pymongo.collection.Collection
         Collection where the works are stored
+    match : dict, optional
+        Filter of the documents to process, None to process the whole collection
     """
     pipeline = [
         {
@@ -423,10 +472,10 @@ def set_works_citations_count_openalex(collection) -> None:
         }
     ]
 
-    collection.update_many({}, pipeline)
+    collection.update_many(match or {}, pipeline)
 
 
-def set_works_authors_full_data(collection) -> None:
+def set_works_authors_full_data(collection, match=None) -> None:
     """
     Function to enrich works authors with full person data
 
@@ -434,6 +483,8 @@ def set_works_authors_full_data(collection) -> None:
     ----------
     collection : pymongo.collection.Collection
         Collection where the works are stored
+    match : dict, optional
+        Filter of the documents to process, None to process the whole collection
     """
     pipeline = [
         {
@@ -508,10 +559,10 @@ def set_works_authors_full_data(collection) -> None:
         },
     ]
 
-    collection.aggregate(pipeline)
+    collection.aggregate(match_stage(match) + pipeline)
 
 
-def set_works_authors_affiliations_dates(collection) -> None:
+def set_works_authors_affiliations_dates(collection, match=None) -> None:
     """
     Function to set authors affiliations start and end dates in works
 
@@ -519,6 +570,8 @@ def set_works_authors_affiliations_dates(collection) -> None:
     ----------
     collection : pymongo.collection.Collection
         Collection where the works are stored
+    match : dict, optional
+        Filter of the documents to process, None to process the whole collection
     """
     pipeline = [
         {
@@ -653,10 +706,10 @@ def set_works_authors_affiliations_dates(collection) -> None:
         },
     ]
 
-    collection.aggregate(pipeline)
+    collection.aggregate(match_stage(match) + pipeline)
 
 
-def set_works_source_full_data(collection) -> None:
+def set_works_source_full_data(collection, match=None) -> None:
     """
     Function to enrich works source with full source data
 
@@ -664,6 +717,8 @@ def set_works_source_full_data(collection) -> None:
     ----------
     collection : pymongo.collection.Collection
         Collection where the works are stored
+    match : dict, optional
+        Filter of the documents to process, None to process the whole collection
     """
     pipeline = [
         {
@@ -707,10 +762,10 @@ def set_works_source_full_data(collection) -> None:
         },
     ]
 
-    collection.aggregate(pipeline)
+    collection.aggregate(match_stage(match) + pipeline)
 
 
-def set_person_affiliations_relations(collection) -> None:
+def set_person_affiliations_relations(collection, match=None) -> None:
     """
     Function to set relations inside affiliations for person collection
 
@@ -718,6 +773,8 @@ def set_person_affiliations_relations(collection) -> None:
     ----------
     collection : pymongo.collection.Collection
         Collection where the persons are stored
+    match : dict, optional
+        Filter of the documents to process, None to process the whole collection
     """
     pipeline = [
         {
@@ -810,10 +867,10 @@ def set_person_affiliations_relations(collection) -> None:
         },
     ]
 
-    collection.aggregate(pipeline)
+    collection.aggregate(match_stage(match) + pipeline)
 
 
-def set_works_authors_affiliations_external_data(collection) -> None:
+def set_works_authors_affiliations_external_data(collection, match=None) -> None:
     """
     Function to enrich works authors affiliations with external_ids and addresses data
 
@@ -821,6 +878,8 @@ def set_works_authors_affiliations_external_data(collection) -> None:
     ----------
     collection : pymongo.collection.Collection
         Collection where the works are stored
+    match : dict, optional
+        Filter of the documents to process, None to process the whole collection
     """
     pipeline = [
         {
@@ -960,10 +1019,10 @@ def set_works_authors_affiliations_external_data(collection) -> None:
         },
     ]
 
-    collection.aggregate(pipeline)
+    collection.aggregate(match_stage(match) + pipeline)
 
 
-def set_works_groups_citations_count(collection) -> None:
+def set_works_groups_citations_count(collection, match=None) -> None:
     """
     Function to set citations count for groups inside works
 
@@ -971,6 +1030,8 @@ def set_works_groups_citations_count(collection) -> None:
     ----------
     collection : pymongo.collection.Collection
         Collection where the works are stored
+    match : dict, optional
+        Filter of the documents to process, None to process the whole collection
     """
     pipeline = [
         {
@@ -1053,10 +1114,10 @@ def set_works_groups_citations_count(collection) -> None:
         },
     ]
 
-    collection.aggregate(pipeline)
+    collection.aggregate(match_stage(match) + pipeline)
 
 
-def set_works_groups_ranking_to_works_collection(collection) -> None:
+def set_works_groups_ranking_to_works_collection(collection, match=None) -> None:
     """
     Function to set ranking data for groups inside works
 
@@ -1064,6 +1125,8 @@ def set_works_groups_ranking_to_works_collection(collection) -> None:
     ----------
     collection : pymongo.collection.Collection
         Collection where the works are stored
+    match : dict, optional
+        Filter of the documents to process, None to process the whole collection
     """
     pipeline = [
         {
@@ -1157,10 +1220,10 @@ def set_works_groups_ranking_to_works_collection(collection) -> None:
         },
     ]
 
-    collection.aggregate(pipeline)
+    collection.aggregate(match_stage(match) + pipeline)
 
 
-def clean_works_authors_affiliations_country_fields(collection) -> None:
+def clean_works_authors_affiliations_country_fields(collection, match=None) -> None:
     """
     Function to remove country and country_code fields from authors affiliations in works
 
@@ -1168,6 +1231,8 @@ def clean_works_authors_affiliations_country_fields(collection) -> None:
     ----------
     collection : pymongo.collection.Collection
         Collection where the works are stored
+    match : dict, optional
+        Filter of the documents to process, None to process the whole collection
     """
     pipeline = [
         {
@@ -1221,10 +1286,10 @@ def clean_works_authors_affiliations_country_fields(collection) -> None:
         }
     ]
 
-    collection.update_many({}, pipeline)
+    collection.update_many(match or {}, pipeline)
 
 
-def normalize_works_authors_ranking_empty_list(collection) -> None:
+def normalize_works_authors_ranking_empty_list(collection, match=None) -> None:
     """
     Function to replace null authors ranking with empty list in works
 
@@ -1232,6 +1297,8 @@ def normalize_works_authors_ranking_empty_list(collection) -> None:
     ----------
     collection : pymongo.collection.Collection
         Collection where the works are stored
+    match : dict, optional
+        Filter of the documents to process, None to process the whole collection
     """
     pipeline = [
         {
@@ -1266,12 +1333,12 @@ def normalize_works_authors_ranking_empty_list(collection) -> None:
     ]
 
     collection.update_many(
-        {"authors.ranking": None},
+        and_match({"authors.ranking": None}, match),
         pipeline,
     )
 
 
-def set_affiliations_citations_count_openalex(collection) -> None:
+def set_affiliations_citations_count_openalex(collection, match=None) -> None:
     """
     Function to set the OpenAlex citations count in affiliations
 
@@ -1279,6 +1346,8 @@ def set_affiliations_citations_count_openalex(collection) -> None:
     ----------
     collection : pymongo.collection.Collection
         Collection where the affiliations are stored
+    match : dict, optional
+        Filter of the documents to process, None to process the whole collection
     """
     pipeline = [
         {
@@ -1311,10 +1380,10 @@ def set_affiliations_citations_count_openalex(collection) -> None:
         }
     ]
 
-    collection.update_many({}, pipeline)
+    collection.update_many(match or {}, pipeline)
 
 
-def set_sources_products_count(collection) -> None:
+def set_sources_products_count(collection, match=None) -> None:
     """
     Function to set products count in sources from works
 
@@ -1322,6 +1391,8 @@ def set_sources_products_count(collection) -> None:
     ----------
     collection : pymongo.collection.Collection
         Sources collection
+    match : dict, optional
+        Filter of the documents to process, None to process the whole collection
     """
     pipeline = [
         {
@@ -1340,10 +1411,10 @@ def set_sources_products_count(collection) -> None:
         },
     ]
 
-    collection.aggregate(pipeline)
+    collection.aggregate(match_stage(match) + pipeline)
 
 
-def normalize_sources_products_count(collection) -> None:
+def normalize_sources_products_count(collection, match=None) -> None:
     """
     Function to set default products_count to 0 in sources
 
@@ -1351,14 +1422,16 @@ def normalize_sources_products_count(collection) -> None:
     ----------
     collection : pymongo.collection.Collection
         Sources collection
+    match : dict, optional
+        Filter of the documents to process, None to process the whole collection
     """
     collection.update_many(
-        {"products_count": {"$exists": False}},
+        and_match({"products_count": {"$exists": False}}, match),
         {"$set": {"products_count": 0}},
     )
 
 
-def set_sources_citations_count_openalex(collection) -> None:
+def set_sources_citations_count_openalex(collection, match=None) -> None:
     """
     Function to set total OpenAlex citations count in sources
 
@@ -1366,6 +1439,8 @@ def set_sources_citations_count_openalex(collection) -> None:
     ----------
     collection : pymongo.collection.Collection
         Sources collection
+    match : dict, optional
+        Filter of the documents to process, None to process the whole collection
     """
     pipeline = [
         {
@@ -1416,10 +1491,10 @@ def set_sources_citations_count_openalex(collection) -> None:
         },
     ]
 
-    collection.aggregate(pipeline)
+    collection.aggregate(match_stage(match) + pipeline)
 
 
-def normalize_sources_citations_count(collection) -> None:
+def normalize_sources_citations_count(collection, match=None) -> None:
     """
     Function to set default OpenAlex citations_count in sources
 
@@ -1427,9 +1502,11 @@ def normalize_sources_citations_count(collection) -> None:
     ----------
     collection : pymongo.collection.Collection
         Sources collection
+    match : dict, optional
+        Filter of the documents to process, None to process the whole collection
     """
     collection.update_many(
-        {"citations_count": {"$exists": False}},
+        and_match({"citations_count": {"$exists": False}}, match),
         {
             "$set": {
                 "citations_count": [
@@ -1443,7 +1520,7 @@ def normalize_sources_citations_count(collection) -> None:
     )
 
 
-def clean_person_empty_affiliations_array(collection) -> None:
+def clean_person_empty_affiliations_array(collection, match=None) -> None:
     """
     Function to replace affiliations equal to [{}]
     with an empty list in person collection
@@ -1452,14 +1529,16 @@ def clean_person_empty_affiliations_array(collection) -> None:
     ----------
     collection : pymongo.collection.Collection
         Collection where the persons are stored
+    match : dict, optional
+        Filter of the documents to process, None to process the whole collection
     """
     collection.update_many(
-        {"affiliations": [{}]},
+        and_match({"affiliations": [{}]}, match),
         {"$set": {"affiliations": []}},
     )
 
 
-def normalize_source_apc_usd(collection) -> None:
+def normalize_source_apc_usd(collection, match=None) -> None:
     """
     Function to normalize APC charges to USD in the sources collection.
 
@@ -1470,8 +1549,10 @@ def normalize_source_apc_usd(collection) -> None:
     ----------
     collection : pymongo.collection.Collection
         Sources collection where APC information is stored.
+    match : dict, optional
+        Filter of the documents to process, None to process the whole collection
     """
-    collection.aggregate([
+    collection.aggregate(match_stage(match) + [
         {
             "$addFields": {
                 "apc.apc_usd": {
@@ -1936,7 +2017,7 @@ def normalize_source_apc_usd(collection) -> None:
     ])
 
 
-def normalize_source_scimago_best_quartile(collection) -> None:
+def normalize_source_scimago_best_quartile(collection, match=None) -> None:
     """
     Function to normalize the Scimago Best Quartile ranking for sources.
 
@@ -1949,8 +2030,10 @@ def normalize_source_scimago_best_quartile(collection) -> None:
     ----------
     collection : pymongo.collection.Collection
         Collection where the sources are stored.
+    match : dict, optional
+        Filter of the documents to process, None to process the whole collection
     """
-    collection.aggregate([
+    collection.aggregate(match_stage(match) + [
         {
             "$project": {
                 "_id": 1,
@@ -2036,7 +2119,7 @@ def normalize_source_scimago_best_quartile(collection) -> None:
     ], allowDiskUse=True)
 
 
-def normalize_source_open_access_status(collection) -> None:
+def normalize_source_open_access_status(collection, match=None) -> None:
     """
     Function to categorize sources as diamond, gold, hybrid, or closed based on
     open access start year and APC charges, and store this status on the source.
@@ -2045,8 +2128,10 @@ def normalize_source_open_access_status(collection) -> None:
     ----------
     collection : pymongo.collection.Collection
         Collection where the sources are stored
+    match : dict, optional
+        Filter of the documents to process, None to process the whole collection
     """
-    collection.aggregate([
+    collection.aggregate(match_stage(match) + [
         {
             "$project": {
                 "_id": 1,
@@ -2197,9 +2282,9 @@ def normalize_source_open_access_status(collection) -> None:
     ], allowDiskUse=True)
 
 
-def normalize_source_topics(collection) -> None:
+def normalize_source_topics(collection, match=None) -> None:
     collection.aggregate(
-        [
+        match_stage(match) + [
             {
                 "$project": {
                     "_id": 1,
@@ -2369,19 +2454,121 @@ DENORMALIZATION_PIPELINES = {
 }
 
 
-def denormalize(db):
+def changed_ids(collection, since):
+    """
+    Function to get the ids of the documents updated after a time
+
+    Parameters
+    ----------
+    collection : pymongo.collection.Collection
+        Collection where the documents are stored
+    since : int
+        Unix time of the last denormalization
+
+    Returns
+    -------
+    list
+        Ids of the documents with an updated time greater than since
+    """
+    return [reg["_id"] for reg in collection.find({"updated.time": {"$gt": since}}, {"_id": 1})]
+
+
+def get_incremental_matches(db, since, max_ids=100000):
+    """
+    Function to get the filters of the documents affected by the changes since the last denormalization.
+
+    The changed documents are found with the updated.time field, then the works of the changed
+    persons, affiliations (including groups) and sources, the persons of the changed affiliations
+    and the sources of the affected works are added as dependents.
+    If a collection has more than max_ids affected documents it is processed completely.
+
+    Parameters
+    ----------
+    db : pymongo.database.Database
+        Database object to denormalize
+    since : int
+        Unix time of the last denormalization
+    max_ids : int
+        Maximum number of ids in a filter
+
+    Returns
+    -------
+    dict
+        Collection name to filter, None to process the whole collection
+    """
+    persons = changed_ids(db["person"], since)
+    affiliations = changed_ids(db["affiliations"], since)
+    sources = changed_ids(db["sources"], since)
+    if max(len(persons), len(affiliations), len(sources)) > max_ids:
+        return {"works": None, "person": None, "affiliations": None, "sources": None}
+
+    works_query = {"$or": [
+        {"updated.time": {"$gt": since}},
+        {"authors.id": {"$in": persons}},
+        {"authors.affiliations.id": {"$in": affiliations}},
+        {"groups.id": {"$in": affiliations}},
+        {"source.id": {"$in": sources}},
+    ]}
+    works = []
+    sources = set(sources)
+    for work in db["works"].find(works_query, {"source.id": 1}):
+        works.append(work["_id"])
+        if work.get("source", {}).get("id"):
+            sources.add(work["source"]["id"])
+    person_query = {"$or": [{"_id": {"$in": persons}},
+                            {"affiliations.id": {"$in": affiliations}}]}
+    persons = [reg["_id"]
+               for reg in db["person"].find(person_query, {"_id": 1})]
+
+    matches = {}
+    for name, ids in [("works", works), ("person", persons), ("affiliations", affiliations), ("sources", list(sources))]:
+        matches[name] = {"_id": {"$in": ids}} if len(ids) <= max_ids else None
+    return matches
+
+
+def denormalize(db, incremental=False, state_collection="denormalization", max_ids=100000):
     """
     Denormalize the data in all configured collections
 
+    In incremental mode the time of the last denormalization is saved in the state collection,
+    and the pipelines are restricted to the documents updated after it and their dependents
+    (see get_incremental_matches). The first run processes the whole collections.
+
     Parameters
     ----------
     db : pymongo.database.Database
         Database object to denormalize
+    incremental : bool
+        True to process only the documents affected by the changes since the last run
+    state_collection : str
+        Collection where the time of the last denormalization is saved
+    max_ids : int
+        Maximum number of ids in a filter, bigger changes process the whole collection
     """
+    start = int(time())
+    matches = {}
+    if incremental:
+        state = db[state_collection].find_one({"_id": "denormalization"})
+        if state:
+            print(
+                f"INFO: Denormalizing documents updated after {state['time']}")
+            matches = get_incremental_matches(db, state["time"], max_ids)
+
     for collection_name, pipelines in DENORMALIZATION_PIPELINES.items():
         collection = db[collection_name]
+        match = matches.get(collection_name)
 
-        print(f"INFO: Denormalizing data in {collection_name}")
+        if match:
+            print(
+                f"INFO: Denormalizing {len(match['_id']['$in'])} documents in {collection_name}")
+        else:
+            print(f"INFO: Denormalizing data in {collection_name}")
 
+        if match and not match["_id"]["$in"]:
+            continue
         for pipeline_func in pipelines:
-            pipeline_func(collection)
+            pipeline_func(collection, match)
+
+    if incremental:
+        db[state_collection].update_one(
+            {"_id": "denormalization"}, {"$set": {"time": start}}, upsert=True)
@@ -0,0 +1,292 @@
+from math import log, exp
+from pymongo import UpdateOne
+from time import time
+
+
+def load_coauthorship_index(db_in, net, author_count, verbose=0):
+    """
+    Function to read the works collection once and build the sparse structure used to create
+    the coauthorship networks of every affiliation or author.
+
+    Every work is kept as a tuple with the affiliations (or authors) ids in the order they
+    appear in the work, and every id is mapped to the list of works where it appears.
+
+    Parameters:
+    ----------
+    db_in : pymongo.database.Database (kahi dabatabase)
+        The database where the information is stored.
+    net : str
+        The network type, either affiliations or person.
+    author_count : int
+        The maximum number of authors in a work to consider.
+    verbose : int
+        The verbosity level.
+
+    Returns:
+        dict: with the keys works (list of tuples of ids), node_works (id -> list of works positions)
+        and labels (id -> first name found for the id).
+    """
+    if net == "affiliations":
+        projection = {"authors.affiliations.id": 1,
+                      "authors.affiliations.name": 1}
+    else:
+        projection = {"authors.id": 1, "authors.full_name": 1}
+    works = []
+    node_works = {}
+    labels = {}
+    start = time()
+    for work in db_in["works"].find({"author_count": {"$lte": author_count}}, projection, batch_size=10000):
+        nodes = []
+        for author in work.get("authors", []):
+            if net == "affiliations":
+                for aff in author.get("affiliations", []):
+                    nodes.append(aff.get("id"))
+                    if aff.get("id") and aff["id"] not in labels:
+                        labels[aff["id"]] = aff.get("name")
+            else:
+                nodes.append(author.get("id"))
+                if author.get("id") and author["id"] not in labels:
+                    labels[author["id"]] = author.get("full_name")
+        position = len(works)
+        works.append(tuple(nodes))
+        for node in set(nodes):
+            if not node:
+                continue
+            if node in node_works:
+                node_works[node].append(position)
+            else:
+                node_works[node] = [position]
+    if verbose > 0:
+        print(
+            f"INFO: {len(works)} works with {len(node_works)} {net} loaded for networks in {time() - start:.0f}s")
+    return {"works": works, "node_works": node_works, "labels": labels}
+
+
+def ego_network(index, idx, label):
+    """
+    Function to create the coauthorship network of an affiliation or author from the index
+    built by load_coauthorship_index.
+
+    The network has the same nodes and edges that the query based algorithm:
+    the edges of idx count the works where idx and the node appear together, and the edges
+    between the other nodes are counted over the works of each node where idx does not appear.
+
+    Parameters:
+    ----------
+    index : dict
+        The output of load_coauthorship_index.
+    idx : str
+        The affiliation or author identifier.
+    label : str
+        The name of the affiliation or author.
+
+    Returns:
+        tuple: nodes, nodes_labels, edges and edges_coauthorships (edge -> count)
+    """
+    works = index["works"]
+    nodes = [idx]
+    nodes_set = {idx}
+    nodes_labels = [label]
+    edges = []
+    edges_coauthorships = {}
+    for position in index["node_works"].get(idx, []):
+        work_nodes = set()
+        for node in works[position]:
+            if not node or node == idx:
+                continue
+            if node not in nodes_set:
+                nodes.append(node)
+                nodes_set.add(node)
+                nodes_labels.append(index["labels"].get(node))
+            if node not in work_nodes:
+                work_nodes.add(node)
+                if (idx, node) in edges_coauthorships:
+                    edges_coauthorships[(idx, node)] += 1
+                else:
+                    edges_coauthorships[(idx, node)] = 1
+                    edges.append((idx, node))
+    # adding the connections between the coauthoring nodes
+    for node in nodes[1:]:
+        for position in index["node_works"].get(node, []):
+            work = works[position]
+            if idx in work:
+                continue
+            for other in work:
+                if other == node or other not in nodes_set:
+                    continue
+                if (node, other) in edges_coauthorships:
+                    edges_coauthorships[(node, other)] += 1
+                elif (other, node) in edges_coauthorships:
+                    edges_coauthorships[(other, node)] += 1
+                else:
+                    edges_coauthorships[(node, other)] = 1
+                    edges.append((node, other))
+    return nodes, nodes_labels, edges, edges_coauthorships
+
+
+def format_network(nodes, nodes_labels, edges, edges_coauthorships):
+    """
+    Function to compute the degree and size of the nodes and the size of the edges
+    in the format saved in the database.
+
+    Parameters:
+    ----------
+    nodes : list
+        The nodes of the network.
+    nodes_labels : list
+        The labels of the nodes.
+    edges : list
+        The edges of the network as tuples of nodes.
+    edges_coauthorships : dict
+        The number of coauthorships of every edge.
+
+    Returns:
+        tuple: nodes and edges in database format.
+    """
+    num_nodes = len(nodes)
+    degrees = {}
+    for nodea, nodeb in edges:
+        degrees[nodea] = degrees.get(nodea, 0) + 1
+        degrees[nodeb] = degrees.get(nodeb, 0) + 1
+    nodes_db = []
+    for i, node in enumerate(nodes):
+        degree = degrees.get(node, 0)
+        size = 50 * log(1 + degree / (num_nodes - 1),
+                        2) if num_nodes > 1 else 1
+        nodes_db.append(
+            {
+                "id": str(node),
+                "label": nodes_labels[i],
+                "degree": degree,
+                "size": size
+            }
+        )
+    edges_db = []
+    for nodea, nodeb in edges:
+        coauthorships = edges_coauthorships.get((nodea, nodeb), 0)
+        edges_db.append({
+            "source": str(nodea),
+            "target": str(nodeb),
+            "coauthorships": coauthorships,
+            "size": coauthorships,
+        })
+    top = max([e["coauthorships"]
+              for e in edges_db]) if len(edges_db) > 0 else 1
+    bot = min([e["coauthorships"]
+              for e in edges_db]) if len(edges_db) > 0 else 1
+    for edge in edges_db:
+        if abs(top - edge["coauthorships"]) < 0.01:
+            edge["size"] = 10
+        elif abs(bot - edge["coauthorships"]) < 0.01:
+            edge["size"] = 1
+        else:
+            size = 10 / (1 + exp(6 - 10 * edge["coauthorships"] / top))
+            edge["size"] = size if size >= 1 else 1
+    return nodes_db, edges_db
+
+
+def network_operations(idx, net, nodes_db, edges_db):
+    """
+    Function to build the write operations of a network.
+    The affiliations networks are split in two documents (affiliations and affiliations_edges)
+    to avoid the size limit of MongoDB documents.
+
+    Returns:
+        dict: collection name -> list of UpdateOne operations.
+    """
+    if net == "affiliations":
+        nedges = int(len(edges_db) / 2)
+        return {
+            "affiliations": [UpdateOne({"_id": idx}, {"$set": {"coauthorship_network": {
+                "nodes": nodes_db, "edges": edges_db[0:nedges]}}}, upsert=True)],
+            "affiliations_edges": [UpdateOne({"_id": idx}, {"$set": {"coauthorship_network": {
+                "edges": edges_db[nedges:]}}}, upsert=True)]
+        }
+    return {"person": [UpdateOne({"_id": idx}, {"$set": {"coauthorship_network": {
+        "nodes": nodes_db, "edges": edges_db}}}, upsert=True)]}
+
+
+def write_operations(db_out, operations):
+    """
+    Function to write the operations of a batch of networks,
+    if the batch fails (ex: a document bigger than the MongoDB limit) the operations are written one by one.
+    """
+    for collection, ops in operations.items():
+        if not ops:
+            continue
+        try:
+            db_out[collection].bulk_write(ops, ordered=False)
+        except Exception:
+            for op in ops:
+                try:
+                    db_out[collection].bulk_write([op])
+                except Exception as e:
+                    print(f"too big network in {collection}", e)
+
+
+def network_creation_all(db_in, db_out, ids, author_count, net, batch_size=1000, verbose=0):
+    """
+    Function to create the coauthorship networks of all the affiliations or authors reading
+    the works collection once, the networks are written with bulk operations.
+
+    Parameters:
+    ----------
+    db_in : pymongo.database.Database (kahi dabatabase)
+        The database where the information is stored.
+    db_out : pymongo.database.Database (calculation database)
+        The database where the information will be stored.
+    ids : list
+        The affiliations or authors identifiers.
+    author_count : int
+        The maximum number of authors in a work to consider.
+    net : str
+        The network type, either affiliations or person.
+    batch_size : int
+        The number of networks per bulk write.
+    verbose : int
+        The verbosity level.
+    """
+    if net not in ["affiliations", "person"]:
+        print("ERROR: Invalid network type options are affiliations or authors")
+        return
+    already = set(reg["_id"] for reg in db_out[net].find(
+        {"coauthorship_network": {"$exists": True}}, {"_id": 1}))
+    ids = [idx for idx in ids if idx not in already]
+    if not ids:
+        return
+
+    labels = {}
+    if net == "affiliations":
+        for aff in db_in["affiliations"].find({"_id": {"$in": ids}}, {"names": 1}):
+            name = aff["names"][0]["name"]
+            for n in aff["names"]:
+                if n["lang"] == "es":
+                    name = n["name"]
+                    break
+                elif n["lang"] == "en":
+                    name = n["name"]
+            labels[aff["_id"]] = name
+    else:
+        for author in db_in["person"].find({"_id": {"$in": ids}}, {"full_name": 1}):
+            labels[author["_id"]] = author["full_name"]
+
+    index = load_coauthorship_index(db_in, net, author_count, verbose)
+    operations = {}
+    start = time()
+    for i, idx in enumerate(ids):
+        nodes, nodes_labels, edges, edges_coauthorships = ego_network(
+            index, idx, labels.get(idx))
+        nodes_db, edges_db = format_network(
+            nodes, nodes_labels, edges, edges_coauthorships)
+        for collection, ops in network_operations(idx, net, nodes_db, edges_db).items():
+            operations.setdefault(collection, []).extend(ops)
+        if (i + 1) % batch_size == 0:
+            write_operations(db_out, operations)
+            operations = {}
+            if verbose > 4:
+                print(
+                    f"INFO: {i + 1} of {len(ids)} {net} networks created in {time() - start:.0f}s")
+    write_operations(db_out, operations)
+    if verbose > 0:
+        print(
+            f"INFO: {len(ids)} {net} networks created in {time() - start:.0f}s")
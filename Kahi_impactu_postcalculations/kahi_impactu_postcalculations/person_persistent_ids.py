@@ -1,35 +1,57 @@
+from pymongo import InsertOne, UpdateOne
+from time import time
 import sys
 
 
-def process_person_id(client, person_col, works_col, person, source):
+def get_person_pid(person, source):
     """
-    Process the person ID based on the source and update the MongoDB collection.
+    Get the persistent id of a person from the given source.
     Parameters:
     ---------
-    client: MongoDB client
-    person_col: MongoDB collection for person
-    works_col: MongoDB collection for works
     person: dict
-        The person document to process
+        The person document
     source: str
         The source of the person ID (e.g., "mongodb_id", "scienti", etc.)
+    Returns:
+    -------
+    str
+        The persistent id or None if it is not available
     """
-
-    original_id = person["_id"]
     pid = None  # person id
 
     if source == "mongodb_id":
-        pid = str(original_id)
+        pid = str(person["_id"])
     else:
         for ext_id in person.get("external_ids", []):
             if ext_id.get("source") == source:
                 pid = ext_id.get("id", {})
                 break
+    if pid is None:
+        return None
     if source == "scienti":
         # Si el source es 'scienti', buscar COD_RH en el campo 'id'
         pid = pid.get("COD_RH", None)
     else:
         pid = pid.split("/")[-1].replace("-", "").split("=")[-1]
+    return pid
+
+
+def process_person_id(client, person_col, works_col, person, source):
+    """
+    Process the person ID based on the source and update the MongoDB collection.
+    Parameters:
+    ---------
+    client: MongoDB client
+    person_col: MongoDB collection for person
+    works_col: MongoDB collection for works
+    person: dict
+        The person document to process
+    source: str
+        The source of the person ID (e.g., "mongodb_id", "scienti", etc.)
+    """
+
+    original_id = person["_id"]
+    pid = get_person_pid(person, source)
 
     if not pid:
         # Si no hay COD_RH, generar ID basado en ObjectId
@@ -63,3 +85,197 @@ def process_person_id(client, person_col, works_col, person, source):
         {"$set": {"authors.$[author].id": pid}},
         array_filters=[{"author.id": original_id}],
     )
+
+
+def compute_person_ids(person_col, sources, verbose=0):
+    """
+    Compute the persistent id of every person without one in a single pass over the collection.
+    The sources are tried in priority order, when the id of a source is already taken by other person
+    the next source is used, the same as processing the sources one by one with process_person_id.
+    Parameters:
+    ---------
+    person_col: MongoDB collection for person
+    sources: list
+        The sources of the person ID in priority order
+    verbose: int
+        The verbosity level
+    Returns:
+    -------
+    dict
+        original _id -> persistent id
+    """
+    taken = set()
+    pending = []
+    for person in person_col.find({}, {"_id": 1, "_id_old": 1, "external_ids": 1}):
+        taken.add(person["_id"])
+        if "_id_old" not in person.keys():
+            pending.append(person)
+    ids_map = {}
+    for source in sources:
+        remaining = []
+        for person in pending:
+            if source != "mongodb_id" and source not in [ext.get("source") for ext in person.get("external_ids", [])]:
+                remaining.append(person)
+                continue
+            pid = get_person_pid(person, source)
+            if not pid:
+                print(
+                    "ERROR: No hay id para el documento:",
+                    person["_id"],
+                    "source:",
+                    source,
+                )
+                sys.exit(1)
+            if pid in taken:
+                print(
+                    f"Error insertando nuevo _id en person: duplicated id\n {source} {pid} {str(person['_id'])}")
+                remaining.append(person)
+                continue
+            taken.add(pid)
+            ids_map[person["_id"]] = pid
+        if verbose > 0:
+            print(
+                f"INFO: {len(pending) - len(remaining)} persistent ids from {source}")
+        pending = remaining
+    return ids_map
+
+
+def copy_indexes(source_col, target_col):
+    """
+    Create in the target collection the indexes of the source collection.
+    Parameters:
+    ---------
+    source_col: MongoDB collection with the indexes
+    target_col: MongoDB collection where the indexes are created
+    """
+    for name, info in source_col.index_information().items():
+        if name == "_id_":
+            continue
+        options = {key: value for key, value in info.items() if key not in [
+            "key", "v", "ns", "weights", "textIndexVersion"]}
+        keys = info["key"]
+        if "weights" in info.keys():
+            # text indexes are described by the weights of the fields
+            keys = [(field, "text") for field in info["weights"].keys()]
+            options["weights"] = info["weights"]
+        target_col.create_index(keys, name=name, **options)
+
+
+def rebuild_person(db, ids_map, staging_collection="person_staging", batch_size=1000, verbose=0):
+    """
+    Rebuild the person collection with the persistent ids, the documents are inserted
+    in batches into a staging collection that replaces the person collection with a rename.
+    Parameters:
+    ---------
+    db: MongoDB database
+    ids_map: dict
+        original _id -> persistent id, output of compute_person_ids
+    staging_collection: str
+        The name of the staging collection
+    batch_size: int
+        The number of documents per insert
+    verbose: int
+        The verbosity level
+    Returns:
+    -------
+    dict
+        old _id -> persistent id of all the persons with persistent id (including previous runs)
+    """
+    person_col = db["person"]
+    staging_col = db[staging_collection]
+    staging_col.drop()
+    old_ids = {}
+    ops = []
+    start = time()
+    for person in person_col.find():
+        if person["_id"] in ids_map.keys():
+            original_id = person["_id"]
+            person["_id"] = ids_map[original_id]
+            person["_id_old"] = original_id
+        if "_id_old" in person.keys():
+            old_ids[person["_id_old"]] = person["_id"]
+        ops.append(InsertOne(person))
+        if len(ops) >= batch_size:
+            staging_col.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        staging_col.bulk_write(ops, ordered=False)
+    copy_indexes(person_col, staging_col)
+    staging_col.rename("person", dropTarget=True)
+    if verbose > 0:
+        print(
+            f"INFO: person collection rebuilt with {len(ids_map)} new persistent ids in {time() - start:.0f}s")
+    return old_ids
+
+
+def update_works_authors(works_col, old_ids, batch_size=1000, verbose=0):
+    """
+    Replace the old ids of the authors of the works by the persistent ids in a single pass over the works.
+    Parameters:
+    ---------
+    works_col: MongoDB collection for works
+    old_ids: dict
+        old _id -> persistent id, output of rebuild_person
+    batch_size: int
+        The number of updates per bulk_write
+    verbose: int
+        The verbosity level
+    """
+    ops = []
+    count = 0
+    start = time()
+    for work in works_col.find({"authors.id": {"$type": "objectId"}}, {"authors.id": 1}):
+        update = {}
+        for i, author in enumerate(work.get("authors", [])):
+            if author.get("id") in old_ids.keys():
+                update[f"authors.{i}.id"] = old_ids[author["id"]]
+        if not update:
+            continue
+        ops.append(UpdateOne({"_id": work["_id"]}, {"$set": update}))
+        count += 1
+        if len(ops) >= batch_size:
+            works_col.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        works_col.bulk_write(ops, ordered=False)
+    if verbose > 0:
+        print(
+            f"INFO: authors ids updated in {count} works in {time() - start:.0f}s")
+
+
+def migrate_person_ids(db, sources, staging_collection="person_staging", batch_size=1000, verbose=0):
+    """
+    Assign the persistent ids of all the persons in one pass over each collection:
+    the ids are computed reading the person collection once, the person collection is rebuilt
+    in a staging collection and the ids of the authors are replaced reading the works collection once.
+    The works are updated even if all the persons already have persistent ids, using the _id_old of the persons,
+    then a run that failed after rebuilding the person collection is completed by the next one.
+    Parameters:
+    ---------
+    db: MongoDB database
+    sources: list
+        The sources of the person ID in priority order
+    staging_collection: str
+        The name of the staging collection
+    batch_size: int
+        The number of operations per bulk_write
+    verbose: int
+        The verbosity level
+    """
+    if staging_collection in db.list_collection_names():
+        # left by a run that failed before the rename, the person collection was not replaced
+        if verbose > 0:
+            print(
+                f"WARNING: dropping the stale staging collection {staging_collection}")
+        db[staging_collection].drop()
+    ids_map = compute_person_ids(db["person"], sources, verbose)
+    if ids_map:
+        old_ids = rebuild_person(
+            db, ids_map, staging_collection, batch_size, verbose)
+    else:
+        if verbose > 0:
+            print("INFO: all the persons have persistent ids")
+        old_ids = {person["_id_old"]: person["_id"]
+                   for person in db["person"].find({"_id_old": {"$exists": True}}, {"_id_old": 1})}
+    # the works are always updated, a previous run could fail after the person collection was rebuilt
+    update_works_authors(db["works"], old_ids, batch_size, verbose)
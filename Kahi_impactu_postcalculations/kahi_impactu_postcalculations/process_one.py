@@ -1,11 +1,16 @@
 from math import log, exp
 from pymongo import MongoClient
 from spacy import load
+from os import getpid
+import atexit
 
 # for multiprocessing have to be loaded global
 en_model = None
 es_model = None
 
+# connections of the current process for the multiprocessing backends (see get_worker_clients)
+worker_clients = {}
+
 
 def load_nlp_models():
     global en_model
@@ -16,6 +21,49 @@ def load_nlp_models():
         es_model = load('es_core_news_sm')
 
 
+def get_worker_clients(config):
+    """
+    Function to get the connections of the current process for the multiprocessing backends.
+
+    The clients are created by the first record processed in the worker
+    and reused by the next records, they are closed when the worker exits.
+
+    Parameters:
+    ----------
+    config : dict
+        The configuration dictionary.
+
+    Returns:
+        tuple: MongoClient for the kahi database and MongoClient for the impactu database.
+    """
+    pid = getpid()
+    if worker_clients.get("pid") == pid:
+        return worker_clients["client"], worker_clients["impactu_client"]
+    # the process could be forked from a process that already has clients,
+    # those connections must not be reused.
+    worker_clients.clear()
+    client = MongoClient(config["database_url"])
+    impactu_client = MongoClient(
+        config["impactu_postcalculations"]["database_url"])
+    worker_clients.update(
+        {"pid": pid, "client": client, "impactu_client": impactu_client})
+    return client, impactu_client
+
+
+def close_worker_clients():
+    """
+    Function to close the connections of the current process, registered with atexit.
+    """
+    if worker_clients.get("pid") != getpid():
+        return
+    worker_clients["client"].close()
+    worker_clients["impactu_client"].close()
+    worker_clients.clear()
+
+
+atexit.register(close_worker_clients)
+
+
 def count_works_one(db, author_id):
     """
     Count the number of works for an author.
@@ -55,12 +103,10 @@ def network_creation_process_one(config, client, impactu_client, idx, author_cou
         The backend to use for the parallel processing. "mutiprocessing" or "threading".
     """
     if backend != "threading":
-        client = MongoClient(config["database_url"])
-        db_in = client[config["database_name"]]
-        impactu_client = MongoClient(
-            config["impactu_postcalculations"]["database_url"])
-        db_out = impactu_client[config["impactu_postcalculations"]
-                                ["database_name"]]
+        client, impactu_client = get_worker_clients(config)
+    db_in = client[config["database_name"]]
+    db_out = impactu_client[config["impactu_postcalculations"]
+                            ["database_name"]]
     if net not in ["affiliations", "person"]:
         print("ERROR: Invalid network type options are affiliations or authors")
         return
@@ -70,10 +116,6 @@ def network_creation_process_one(config, client, impactu_client, idx, author_cou
     if net == "person":
         network_creation_person(db_in, db_out, idx, author_count)
 
-    if backend != "threading":
-        client.close()
-        impactu_client.close()
-
 
 def network_creation_affiliations(db_in, db_out, idx, author_count):
     """
@@ -390,12 +432,12 @@ def top_words_process_one(config, client, impactu_client, aff, stopwords, top_wo
     global en_model
     global es_model
     if backend != "threading":
-        client = MongoClient(config["database_url"])
-        db_in = client[config["database_name"]]
-        impactu_client = MongoClient(
-            config["impactu_postcalculations"]["database_url"])
-        db_out = impactu_client[config["impactu_postcalculations"]
-                                ["database_name"]]
+        client, impactu_client = get_worker_clients(config)
+        # the models are not loaded in the worker processes
+        load_nlp_models()
+    db_in = client[config["database_name"]]
+    db_out = impactu_client[config["impactu_postcalculations"]
+                            ["database_name"]]
     if top_words not in ["affiliations", "affiliations_others", "person"]:
         print(
             f'ERROR: Invalid network type options are {["affiliations", "affiliations_others", "person"]}')
@@ -409,9 +451,6 @@ def top_words_process_one(config, client, impactu_client, aff, stopwords, top_wo
             db_in, db_out, aff, es_model, en_model, stopwords)
     if top_words == "person":
         top_words_person(db_in, db_out, aff, es_model, en_model, stopwords)
-    if backend != "threading":
-        client.close()
-        impactu_client.close()
 
 
 def top_words_affiliations(db_in, db_out, aff, es_model, en_model, stopwords):
@@ -0,0 +1,158 @@
+from collections import Counter
+from joblib import Parallel, delayed
+from sys import intern
+from time import time
+
+# components not used by the lemmatizer, they are disabled in nlp.pipe
+UNUSED_COMPONENTS = ["parser", "ner", "senter", "textcat"]
+
+
+def is_top_word(lemma, stopwords):
+    """
+    Returns True if the lemma is counted as a top word (not numeric, not a stopword and at least 4 characters).
+    """
+    return not lemma.isnumeric() and lemma not in stopwords and len(lemma) >= 4
+
+
+def lemmatize_works(db_in, es_model, en_model, stopwords, batch_size=1000, verbose=0):
+    """
+    Function to lemmatize the first title of every work once, the titles are processed
+    with nlp.pipe in batches per language.
+
+    The lemmas are filtered with the same rules used for the top words
+    (numeric, stopwords and lemmas shorter than 4 characters).
+
+    Parameters:
+    ----------
+    db_in : pymongo.database.Database (kahi dabatabase)
+        The database where the information is stored.
+    es_model : spacy.lang.es.Spanish
+        The Spanish model for the NLP.
+    en_model : spacy.lang.en.English
+        The English model for the NLP.
+    stopwords : set
+        The set of stopwords to ignore.
+    batch_size : int
+        The number of titles per batch.
+    verbose : int
+        The verbosity level.
+
+    Returns:
+        dict: work _id -> tuple of lemmas.
+    """
+    lemmas = {}
+    buffers = {"es": [], "en": []}
+    models = {"es": es_model, "en": en_model}
+    start = time()
+
+    def flush(lang):
+        buffer = buffers[lang]
+        if not buffer:
+            return
+        model = models[lang]
+        disable = [name for name in UNUSED_COMPONENTS if name in model.pipe_names]
+        docs = model.pipe([title for _, title in buffer],
+                          batch_size=batch_size, disable=disable)
+        for (_id, _), doc in zip(buffer, docs):
+            lemmas[_id] = tuple(intern(token.lemma_) for token in doc
+                                if is_top_word(token.lemma_, stopwords))
+        buffers[lang] = []
+
+    for work in db_in["works"].find({"titles.title": {"$exists": 1}}, {"titles": {"$slice": 1}}, batch_size=batch_size):
+        lang = "es" if work["titles"][0]["lang"] == "es" else "en"
+        buffers[lang].append((work["_id"], work["titles"][0]["title"].lower()))
+        if len(buffers[lang]) >= batch_size:
+            flush(lang)
+    flush("es")
+    flush("en")
+    if verbose > 0:
+        print(
+            f"INFO: {len(lemmas)} titles lemmatized in {time() - start:.0f}s")
+    return lemmas
+
+
+def count_top_words(lemmas, works_ids, top=20):
+    """
+    Function to count the lemmas of the given works and return the top words.
+
+    Parameters:
+    ----------
+    lemmas : dict
+        The output of lemmatize_works.
+    works_ids : list
+        The works identifiers.
+    top : int
+        The number of words to return.
+
+    Returns:
+        list: top words in database format.
+    """
+    results = Counter()
+    for _id in works_ids:
+        results.update(lemmas.get(_id, ()))
+    topN = sorted(results.items(), key=lambda x: x[1], reverse=True)[:top]
+    return [{"name": name, "value": value} for name, value in topN]
+
+
+def top_words_entity(db_in, db_out, lemmas, idx, collection):
+    """
+    Function to get the top words for an affiliation or author from the lemmas of its works.
+
+    Parameters:
+    ----------
+    db_in : pymongo.database.Database (kahi dabatabase)
+        The database where the information is stored.
+    db_out : pymongo.database.Database (calculation database)
+        The database where the information will be stored.
+    lemmas : dict
+        The output of lemmatize_works.
+    idx : str
+        The affiliation or author identifier.
+    collection : str
+        The entity type, either affiliations or person.
+    """
+    if db_out[collection].find_one({"_id": idx, "top_words": {"$exists": 1}}, {"_id": 1}):
+        return
+    field = "authors.affiliations.id" if collection == "affiliations" else "authors.id"
+    works_ids = [work["_id"] for work in db_in["works"].find(
+        {field: idx, "titles.title": {"$exists": 1}}, {"_id": 1})]
+    db_out[collection].update_one(
+        {"_id": idx}, {"$set": {"top_words": count_top_words(lemmas, works_ids)}}, upsert=True)
+
+
+def top_words_all(db_in, db_out, ids, collection, lemmas, n_jobs=1, verbose=0):
+    """
+    Function to get the top words for all the given affiliations or authors,
+    the lemmas are shared by the threads then the titles are not processed again.
+
+    Parameters:
+    ----------
+    db_in : pymongo.database.Database (kahi dabatabase)
+        The database where the information is stored.
+    db_out : pymongo.database.Database (calculation database)
+        The database where the information will be stored.
+    ids : list
+        The affiliations or authors identifiers.
+    collection : str
+        The entity type, either affiliations or person.
+    lemmas : dict
+        The output of lemmatize_works.
+    n_jobs : int
+        The number of threads.
+    verbose : int
+        The verbosity level.
+    """
+    if collection not in ["affiliations", "person"]:
+        print("ERROR: Invalid top words type options are affiliations or person")
+        return
+    Parallel(
+        n_jobs=n_jobs,
+        verbose=10 if verbose > 0 else 0,
+        backend="threading")(
+            delayed(top_words_entity)(
+                db_in,
+                db_out,
+                lemmas,
+                idx,
+                collection
+            ) for idx in ids)
@@ -1,8 +1,39 @@
+from joblib import Parallel, delayed
+from pymongo import UpdateOne
+from requests.adapters import HTTPAdapter
+from threading import Lock
+from time import time
+from urllib3.util.retry import Retry
 import requests
 
 type_url_base = "https://openalex.org/T"
 
 
+def inference_payload(title, abstract={}, journal_name=""):
+    """
+    Method to build the payload of a work for the inference service
+
+    Parameters
+    ----------
+    title : str
+        Title of the work
+    abstract : dict, optional
+        Abstract of the work, by default {}
+    journal_name : str, optional
+        Name of the journal where the work was published, by default ""
+
+    Returns
+    -------
+    dict
+        Payload of the work
+    """
+    return {"title": title,
+            "abstract_inverted_index": abstract,
+            "inverted": True,
+            "referenced_works": [],
+            "journal_display_name": journal_name}
+
+
 def request_topic_inference(title, abstract={}, journal_name="", inference_endpoint="http://localhost:8080/invocations"):
     """
     Method to request the topic inference for a given work
@@ -25,13 +56,7 @@ def request_topic_inference(title, abstract={}, journal_name="", inference_endpo
     requests.Response
         Response of the inference service
     """
-    payload = [
-        {"title": title,
-         "abstract_inverted_index": abstract,
-         "inverted": True,
-         "referenced_works": [],
-         "journal_display_name": journal_name}
-    ]
+    payload = [inference_payload(title, abstract, journal_name)]
 
     req = requests.post(inference_endpoint, json=payload)
     return req
@@ -113,3 +138,254 @@ def process_topic(col, col_oa, work, inference_endpoint="http://localhost:8080/i
     else:
         print(
             f"ERROR: request for inference fails status code {req.status_code}\n", work)
+
+
+class TopicInferenceClient:
+    """
+    Client of the inference service that sends the works in batches over a pooled session.
+    The requests that fail with a connection error or with the status 429 or 5xx are retried with exponential backoff.
+    The latency and throughput of the requests are measured, see stats.
+
+    Parameters
+    ----------
+    inference_endpoint : str, optional
+        Endpoint of the inference service, by default "http://localhost:8080/invocations"
+    pool_size : int, optional
+        Number of connections of the pool, by default 10
+    retries : int, optional
+        Maximum number of retries of a request, by default 3
+    backoff : float, optional
+        Backoff factor of the retries in seconds, by default 1
+    timeout : float, optional
+        Timeout of the requests in seconds, by default 300
+    """
+
+    def __init__(self, inference_endpoint="http://localhost:8080/invocations", pool_size=10, retries=3, backoff=1, timeout=300):
+        self.inference_endpoint = inference_endpoint
+        self.timeout = timeout
+        retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=frozenset(["POST"]), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.lock = Lock()
+        self.start = time()
+        self.requests = 0
+        self.works = 0
+        self.errors = 0
+        self.latency = 0.0
+        self.max_latency = 0.0
+
+    def infer(self, payload):
+        """
+        Sends a batch of works to the inference service
+
+        Parameters
+        ----------
+        payload : list
+            Payloads of the works, see inference_payload
+
+        Returns
+        -------
+        list
+            The predictions of every work in the order of the payload, or None if the request fails
+        """
+        start = time()
+        try:
+            req = self.session.post(
+                self.inference_endpoint, json=payload, timeout=self.timeout)
+            status_code = req.status_code
+        except requests.exceptions.RequestException as e:
+            req = None
+            status_code = e
+        latency = time() - start
+        predictions = req.json() if req is not None and status_code == 200 else None
+        with self.lock:
+            self.requests += 1
+            self.latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            if predictions is None:
+                self.errors += 1
+            else:
+                self.works += len(payload)
+        if predictions is None:
+            print(
+                f"ERROR: request for inference of {len(payload)} works fails: {status_code}")
+        return predictions
+
+    def stats(self):
+        """
+        Returns the metrics of the requests: number of requests, works and errors,
+        mean and max latency in seconds and throughput in works per second
+        """
+        with self.lock:
+            elapsed = time() - self.start
+            return {
+                "requests": self.requests,
+                "works": self.works,
+                "errors": self.errors,
+                "mean_latency": self.latency / self.requests if self.requests else 0.0,
+                "max_latency": self.max_latency,
+                "throughput": self.works / elapsed if elapsed > 0 else 0.0
+            }
+
+    def report(self):
+        """
+        Prints the metrics of the requests
+        """
+        stats = self.stats()
+        print("INFO: topics inference of {} works in {} requests ({} errors), mean latency {:.2f}s, max latency {:.2f}s, throughput {:.1f} works/s".format(
+            stats["works"], stats["requests"], stats["errors"], stats["mean_latency"], stats["max_latency"], stats["throughput"]))
+
+    def close(self):
+        self.session.close()
+
+
+def load_openalex_topics(col_oa):
+    """
+    Loads the OpenAlex topics collection in memory
+
+    Parameters
+    ----------
+    col_oa : pymongo.collection.Collection
+        Collection of OpenAlex topics
+
+    Returns
+    -------
+    dict
+        id (URL of the topic) -> topic with the fields id, display_name, subfield, field and domain
+    """
+    return {topic["id"]: topic for topic in col_oa.find({}, {"id": 1, "display_name": 1, "subfield": 1, "field": 1, "domain": 1})}
+
+
+def get_cached_topic(topics, topic_pred):
+    """
+    Same of get_openalex_topic but the topic is taken from the topics loaded in memory
+
+    Parameters
+    ----------
+    topics : dict
+        Output of load_openalex_topics
+    topic_pred : dict
+        Prediction of the topic, with the fields topic_id and topic_score
+
+    Returns
+    -------
+    dict
+        Topic from OpenAlex with the score of the prediction
+    """
+    topic_url = type_url_base + str(topic_pred['topic_id'])
+    if topic_url in topics.keys():
+        topic = dict(topics[topic_url])
+    else:
+        topic = {"id": topic_pred['topic_id'], "display_name": "Unknown",
+                 "subfield": "Unknown", "field": "Unknown", "domain": "Unknown"}
+        print("WARNING: Topic not found predicted in inference",
+              topic_url, topic_pred)
+    topic["score"] = topic_pred["topic_score"]
+    return topic
+
+
+def process_topics_batch(col, topics, works, client):
+    """
+    Process the topic inference for a batch of works with a single request,
+    the works are updated with bulk_write.
+
+    Parameters
+    ----------
+    col : pymongo.collection.Collection
+        Collection of the works (kahi database)
+    topics : dict
+        Output of load_openalex_topics
+    works : list
+        Works to process
+    client : TopicInferenceClient
+        Client of the inference service
+
+    Returns
+    -------
+    int
+        Number of works updated
+    """
+    works = [work for work in works if len(work["abstracts"]) > 0]
+    if not works:
+        return 0
+    payload = [inference_payload(work["titles"][0]["title"], work["abstracts"][0]["abstract"],
+                                 work["source"]["name"] if work["source"] != {} else "") for work in works]
+    predictions = client.infer(payload)
+    if predictions is None:
+        return 0
+    ops = []
+    for work, topics_ids_pred in zip(works, predictions):
+        for topic_pred in topics_ids_pred:
+            topic = get_cached_topic(topics, topic_pred)
+            if work["primary_topic"] == {}:
+                work["primary_topic"] = topic
+            work["topics"].append(topic)
+        ops.append(UpdateOne({"_id": work["_id"]}, {
+                   "$set": {"primary_topic": work["primary_topic"], "topics": work["topics"]}}))
+    col.bulk_write(ops, ordered=False)
+    return len(ops)
+
+
+def batches(works, batch_size):
+    """
+    Generator of lists of batch_size works
+    """
+    batch = []
+    for work in works:
+        batch.append(work)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def process_topics_all(col, col_oa, works, inference_endpoint="http://localhost:8080/invocations", batch_size=100, n_jobs=1, verbose=0):
+    """
+    Process the topic inference for all the given works, the works are sent to the inference
+    service in batches of batch_size works by n_jobs threads sharing a pooled session,
+    the topics are taken from the OpenAlex topics loaded in memory.
+
+    Parameters
+    ----------
+    col : pymongo.collection.Collection
+        Collection of the works (kahi database)
+    col_oa : pymongo.collection.Collection
+        Collection of OpenAlex topics
+    works : iterable
+        Works to process
+    inference_endpoint : str, optional
+        Endpoint of the inference service, by default "http://localhost:8080/invocations"
+    batch_size : int, optional
+        Number of works per request, by default 100
+    n_jobs : int, optional
+        Number of threads, by default 1
+    verbose : int, optional
+        Verbosity level, by default 0
+
+    Returns
+    -------
+    dict
+        The metrics of the inference client, see TopicInferenceClient.stats
+    """
+    topics = load_openalex_topics(col_oa)
+    client = TopicInferenceClient(inference_endpoint, pool_size=n_jobs)
+    Parallel(
+        n_jobs=n_jobs,
+        verbose=10 if verbose > 0 else 0,
+        backend="threading")(
+            delayed(process_topics_batch)(
+                col,
+                topics,
+                batch,
+                client
+            ) for batch in batches(works, batch_size))
+    client.close()
+    if verbose > 0:
+        client.report()
+    return client.stats()
@@ -1,3 +1,5 @@
+from pymongo import UpdateOne
+
 
 def get_scienti_string(work):
     """
@@ -152,3 +154,129 @@ def process_type(db, work, source, types, verbose=True):
                                {"$push": {"types": impactu_type}})
     elif verbose:
         print(f"WARNING: impactu type not found for {work}")
+
+
+def get_type_string(work, source):
+    """
+    Get the string of the work types that is compared with the column Tipo of the types table
+
+    Parameters:
+    ----------
+    work: dict
+        The work from kahi with the types of the source
+    source: str
+        The source of the types ex: minciencias, scienti, ciarp, openalex, scholar
+
+    Returns:
+    -------
+    str
+        The string of the work types or None if the work does not have enough types
+    """
+    if source == "scienti":
+        return get_scienti_string(work)
+    if source == "minciencias":
+        if len(work["types"]) < 2:
+            return None
+        return work["types"][0]["type"] + ": " + work["types"][1]["type"]
+    return work["types"][0]["type"]
+
+
+def compile_types(types, sources):
+    """
+    Compile the types dataframe into a dictionary to map the types without filtering the dataframe
+
+    Parameters:
+    ----------
+    types: pandas.DataFrame
+        The impactu types
+    sources: list
+        The sources of the types ex: minciencias, scienti, ciarp, openalex, scholar
+
+    Returns:
+    -------
+    dict
+        (source, Tipo) -> list of Tipo ImpactU, the list has more than one value if the type is ambiguous
+    """
+    table = {}
+    for source in sources:
+        df_filtered = types[types["Fuente"].str.contains(
+            source, case=False, na=False)]
+        for t, impactu_type in zip(df_filtered["Tipo"], df_filtered["Tipo ImpactU"]):
+            table.setdefault((source, t), []).append(impactu_type)
+    return table
+
+
+def map_type(work, source, table, verbose=False):
+    """
+    Get the impactu type of a work from the compiled types table,
+    the result is the same of the functors used by process_type
+
+    Parameters:
+    ----------
+    work: dict
+        The work from kahi
+    source: str
+        The source of the types ex: minciencias, scienti, ciarp, openalex, scholar
+    table: dict
+        The output of compile_types
+    verbose: bool
+        If True, print warnings
+
+    Returns:
+    -------
+    dict
+        The impactu type or an empty dictionary if type is not found
+    """
+    t = get_type_string(work, source)
+    impactu_type = table.get((source, t), [])
+    if len(impactu_type) > 1 and verbose:
+        print(f"WARNING: more than one type found for {t} = {impactu_type}")
+    if len(impactu_type) == 1:
+        return {"provenance": source, "source": "impactu", "type": impactu_type[0]}
+    return {}
+
+
+def process_types_table(db, works, source, table, batch_size=1000, verbose=False):
+    """
+    Process a stream of works to get the impactu types with the compiled types table,
+    the types are pushed with bulk_write in batches
+
+    Parameters:
+    ----------
+    db: pymongo.database.Database
+        The database
+    works: iterable
+        The works from kahi with the types of the source
+    source: str
+        The source of the types ex: minciencias, scienti, ciarp, openalex, scholar
+    table: dict
+        The output of compile_types
+    batch_size: int
+        The number of operations per bulk_write
+    verbose: bool
+        If True, print warnings
+
+    Returns:
+    -------
+    tuple
+        The number of works typed and the number of works without impactu type
+    """
+    ops = []
+    typed = 0
+    missing = 0
+    for work in works:
+        impactu_type = map_type(work, source, table, verbose)
+        if impactu_type:
+            ops.append(UpdateOne({"_id": work["_id"]},
+                                 {"$push": {"types": impactu_type}}))
+            typed += 1
+        else:
+            missing += 1
+            if verbose:
+                print(f"WARNING: impactu type not found for {work}")
+        if len(ops) >= batch_size:
+            db["works"].bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        db["works"].bulk_write(ops, ordered=False)
+    return typed, missing
@@ -3,6 +3,7 @@ from pymongo import MongoClient, TEXT
 from joblib import Parallel, delayed
 from datetime import datetime as dt
 from kahi.KahiBase import KahiBase
+from kahi_minciencias_opendata_affiliations.resolver import InstitutionResolver
 from unidecode import unidecode
 from thefuzz import fuzz
 from time import time
@@ -48,6 +49,10 @@ class Kahi_minciencias_opendata_affiliations(KahiBase):
         self.verbose = config["minciencias_opendata_affiliations"][
             "verbose"] if "verbose" in config["minciencias_opendata_affiliations"].keys() else 0
 
+        self.aval_engine = config["minciencias_opendata_affiliations"][
+            "aval_engine"] if "aval_engine" in config["minciencias_opendata_affiliations"].keys() else "text"
+        self.resolver = None
+
         self.inserted_cod_grupo = []
 
         for reg in self.collection.find({"types.type": "group"}):
@@ -101,6 +106,71 @@ class Kahi_minciencias_opendata_affiliations(KahiBase):
         else:
             return name
 
+    def find_institution_by_text(self, inst_aval):
+        """
+        Finds the institution of an inst_aval with a text search over the colombian institutions.
+
+        Parameters
+        ----------
+        inst_aval : str
+            The normalized name of the institution.
+
+        Returns
+        -------
+        tuple
+            (institution, name), the institution document and its name, or (None, "") if it is not found.
+        """
+        institutions = self.collection.find(
+            {"$text": {"$search": inst_aval}, "addresses.country": "Colombia"}).limit(50)
+        institution = ""
+        score = 10
+        for inst in institutions:
+            method = ""
+            name = ""
+            for n in inst["names"]:
+                if n["lang"] == "es":
+                    name = n["name"]
+                    break
+                elif n["lang"] == "en":
+                    name = n["name"]
+            name_mod = name.lower().replace("(colombia)", "").replace(
+                "(", "").replace(")", "").replace("bogotá", "")
+            # name_mod=name_mod.replace("universidad","").replace("de","").replace("del","").replace("los","").strip()
+            name_mod = unidecode(name_mod)
+
+            if "santander" in name_mod and "industrial" in name_mod:
+                name_mod = "industrial santander"
+            if "santander" in name_mod and "industrial" not in name_mod:
+                name_mod = "universidad santander"
+            if "francisco" in name_mod and "paula" in name_mod and "santander" in name_mod:
+                inst_aval = "francisco paula"
+            score = fuzz.ratio(name_mod, inst_aval)
+            if score > 90:
+                method = "ratio"
+                institution = inst
+                break
+            elif score > 39:
+                score = fuzz.partial_ratio(name_mod, inst_aval)
+                # print("Partial ratio score: {}. {} -against- {}".format(score,name,reg["INST_AVAL"]))
+                if score > 93:
+                    method = "partial ratio"
+                    institution = inst
+                    break
+                elif score > 55:
+                    score = fuzz.token_set_ratio(name_mod, inst_aval)
+                    # print("Token set ratio score: {}. {} -against- {}".format(score,name,reg["INST_AVAL"]))
+                    if score > 98:
+                        method = "token set ratio"
+                        # print("Token set ratio score: {}. {} -against- {}".format(score,name,inst_aval))
+                        institution = inst
+                        break
+        if institution == "":
+            if score == 98 and method == "token set ratio":
+                print(
+                    "(LAST) {} score: {}. {} -against- {}".format(method, score, name, inst_aval))
+            return None, ""
+        return institution, name
+
     def process_one(self, reg, collection, empty_affiliation, verbose):
         if "cod_grupo_gr" not in reg.keys() or not reg["cod_grupo_gr"]:
             return
@@ -190,58 +260,12 @@ class Kahi_minciencias_opendata_affiliations(KahiBase):
                     inst_aval = self.rename_institution(inst_aval)
 
                     inst_aval = unidecode(inst_aval)
-                    institutions = self.collection.find(
-                        {"$text": {"$search": inst_aval}, "addresses.country": "Colombia"}).limit(50)
-                    institution = ""
-                    score = 10
-                    for inst in institutions:
-                        method = ""
-                        name = ""
-                        for n in inst["names"]:
-                            if n["lang"] == "es":
-                                name = n["name"]
-                                break
-                            elif n["lang"] == "en":
-                                name = n["name"]
-                        name_mod = name.lower().replace("(colombia)", "").replace(
-                            "(", "").replace(")", "").replace("bogotá", "")
-                        # name_mod=name_mod.replace("universidad","").replace("de","").replace("del","").replace("los","").strip()
-                        name_mod = unidecode(name_mod)
-
-                        if "santander" in name_mod and "industrial" in name_mod:
-                            name_mod = "industrial santander"
-                        if "santander" in name_mod and "industrial" not in name_mod:
-                            name_mod = "universidad santander"
-                        if "francisco" in name_mod and "paula" in name_mod and "santander" in name_mod:
-                            inst_aval = "francisco paula"
-                        score = fuzz.ratio(name_mod, inst_aval)
-                        if score > 90:
-                            method = "ratio"
-                            institution = inst
-                            break
-                        elif score > 39:
-                            score = fuzz.partial_ratio(name_mod, inst_aval)
-                            # print("Partial ratio score: {}. {} -against- {}".format(score,name,reg["INST_AVAL"]))
-                            if score > 93:
-                                method = "partial ratio"
-                                institution = inst
-                                break
-                            elif score > 55:
-                                score = fuzz.token_set_ratio(name_mod, inst_aval)
-                                # print("Token set ratio score: {}. {} -against- {}".format(score,name,reg["INST_AVAL"]))
-                                if score > 98:
-                                    method = "token set ratio"
-                                    # print("Token set ratio score: {}. {} -against- {}".format(score,name,inst_aval))
-                                    institution = inst
-                                    break
-                    if institution != "":
-                        name = ""
-                        for n in inst["names"]:
-                            if n["lang"] == "es":
-                                name = n["name"]
-                                break
-                            elif n["lang"] == "en":
-                                name = n["name"]
+                    if self.resolver:
+                        institution, name = self.resolver.resolve(inst_aval)
+                    else:
+                        institution, name = self.find_institution_by_text(
+                            inst_aval)
+                    if institution:
                         entry["relations"].append(
                             {"types": institution["types"], "id": institution["_id"], "name": name})
                         entry["addresses"].append({
@@ -254,9 +278,6 @@ class Kahi_minciencias_opendata_affiliations(KahiBase):
                             "country_code": institution["addresses"][0].get("country_code", None)
                         })
                     else:
-                        if score == 98 and method == "token set ratio":
-                            print(
-                                "(LAST) {} score: {}. {} -against- {}".format(method, score, name, inst_aval))
                         entry["addresses"].append({
                             "lat": "",
                             "lng": "",
@@ -281,6 +302,9 @@ class Kahi_minciencias_opendata_affiliations(KahiBase):
                 print("Inserted group {}".format(idgr))
 
     def process_openadata(self):
+        if self.aval_engine == "resolver":
+            self.resolver = InstitutionResolver(
+                self.collection, verbose=self.verbose)
         # Pipeline to find duplicate documents and keep the one with the highest edad_anos_gr in each group
         pipeline = [
             {
@@ -0,0 +1,126 @@
+from threading import Lock
+from rapidfuzz import fuzz, process
+from rapidfuzz.utils import default_process
+from unidecode import unidecode
+import numpy as np
+
+
+def institution_name(inst):
+    """
+    Returns the spanish name of the institution, or the english one if there is not spanish name.
+    """
+    name = ""
+    for n in inst["names"]:
+        if n["lang"] == "es":
+            name = n["name"]
+            break
+        elif n["lang"] == "en":
+            name = n["name"]
+    return name
+
+
+def normalize_institution_name(name):
+    """
+    Returns the name of the institution cleaned to be compared with the inst_aval of the groups.
+    """
+    name_mod = name.lower().replace("(colombia)", "").replace(
+        "(", "").replace(")", "").replace("bogotá", "")
+    name_mod = unidecode(name_mod)
+    if "santander" in name_mod and "industrial" in name_mod:
+        name_mod = "industrial santander"
+    if "santander" in name_mod and "industrial" not in name_mod:
+        name_mod = "universidad santander"
+    return name_mod
+
+
+class InstitutionResolver:
+    """
+    Resolver of the institutions (inst_aval) of the minciencias groups.
+
+    The names of the colombian institutions are normalized once, every inst_aval is matched against all of them
+    with the thresholds of the text search (ratio > 90, or ratio > 39 and partial_ratio > 93,
+    or partial_ratio > 55 and token_set_ratio > 98) and the results are memoized by inst_aval.
+
+    Parameters
+    ----------
+    collection : pymongo.collection.Collection
+        Collection of affiliations.
+    verbose : int, optional
+        Verbosity level. The default is 0.
+    """
+
+    def __init__(self, collection, verbose=0):
+        self.verbose = verbose
+        self.institutions = []
+        self.names = []
+        self.choices = []
+        # the groups are not institutions that endorse other groups
+        for inst in collection.find({"addresses.country": "Colombia", "types.type": {"$ne": "group"}},
+                                    {"names": 1, "types": 1, "addresses": 1}):
+            self.institutions.append(inst)
+            self.names.append(institution_name(inst))
+            self.choices.append(normalize_institution_name(self.names[-1]))
+        self.lock = Lock()
+        self.cache = {}
+        if self.verbose > 0:
+            print(
+                f"INFO: {len(self.institutions)} colombian institutions loaded in the resolver")
+
+    def match(self, inst_aval):
+        """
+        Returns the position of the institution that matches the inst_aval or None.
+        """
+        if not self.choices:
+            return None
+        # thefuzz rounds the scores (half to even), the best score passes the cutoff only if its rounded value does
+        result = process.extractOne(
+            inst_aval, self.choices, scorer=fuzz.ratio, score_cutoff=90.5)
+        if result and round(result[1]) > 90:
+            return result[2]
+        ratios = np.round(process.cdist(
+            [inst_aval], self.choices, scorer=fuzz.ratio, dtype=np.float64)[0])
+        candidates = {i: self.choices[i] for i in np.flatnonzero(ratios > 39)}
+        if not candidates:
+            return None
+        result = process.extractOne(
+            inst_aval, candidates, scorer=fuzz.partial_ratio, score_cutoff=93.5)
+        if result and round(result[1]) > 93:
+            return result[2]
+        partials = np.round(process.cdist(
+            [inst_aval], list(candidates.values()), scorer=fuzz.partial_ratio, dtype=np.float64)[0])
+        candidates = {i: choice for (i, choice), score in zip(
+            candidates.items(), partials) if score > 55}
+        if not candidates:
+            return None
+        # token_set_ratio of thefuzz processes the strings
+        result = process.extractOne(
+            inst_aval, candidates, scorer=fuzz.token_set_ratio, processor=default_process, score_cutoff=98.5)
+        if result and round(result[1]) > 98:
+            return result[2]
+        return None
+
+    def resolve(self, inst_aval):
+        """
+        Resolves a normalized inst_aval (lower case, renamed and without accents).
+
+        Parameters
+        ----------
+        inst_aval : str
+            The normalized name of the institution.
+
+        Returns
+        -------
+        tuple
+            (institution, name), the institution document and its name, or (None, "") if it is not found.
+        """
+        with self.lock:
+            if inst_aval in self.cache.keys():
+                return self.cache[inst_aval]
+        position = self.match(inst_aval)
+        result = (None, "") if position is None else (
+            self.institutions[position], self.names[position])
+        with self.lock:
+            self.cache[inst_aval] = result
+        if self.verbose > 4:
+            print(f"Resolved {inst_aval} -against- {result[1]}")
+        return result
@@ -84,6 +84,8 @@ def main():
             'kahi',
             'pymongo',
             'thefuzz',
+            'rapidfuzz',
+            'numpy',
             'unidecode'
         ],
     )
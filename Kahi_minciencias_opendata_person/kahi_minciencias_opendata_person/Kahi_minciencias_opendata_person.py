@@ -70,40 +70,74 @@ def extract_valid_dois(html: str) -> list[str]:
     return list(valid)
 
 
-def get_works_by_id(author_id, cvlac_html_dois) -> list[dict]:
+def load_cvlac_dois(collection, verbose=0) -> dict:
     """
-    Depending on stored HTML profiles, extract DOIs for an author.
+    Depending on stored HTML profiles, extract the DOIs of every profile once.
+    The profiles are read with a cursor, then only the DOIs are kept in memory.
+
+    Parameters
+    ----------
+    collection : pymongo.collection.Collection
+        The collection of the cvlac html profiles (each document must contain '_id' and 'html').
+    verbose : int
+        Verbosity level.
+
+    Returns
+    -------
+    dict
+        The valid DOIs of every profile by its '_id'.
+    """
+    cvlac_dois = {}
+    for doc in collection.find({"html": {"$exists": True}}, {"html": 1}):
+        dois = extract_valid_dois(doc["html"]) if doc["html"] else []
+        if dois:
+            cvlac_dois[doc["_id"]] = dois
+    if verbose > 4:
+        print("DOIs extracted from the html profiles of {} authors.".format(
+            len(cvlac_dois)))
+    return cvlac_dois
+
+
+def get_works_by_id(author_id, cvlac_dois) -> list[dict]:
+    """
+    Depending on stored HTML profiles, get the DOIs of an author.
 
     Parameters
     ----------
     author_id : str
-        The identifier of the author whose profile should be inspected in cvlac_html_dois.
-    cvlac_html_dois : list of dict
-        A list of documents (each must contain '_id' and 'html') representing stored profiles.
+        The identifier of the author whose profile should be inspected in cvlac_dois.
+    cvlac_dois : dict
+        The DOIs of the profiles by author identifier, see load_cvlac_dois.
 
     Returns
     -------
     list of dict
         Each dict has keys {'provenance', 'source', 'id'} corresponding to a detected valid DOI.
     """
-    for author_reg in cvlac_html_dois:
-        if author_reg["_id"] == author_id:
-            doc = author_reg
-            break
-    if not doc or 'html' not in doc:
-        return []
-    html = doc['html']
-    dois = extract_valid_dois(html)
+    dois = cvlac_dois.get(author_id, [])
     return [{'provenance': 'minciencias', 'source': 'doi', 'id': doi} for doi in dois]
 
 
-def process_info_from_works(db, author, entry, groups_production_list, cvlac_html_dois):
+def index_groups_production(groups_production_list) -> dict:
+    """
+    Depending on the groups production aggregate, index the products by author.
+
+    Parameters
+    ----------
+    groups_production_list : iterable of dict
+        Documents with the author identifier as '_id' and the list of 'products'.
+
+    Returns
+    -------
+    dict
+        The products of every author by its identifier.
+    """
+    return {prod["_id"]: prod["products"] for prod in groups_production_list}
+
+
+def process_info_from_works(db, author, entry, groups_production, cvlac_dois):
     # Works
-    papers = []
-    for prod in groups_production_list:
-        if prod["_id"] == author["id_persona_pr"]:
-            papers = prod["products"]
-            break
+    papers = groups_production.get(author["id_persona_pr"], [])
     if papers:
         groups_cod = []
         inst_cod = []
@@ -230,12 +264,12 @@ def process_info_from_works(db, author, entry, groups_production_list, cvlac_htm
 
     # Extract realted works from cvlac_html_profiles
     cvlac_works_with_dois = get_works_by_id(
-        author["id_persona_pr"], cvlac_html_dois)
+        author["id_persona_pr"], cvlac_dois)
     if cvlac_works_with_dois:
         entry["related_works"].extend(cvlac_works_with_dois)
 
 
-def process_one(author_entry, db, collection, empty_person, cvlac_profile, groups_production_list, privates, cvlac_html_dois, verbose):
+def process_one(author_entry, db, collection, empty_person, cvlac_profile, groups_production, privates, cvlac_dois, verbose):
 
     if not author_entry or not cvlac_profile:
         return
@@ -322,7 +356,7 @@ def process_one(author_entry, db, collection, empty_person, cvlac_profile, group
 
             # Affiliations and related_works
             process_info_from_works(
-                db, author, reg_db, groups_production_list, cvlac_html_dois)
+                db, author, reg_db, groups_production, cvlac_dois)
             # Update the record
             collection.update_one(
                 {"_id": reg_db["_id"]},
@@ -449,7 +483,7 @@ def process_one(author_entry, db, collection, empty_person, cvlac_profile, group
 
         # affiliations and related works
         process_info_from_works(
-            db, author, entry, groups_production_list, cvlac_html_dois)
+            db, author, entry, groups_production, cvlac_dois)
 
         # Ranking
         if "nme_clasificacion_pr" in author.keys():
@@ -557,8 +591,7 @@ class Kahi_minciencias_opendata_person(KahiBase):
         ]
         production_cursor = self.groups_production.aggregate(
             pipeline, allowDiskUse=True)
-        if production_cursor:
-            groups_production_list = list(production_cursor)
+        groups_production = index_groups_production(production_cursor)
 
         # authors not in the cvlac collection
         cvlac_data_ids = list(
@@ -575,8 +608,8 @@ class Kahi_minciencias_opendata_person(KahiBase):
         production_not_cvlac_cursor = self.groups_production.aggregate(
             pipeline, allowDiskUse=True)
 
-        # send all profiles with the cvlac html
-        cvlac_html_dois = list(self.cvlac_html_profiles.find())
+        # DOIs of all profiles with the cvlac html
+        cvlac_dois = load_cvlac_dois(self.cvlac_html_profiles, self.verbose)
 
         with MongoClient(self.mongodb_url) as client:
             db = client[self.config["database_name"]]
@@ -597,9 +630,9 @@ class Kahi_minciencias_opendata_person(KahiBase):
                     # Find the document in the cvlac_stage collection using the id_persona_pr field.
                     self.cvlac_stage.find_one(
                         {"id_persona_pr": author["_id"]}),
-                    groups_production_list,
+                    groups_production,
                     False,  # author is list of author documents
-                    cvlac_html_dois,
+                    cvlac_dois,
                     self.verbose
                 ) for author in cvlac_authors_list  # Iterate over the cvlac_authors_list
             )
@@ -619,22 +652,21 @@ class Kahi_minciencias_opendata_person(KahiBase):
                     # Find the document in the private_profiles collection using the id_persona_pr field.
                     self.private_profiles.find_one(
                         {"id_persona_pr": author}),
-                    groups_production_list,
+                    groups_production,
                     True,  # author is an author id
-                    cvlac_html_dois,
+                    cvlac_dois,
                     self.verbose
                     # Iterate over the authors_private_profile_list
                 ) for author in authors_private_profile_list
             )
             if production_not_cvlac_cursor:
-                groups_production_not_cvlac_list = list(
+                groups_production_not_cvlac = index_groups_production(
                     production_not_cvlac_cursor)
-                # Extract the id_persona_pr id from the groups_production_not_cvlac_list
-                authors_not_cvlac_ids = set(
-                    [author["_id"] for author in groups_production_not_cvlac_list])
+                # Extract the id_persona_pr id from the groups_production_not_cvlac
+                authors_not_cvlac_ids = set(groups_production_not_cvlac.keys())
                 if self.verbose > 4:
                     print("Processing {} authors not in cvlac.".format(
-                        len(groups_production_not_cvlac_list)))
+                        len(groups_production_not_cvlac)))
                 Parallel(
                     n_jobs=self.n_jobs,
                     verbose=10,
@@ -647,9 +679,9 @@ class Kahi_minciencias_opendata_person(KahiBase):
                         # Find the document in the cvlac_stage collection using the id_persona_pr field.
                         self.cvlac_stage.find_one(
                             {"id_persona_pr": author}),
-                        groups_production_not_cvlac_list,
+                        groups_production_not_cvlac,
                         True,  # author is an author id
-                        cvlac_html_dois,
+                        cvlac_dois,
                         self.verbose
                         # Iterate over the ids of the authors not in cvlac.
                     ) for author in list(authors_not_cvlac_ids)
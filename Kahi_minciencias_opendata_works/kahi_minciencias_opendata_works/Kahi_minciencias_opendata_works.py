@@ -4,6 +4,8 @@ from pymongo.errors import ConnectionFailure
 from joblib import Parallel, delayed
 from kahi_minciencias_opendata_works.process_one import process_one
 from mohan.Similarity import Similarity
+from kahi_impactu_utils.Elasticsearch import ElasticsearchSink
+from kahi_impactu_utils.Verifier import WorkVerifier
 
 
 class Kahi_minciencias_opendata_works(KahiBase):
@@ -32,6 +34,9 @@ class Kahi_minciencias_opendata_works(KahiBase):
                 - es_url: the URL for the Elasticsearch server
                 - es_user: the username for the Elasticsearch server
                 - es_password: the password for the Elasticsearch server
+                - es_bulk_size: if given, the works are indexed in Elasticsearch with _bulk requests of this size
+                - es_queue_size: the maximum number of works waiting to be indexed, default 10000
+                - es_flush_interval: the maximum number of seconds before a work is sent to Elasticsearch, default 5
         """
         self.config = config
 
@@ -72,6 +77,22 @@ class Kahi_minciencias_opendata_works(KahiBase):
         ) else 1
         self.verbose = config["minciencias_opendata_works"]["verbose"] if "verbose" in config["minciencias_opendata_works"].keys(
         ) else 0
+        if self.thresholds and len(self.thresholds) == 3:
+            self.verifier = WorkVerifier({"author_thd": self.thresholds[0], "paper_thd_low": self.thresholds[1],
+                                          "paper_thd_high": self.thresholds[2]}, verbose=self.verbose)
+        else:
+            self.verifier = WorkVerifier(verbose=self.verbose)
+
+        self.es_bulk_size = config["minciencias_opendata_works"]["es_bulk_size"] if "es_bulk_size" in config["minciencias_opendata_works"].keys(
+        ) else None
+        if self.es_handler and self.es_bulk_size:
+            self.es_handler = ElasticsearchSink(
+                self.es_handler,
+                config["minciencias_opendata_works"]["es_index"],
+                bulk_size=self.es_bulk_size,
+                queue_size=config["minciencias_opendata_works"].get("es_queue_size", 10000),
+                flush_interval=config["minciencias_opendata_works"].get("es_flush_interval", 5),
+                verbose=self.verbose)
 
         # checking if the databases and collections are available
         self.check_databases_and_collections()
@@ -142,11 +163,16 @@ class Kahi_minciencias_opendata_works(KahiBase):
                 self.es_handler,
                 insert_all=self.insert_all,
                 thresholds=self.thresholds,
-                verbose=self.verbose
+                verbose=self.verbose,
+                verifier=self.verifier
             ) for work in paper_list
         )
         client.close()
 
     def run(self):
         self.process_opendata()
+        if self.verbose > 0:
+            self.verifier.report()
+        if isinstance(self.es_handler, ElasticsearchSink):
+            self.es_handler.close()
         return 0
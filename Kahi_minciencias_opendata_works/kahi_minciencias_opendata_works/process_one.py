@@ -1,7 +1,7 @@
 from kahi_minciencias_opendata_works.parser import parse_minciencias_opendata
+from kahi_impactu_utils.Verifier import WorkVerifier
 from kahi_impactu_utils.Utils import compare_author
-from thefuzz import process, fuzz
-from unidecode import unidecode
+from thefuzz import process
 from time import time
 from bson import ObjectId
 from re import search, sub
@@ -403,37 +403,7 @@ def process_one_insert(openadata_reg, db, collection, empty_work, es_handler, ve
             print("No elasticsearch index provided")
 
 
-def str_normilize(word):
-    return unidecode(word).lower().strip().replace(".", "")
-
-
-def check_work(title_work, authors, response, thresholds):
-    author_found = False
-    if authors:
-        if authors[0] != "":
-            _authors = []
-            for author in response["_source"]["authors"]:
-                _authors.append(str_normilize(author))
-            scores = process.extract(str_normilize(
-                authors[0]), _authors, scorer=fuzz.partial_ratio)
-            for score in scores:
-                if score[1] >= thresholds["author_thd"]:
-                    author_found = True
-                    break
-    es_title = response["_source"]["title"]
-    if es_title:
-        score = fuzz.ratio(str_normilize(title_work),
-                           str_normilize(es_title))
-        if author_found:
-            if score >= thresholds["paper_thd_low"]:
-                return True
-        else:
-            if score >= thresholds["paper_thd_high"]:
-                return True
-    return False
-
-
-def process_one(openadata_reg, db, collection, empty_work, es_handler, insert_all, thresholds, verbose=0):
+def process_one(openadata_reg, db, collection, empty_work, es_handler, insert_all, thresholds, verbose=0, verifier=None):
     """
     Function to process a single register from the minciencias opendata database.
     This function is used to insert or update a register in the colav(kahi works) database.
@@ -456,6 +426,8 @@ def process_one(openadata_reg, db, collection, empty_work, es_handler, insert_al
         List with the thresholds for the similarity functions.
     verbose : int, optional
         Verbosity level. The default is 0.
+    verifier : WorkVerifier, optional
+        Verifier of the elasticsearch hits shared by the workers, if None one is created with the thresholds.
     """
     # type id verification
     if "id_producto_pd" in openadata_reg.keys():
@@ -487,6 +459,8 @@ def process_one(openadata_reg, db, collection, empty_work, es_handler, insert_al
                 print("Invalid thresholds values provided, using default values")
             thresholds = {"author_thd": 65,
                           "paper_thd_low": 90, "paper_thd_high": 95}
+        if verifier is None:
+            verifier = WorkVerifier(thresholds, verbose=verbose)
 
         authors = []
         title_work = ""
@@ -516,20 +490,15 @@ def process_one(openadata_reg, db, collection, empty_work, es_handler, insert_al
                 hits=20
             )
             if responses:
-                for response in responses:
-                    out = check_work(title_work, authors, response, thresholds)
-                    if out:
-                        colav_reg = collection.find_one(
-                            {"_id": ObjectId(response["_id"])})
-                        if colav_reg:
-                            process_one_update(
-                                openadata_reg, colav_reg, db, collection, empty_work, verbose)
-                            return
-                        else:
-                            if verbose > 4:
-                                print("Register with {} not found in mongodb".format(
-                                    response["_id"]))
-                            return
+                found, colav_reg = verifier.find_match(
+                    collection, title_work, authors, responses)
+                if colav_reg:
+                    process_one_update(
+                        openadata_reg, colav_reg, db, collection, empty_work, verbose)
+                    return
+                if found:
+                    # the matched works are not in mongodb
+                    return
                 # Work not found
                 if insert_all:
                     process_one_insert(
@@ -567,7 +536,7 @@ def process_one(openadata_reg, db, collection, empty_work, es_handler, insert_al
                     else:
                         if verbose > 4:
                             print("Register with {} not found in mongodb".format(
-                                response["_id"]))
+                                es_work["_id"]))
                         return
 
             if insert_all:
@@ -262,9 +262,76 @@ class Kahi_openalex_person(KahiBase):
         ) else 1
         self.verbose = config["openalex_person"]["verbose"] if "verbose" in config["openalex_person"].keys(
         ) else 0
+        self.prefetch = config["openalex_person"]["prefetch"] if "prefetch" in config["openalex_person"].keys(
+        ) else False
+        self.prefetch_collection_name = config["openalex_person"]["prefetch_collection"] if "prefetch_collection" in config["openalex_person"].keys(
+        ) else "authors_related_works"
 
         self.client.close()
 
+    def prefetch_related_works(self):
+        """
+        Writes the related works of all the authors to a temporary collection of the openalex database
+        reading the works collection once, one document per authorship keyed by the author id.
+        """
+        if self.verbose > 0:
+            print("INFO: Prefetching related works in {}".format(
+                self.prefetch_collection_name))
+        start = time()
+        self.openalex_collection_works.aggregate(
+            [{"$project": {"ids": 1, "publication_year": 1, "authorships.author.id": 1, "authorships.institutions": 1}},
+             {"$unwind": "$authorships"},
+             {"$match": {"authorships.author.id": {"$type": "string"}}},
+             {"$project": {"_id": 0, "author_id": "$authorships.author.id", "ids": 1, "publication_year": 1,
+                           "authorships": {"institutions": "$authorships.institutions"}}},
+             {"$out": self.prefetch_collection_name}],
+            allowDiskUse=True)
+        self.openalex_db[self.prefetch_collection_name].create_index(
+            "author_id")
+        if self.verbose > 0:
+            print("INFO: Related works prefetched in {:.0f}s".format(
+                time() - start))
+
+    def authors_with_related_works(self):
+        """
+        Generator of the authors with their related works, the authors and the prefetched
+        related works are read sorted by author id and joined while streaming.
+        """
+        author_cursor = self.openalex_collection.find(
+            no_cursor_timeout=True).sort("id", 1)
+        related_cursor = self.openalex_db[self.prefetch_collection_name].find(
+            {}, {"_id": 0}, no_cursor_timeout=True).sort("author_id", 1)
+        related = next(related_cursor, None)
+        for author in author_cursor:
+            related_works = []
+            while related is not None and related["author_id"] < author["id"]:
+                related = next(related_cursor, None)
+            while related is not None and related["author_id"] == author["id"]:
+                related_works.append(related)
+                related = next(related_cursor, None)
+            yield author, related_works
+        author_cursor.close()
+        related_cursor.close()
+
+    def process_openalex_prefetch(self):
+        self.openalex_collection.create_index("id")
+        self.prefetch_related_works()
+        client = MongoClient(self.mongodb_url)
+        Parallel(
+            n_jobs=self.n_jobs,
+            verbose=self.verbose,
+            backend="threading")(
+            delayed(process_one)(
+                author,
+                client,
+                self.config["database_name"],
+                self.empty_person(),
+                related_works
+            ) for author, related_works in self.authors_with_related_works()
+        )
+        client.close()
+        self.openalex_db.drop_collection(self.prefetch_collection_name)
+
     def process_openalex(self):
         author_cursor = self.openalex_collection.find(no_cursor_timeout=True)
         client = MongoClient(self.mongodb_url)
@@ -289,5 +356,8 @@ class Kahi_openalex_person(KahiBase):
         client.close()
 
     def run(self):
-        self.process_openalex()
+        if self.prefetch:
+            self.process_openalex_prefetch()
+        else:
+            self.process_openalex()
         return 0
@@ -1,9 +1,23 @@
 from kahi.KahiBase import KahiBase
 from pymongo import MongoClient, TEXT
 from joblib import Parallel, delayed
+from time import time
 from kahi_openalex_works.process_one import process_one
+from kahi_openalex_works.resolver import EntityResolver
+from kahi_openalex_works.bulk import BulkWriter
+from kahi_impactu_utils.Elasticsearch import ElasticsearchSink
+from kahi_impactu_utils.Checkpoint import Checkpoint
 from mohan.Similarity import Similarity
 
+# fields of the openalex works used by the parser and the similarity search
+OPENALEX_PROJECTION = {
+    "id": 1, "doi": 1, "title": 1, "ids": 1, "type": 1,
+    "publication_year": 1, "publication_date": 1, "primary_location": 1,
+    "biblio": 1, "counts_by_year": 1, "cited_by_count": 1, "open_access": 1,
+    "apc_paid": 1, "apc_list": 1, "abstract_inverted_index": 1,
+    "authorships": 1, "concepts": 1, "primary_topic": 1, "topics": 1
+}
+
 
 class Kahi_openalex_works(KahiBase):
 
@@ -31,6 +45,20 @@ class Kahi_openalex_works(KahiBase):
                 - es_url: The url of the elasticsearch server.
                 - es_user: The user for the elasticsearch server.
                 - es_password: The password for the elasticsearch server.
+                - cache_size: Maximum number of entries of the entity resolver caches (threading backend only).
+                - preload: List of collections ("sources", "subjects", "affiliations") loaded in memory before processing.
+                - stream: If true the works are read with a projected cursor in batches of cursor_batch_size
+                  instead of loading them in memory, the progress is reported from an estimated count.
+                - cursor_batch_size: Number of works fetched per cursor batch in stream mode, default 1000.
+                - checkpoint: If true the progress of the task is saved in the checkpoint_collection of the colav database,
+                  and a restarted task continues after the last processed work.
+                - checkpoint_collection: Collection for the checkpoints, default "checkpoints".
+                - bulk_size: If given, the works are written with unordered bulk_write batches of this size (threading backend only).
+                - bulk_timeout: Maximum number of seconds before a batch is written, default 60.
+                - bulk_errors_collection: Collection of the colav database where the error reports of the failed batches are saved.
+                - es_bulk_size: If given, the works are indexed in elasticsearch with _bulk requests of this size.
+                - es_queue_size: Maximum number of works waiting to be indexed in elasticsearch, default 10000.
+                - es_flush_interval: Maximum number of seconds before a work is sent to elasticsearch, default 5.
         """
         self.config = config
 
@@ -81,26 +109,138 @@ class Kahi_openalex_works(KahiBase):
         self.backend = "threading" if "backend" not in config[
             "openalex_works"].keys() else config["openalex_works"]["backend"]
 
+        self.es_bulk_size = config["openalex_works"]["es_bulk_size"] if "es_bulk_size" in config["openalex_works"].keys(
+        ) else None
+        if self.es_handler and self.es_bulk_size:
+            self.es_handler = ElasticsearchSink(
+                self.es_handler,
+                config["openalex_works"]["es_index"],
+                bulk_size=self.es_bulk_size,
+                queue_size=config["openalex_works"].get("es_queue_size", 10000),
+                flush_interval=config["openalex_works"].get("es_flush_interval", 5),
+                verbose=self.verbose)
+
+        self.cache_size = config["openalex_works"]["cache_size"] if "cache_size" in config["openalex_works"].keys(
+        ) else 1000000
+        self.preload = config["openalex_works"]["preload"] if "preload" in config["openalex_works"].keys(
+        ) else []
+
+        self.stream = config["openalex_works"]["stream"] if "stream" in config["openalex_works"].keys(
+        ) else False
+        self.cursor_batch_size = config["openalex_works"]["cursor_batch_size"] if "cursor_batch_size" in config["openalex_works"].keys(
+        ) else 1000
+
+        self.checkpoint = config["openalex_works"]["checkpoint"] if "checkpoint" in config["openalex_works"].keys(
+        ) else False
+        self.checkpoint_collection = config["openalex_works"]["checkpoint_collection"] if "checkpoint_collection" in config["openalex_works"].keys(
+        ) else "checkpoints"
+
+        self.bulk_size = config["openalex_works"]["bulk_size"] if "bulk_size" in config["openalex_works"].keys(
+        ) else None
+        self.bulk_timeout = config["openalex_works"]["bulk_timeout"] if "bulk_timeout" in config["openalex_works"].keys(
+        ) else 60
+        self.bulk_errors_collection = config["openalex_works"]["bulk_errors_collection"] if "bulk_errors_collection" in config["openalex_works"].keys(
+        ) else None
+        if self.bulk_size and self.backend != "threading":
+            print("WARNING: bulk_size is only supported with the threading backend, works will be written one by one")
+            self.bulk_size = None
+
+    def stream_works(self, query, estimated, sort=None):
+        """
+        Generator of the openalex works that match the query, read with a projected cursor
+        in batches, then only a cursor batch is in memory at a time.
+        joblib consumes the generator on demand (pre_dispatch), so it is bounded by the workers.
+
+        Parameters
+        ----------
+        query : dict
+            Query for the openalex works collection.
+        estimated : int
+            Estimated number of works, used to report the progress.
+        sort : list, optional
+            Sort specification for the cursor. The default is None.
+        """
+        step = max(self.cursor_batch_size * 100, 1)
+        start = time()
+        # the processing of a batch could take longer than the cursor idle timeout
+        paper_cursor = self.openalex_collection.find(
+            query, OPENALEX_PROJECTION, no_cursor_timeout=True, batch_size=self.cursor_batch_size, sort=sort)
+        try:
+            for i, paper in enumerate(paper_cursor):
+                if self.verbose > 0 and i > 0 and i % step == 0:
+                    print(
+                        f"INFO: {i} works dispatched of about {estimated} ({i / estimated:.2%} of the collection) in {time() - start:.0f}s")
+                yield paper
+        finally:
+            paper_cursor.close()
+
     def process_openalex(self):
-        # selects papers with doi according to task variable
+        checkpoint = None
+        if self.checkpoint:
+            checkpoint = Checkpoint(
+                self.db[self.checkpoint_collection],
+                "openalex_works",
+                f'{self.config["openalex_works"]["database_name"]}.{self.config["openalex_works"]["collection_name"]}/{self.task if self.task == "doi" else "no_doi"}',
+                verbose=self.verbose)
         if self.task == "doi":
-            paper_cursor = self.openalex_collection.find(
-                {"doi": {"$ne": None}, "title": {"$ne": None}, "type": {"$ne": "grant"}})
-            count = self.openalex_collection.count_documents(
-                {"doi": {"$ne": None}, "title": {"$ne": None}, "type": {"$ne": "grant"}})
+            query = {"doi": {"$ne": None}, "title": {"$ne": None}, "type": {"$ne": "grant"}}
+        else:
+            query = {"doi": {"$eq": None}, "title": {"$ne": None}, "type": {"$ne": "grant"}}
+        if checkpoint or self.stream:
+            sort = None
+            if checkpoint:
+                # the works are processed in _id order, resuming after the last processed work
+                query = checkpoint.query(query)
+                sort = [("_id", 1)]
+            # the exact count would be a second scan of the collection
+            estimated = max(self.openalex_collection.estimated_document_count(), 1)
+            print(
+                f"INFO: proccesing works {'with' if self.task == 'doi' else 'without'} DOI from a collection of about {estimated} works")
+            paper_cursor = self.stream_works(query, estimated, sort=sort)
+        # selects papers with doi according to task variable
+        elif self.task == "doi":
+            paper_cursor = self.openalex_collection.find(query)
+            count = self.openalex_collection.count_documents(query)
             print(f"INFO: proccesing {count} works with DOI")
         else:
-            paper_cursor = list(self.openalex_collection.find(
-                {"doi": {"$eq": None}, "title": {"$ne": None}, "type": {"$ne": "grant"}}))
-            count = self.openalex_collection.count_documents(
-                {"doi": {"$eq": None}, "title": {"$ne": None}, "type": {"$ne": "grant"}})
+            paper_cursor = list(self.openalex_collection.find(query))
+            count = self.openalex_collection.count_documents(query)
             print(f"INFO: proccesing {count} works without DOI")
 
-        Parallel(
+        resolver = None
+        if self.backend == "threading":
+            resolver = EntityResolver(
+                self.db, cache_size=self.cache_size, preload=self.preload, verbose=self.verbose)
+
+        bulk_writer = None
+        if self.bulk_size:
+            bulk_writer = BulkWriter(
+                self.collection,
+                bulk_size=self.bulk_size,
+                bulk_timeout=self.bulk_timeout,
+                es_handler=self.es_handler,
+                errors_collection=self.db[self.bulk_errors_collection] if self.bulk_errors_collection else None,
+                verbose=self.verbose)
+        parallel_kwargs = {}
+        if checkpoint:
+            # the buffered works have to be on the database and the queued elasticsearch documents
+            # indexed before moving the checkpoint, the bulk writer first because it queues documents
+            def before_save():
+                if bulk_writer:
+                    bulk_writer.flush()
+                if isinstance(self.es_handler, ElasticsearchSink):
+                    self.es_handler.flush()
+            checkpoint.before_save = before_save
+            paper_cursor = checkpoint.track(paper_cursor)
+            # results in order to know which works are already processed
+            parallel_kwargs["return_as"] = "generator"
+
+        results = Parallel(
             n_jobs=self.n_jobs,
             verbose=self.verbose,
             backend=self.backend,
-            batch_size=10)(
+            batch_size=10,
+            **parallel_kwargs)(
             delayed(process_one)(
                 paper,
                 self.config,
@@ -108,10 +248,20 @@ class Kahi_openalex_works(KahiBase):
                 self.client if self.backend == "threading" else None,
                 self.es_handler if self.backend == "threading" else None,
                 self.backend,
+                resolver=resolver,
+                bulk_writer=bulk_writer,
                 verbose=self.verbose
             ) for paper in paper_cursor
         )
+        if checkpoint:
+            checkpoint.consume(results)
+        if bulk_writer:
+            bulk_writer.close()
+        if resolver and self.verbose > 0:
+            resolver.report()
 
     def run(self):
         self.process_openalex()
+        if isinstance(self.es_handler, ElasticsearchSink):
+            self.es_handler.close()
         return 0
@@ -0,0 +1,239 @@
+from threading import Event, Lock
+from time import time
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+
+class BulkWriter:
+    """
+    Buffer of write operations over the works collection, written as unordered bulk_write batches.
+    Inserts are upserts keyed by the openalex id and updates are guarded by the openalex updated source,
+    then a batch written again after a restart does not duplicate works.
+    bulk_timeout is only checked when an operation is added, flush or close write the rest of the buffer.
+
+    Parameters
+    ----------
+    collection : pymongo.collection.Collection
+        Colav database collection for works.
+    bulk_size : int, optional
+        Number of operations per batch. The default is 1000.
+    bulk_timeout : float, optional
+        Number of seconds since the last flush after which the next added operation writes the buffer. The default is 60.
+    es_handler : Similarity, optional
+        Elasticsearch handler, the works inserted are indexed after its batch is written.
+    errors_collection : pymongo.collection.Collection, optional
+        Collection where the error report of every failed batch is saved.
+        If None the report is only printed.
+    verbose : int, optional
+        Verbosity level. The default is 0.
+    """
+
+    def __init__(self, collection, bulk_size=1000, bulk_timeout=60, es_handler=None, errors_collection=None, verbose=0):
+        self.collection = collection
+        self.bulk_size = bulk_size
+        self.bulk_timeout = bulk_timeout
+        self.es_handler = es_handler
+        self.errors_collection = errors_collection
+        self.verbose = verbose
+
+        self.lock = Lock()
+        self.flush_lock = Lock()
+        self.ops = []
+        self.filters = []
+        self.es_works = []
+        self.pending_keys = set()
+        # doi -> Event of the batch that is writing it, and batch -> Event of the batches being written
+        self.inflight_keys = {}
+        self.inflight_batches = {}
+        self.last_flush = time()
+        self.batch = 0
+
+    def insert(self, entry, oa_id, doi=None, es_work=None):
+        """
+        Adds the insertion of a new work to the buffer.
+
+        Parameters
+        ----------
+        entry : dict
+            Work entry, it must have the _id already assigned.
+        oa_id : str
+            Openalex id of the work, used as key of the upsert.
+        doi : str, optional
+            Doi of the work, registered as pending until the batch is written.
+        es_work : dict, optional
+            Document to be indexed in elasticsearch once the work is written.
+        """
+        query = {"external_ids.id": oa_id}
+        op = UpdateOne(query, {"$setOnInsert": entry}, upsert=True)
+        with self.lock:
+            if es_work is not None:
+                self.es_works.append(
+                    (len(self.ops), str(entry["_id"]), es_work))
+            self.ops.append(op)
+            self.filters.append(query)
+            if doi:
+                self.pending_keys.add(doi)
+        self.flush_if_needed()
+
+    def update(self, _id, update):
+        """
+        Adds the update of an existing work to the buffer.
+
+        Parameters
+        ----------
+        _id : ObjectId
+            _id of the work in the colav database.
+        update : dict
+            Update document (ex: {"$set": {...}}).
+        """
+        query = {"_id": _id, "updated.source": {"$ne": "openalex"}}
+        op = UpdateOne(query, update)
+        with self.lock:
+            self.ops.append(op)
+            self.filters.append(query)
+        self.flush_if_needed()
+
+    def sync(self, key):
+        """
+        Makes sure that the work with the given doi is on the database
+        if it was added to the buffer, writing the buffer or waiting for
+        the batch that is being written.
+
+        Parameters
+        ----------
+        key : str
+            Doi of the work.
+        """
+        with self.lock:
+            pending = key in self.pending_keys
+            written = self.inflight_keys.get(key)
+        if pending:
+            self.flush()
+        elif written:
+            written.wait()
+
+    def flush_if_needed(self):
+        with self.lock:
+            needed = len(self.ops) >= self.bulk_size or (
+                self.ops and time() - self.last_flush >= self.bulk_timeout)
+        if needed:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered operations as an unordered bulk_write,
+        then indexes in elasticsearch the works inserted by the batch.
+        When it returns, the batches taken from the buffer by other threads before the call are written too.
+        """
+        with self.lock:
+            ops = self.ops
+            filters = self.filters
+            es_works = self.es_works
+            keys = self.pending_keys
+            self.ops = []
+            self.filters = []
+            self.es_works = []
+            self.pending_keys = set()
+            self.last_flush = time()
+            earlier = list(self.inflight_batches.values())
+            if ops:
+                self.batch += 1
+                written = Event()
+                self.inflight_batches[self.batch] = written
+                for key in keys:
+                    self.inflight_keys[key] = written
+            batch = self.batch
+        if ops:
+            try:
+                self.write(batch, ops, filters, es_works)
+            finally:
+                with self.lock:
+                    del self.inflight_batches[batch]
+                    for key in keys:
+                        if self.inflight_keys.get(key) is written:
+                            del self.inflight_keys[key]
+                written.set()
+        # waits for the batches that other threads could be writing
+        for event in earlier:
+            event.wait()
+
+    def write(self, batch, ops, filters, es_works):
+        """
+        Writes a batch of operations and indexes in elasticsearch the works inserted by it.
+
+        Parameters
+        ----------
+        batch : int
+            Number of the batch.
+        ops : list
+            Operations of the batch.
+        filters : list
+            Filters of the operations of the batch.
+        es_works : list
+            (index of the operation, _id, document) of the works to be indexed.
+        """
+        with self.flush_lock:
+            upserted = {}
+            failed = set()
+            try:
+                result = self.collection.bulk_write(ops, ordered=False)
+                upserted = result.upserted_ids
+                inserted = result.upserted_count
+                updated = result.modified_count
+            except BulkWriteError as bwe:
+                details = bwe.details
+                upserted = {up["index"]: up["_id"]
+                            for up in details.get("upserted", [])}
+                inserted = details.get("nUpserted", 0)
+                updated = details.get("nModified", 0)
+                failed = {error["index"] for error in details["writeErrors"]}
+                self.report_errors(batch, filters, details)
+            if self.es_handler:
+                for index, _id, work in es_works:
+                    # upserts that matched an existing work were already indexed in a previous run
+                    if index in upserted.keys() and index not in failed:
+                        self.es_handler.insert_work(_id=_id, work=work)
+        if self.verbose > 4:
+            print(
+                f"INFO: batch {batch} with {len(ops)} operations written ({inserted} inserted, {updated} updated, {len(failed)} errors)")
+
+    def report_errors(self, batch, filters, details):
+        """
+        Prints and saves the error report of a failed batch.
+
+        Parameters
+        ----------
+        batch : int
+            Number of the batch.
+        filters : list
+            Filters of the operations of the batch.
+        details : dict
+            Details of the BulkWriteError exception.
+        """
+        errors = []
+        for error in details["writeErrors"]:
+            errors.append({
+                "index": error["index"],
+                "code": error.get("code"),
+                "errmsg": error.get("errmsg"),
+                "filter": filters[error["index"]]
+            })
+        print(
+            f"ERROR: batch {batch} has {len(errors)} failed operations of {len(filters)}")
+        if self.verbose > 4:
+            for error in errors:
+                print(f"\t{error}")
+        if self.errors_collection is not None:
+            self.errors_collection.insert_one({
+                "source": "openalex",
+                "batch": batch,
+                "time": int(time()),
+                "operations": len(filters),
+                "errors": errors
+            })
+
+    def close(self):
+        """
+        Writes the remaining operations in the buffer.
+        """
+        self.flush()
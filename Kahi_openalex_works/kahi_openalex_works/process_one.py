@@ -4,16 +4,22 @@ from time import time
 from bson import ObjectId
 from pymongo import MongoClient
 from mohan.Similarity import Similarity
+from kahi_openalex_works.resolver import EntityResolver
+from os import getpid
+import atexit
 
+# connections of the current process for the multiprocessing backends (see get_worker_resources)
+worker_resources = {}
 
-def get_units_affiations(db, author_db, affiliations):
+
+def get_units_affiations(resolver, author_db, affiliations):
     """
     Method to get the units of an author in a register. ex: faculty, department and group.
 
     Parameters:
     ----------
-    db : pymongo.database.Database
-        Database connection to colav database.
+    resolver : EntityResolver
+        Cached resolver of the colav entities.
     author_db : dict
         record from person
     affiliations : list
@@ -30,8 +36,7 @@ def get_units_affiations(db, author_db, affiliations):
         aff_db = None
         if "external_ids" in aff.keys():
             for ext in aff["external_ids"]:
-                aff_db = db["affiliations"].find_one(
-                    {"external_ids.id": ext["id"]}, {"_id": 1, "types": 1})
+                aff_db = resolver.affiliation(ext["id"])
                 if aff_db:
                     types = [i["type"] for i in aff_db["types"]]
                     if "group" in types or "department" in types or "faculty" in types:
@@ -40,25 +45,24 @@ def get_units_affiations(db, author_db, affiliations):
                     else:
                         break
         if aff_db:
-            count = db["person"].count_documents(
-                {"_id": author_db["_id"], "affiliations.id": aff_db["_id"]})
-            if count > 0:
+            author_aff_ids = [author_aff["id"]
+                              for author_aff in author_db["affiliations"]]
+            if aff_db["_id"] in author_aff_ids:
                 institution_id = aff_db["_id"]
                 break
     units = []
     for aff in author_db["affiliations"]:
         if aff["id"] == institution_id:
             continue
-        count = db["affiliations"].count_documents(
-            {"_id": aff["id"], "relations.id": institution_id})
-        if count > 0:
+        aff_db = resolver.affiliation_by_id(aff["id"])
+        if aff_db and institution_id in [rel["id"] for rel in aff_db.get("relations", []) if "id" in rel.keys()]:
             types = [i["type"] for i in aff["types"]]
             if "department" in types or "faculty" in types:
                 units.append(aff)
     return units
 
 
-def process_one_update(oa_reg, colav_reg, db, collection, empty_work, verbose=0):
+def process_one_update(oa_reg, colav_reg, resolver, collection, empty_work, bulk_writer=None, verbose=0):
     """
     Method to update a register in the database if it is found in the openalex database.
     This means that the register is already on the database and it is being updated with new information.
@@ -69,12 +73,14 @@ def process_one_update(oa_reg, colav_reg, db, collection, empty_work, verbose=0)
         A record from openalex
     colav_reg : dict
         Register from the colav database (kahi database for impactu)
-    db : pymongo.database.Database
-        Database connection to colav database.
+    resolver : EntityResolver
+        Cached resolver of the colav entities (sources, subjects, affiliations and person).
     collection : pymongo.collection.Collection
         Collection to insert the register. Colav database collection for works.
     empty_work : dict
         A template for a work entry, with empty fields.
+    bulk_writer : BulkWriter, optional
+        If given, the update is buffered and written in batches.
     verbose : int, optional
         Verbosity level. The default is 0.
     """
@@ -121,8 +127,7 @@ def process_one_update(oa_reg, colav_reg, db, collection, empty_work, verbose=0)
     for subjects in entry["subjects"]:
         for i, subj in enumerate(subjects["subjects"]):
             for ext in subj["external_ids"]:
-                sub_db = db["subjects"].find_one(
-                    {"external_ids.id": ext["id"]})
+                sub_db = resolver.subject(ext["id"])
                 if sub_db:
                     name = sub_db["names"][0]["name"]
                     for n in sub_db["names"]:
@@ -144,34 +149,34 @@ def process_one_update(oa_reg, colav_reg, db, collection, empty_work, verbose=0)
     for i, author in enumerate(entry["authors"]):
         author_db = None
         for ext in author["external_ids"]:
-            author_db = db["person"].find_one(
-                {"external_ids.id": ext["id"]})
+            author_db = resolver.person(ext["id"])
             if author_db:
                 break
         if author_db:
             aff_units = get_units_affiations(
-                db, author_db, author["affiliations"])
+                resolver, author_db, author["affiliations"])
             for aff_unit in aff_units:
                 if aff_unit not in author["affiliations"]:
                     colav_reg["authors"][i]["affiliations"].append(aff_unit)
-    collection.update_one(
-        {"_id": colav_reg["_id"]},
-        {"$set": {
-            "updated": colav_reg["updated"],
-            "titles": colav_reg["titles"],
-            "external_ids": colav_reg["external_ids"],
-            "types": colav_reg["types"],
-            "bibliographic_info": colav_reg["bibliographic_info"],
-            "external_urls": colav_reg["external_urls"],
-            "subjects": colav_reg["subjects"],
-            "citations_count": colav_reg["citations_count"],
-            "citations_by_year": colav_reg["citations_by_year"],
-            "authors": colav_reg["authors"]
-        }}
-    )
-
-
-def process_one_insert(oa_reg, db, collection, empty_work, es_handler, verbose=0):
+    update = {"$set": {
+        "updated": colav_reg["updated"],
+        "titles": colav_reg["titles"],
+        "external_ids": colav_reg["external_ids"],
+        "types": colav_reg["types"],
+        "bibliographic_info": colav_reg["bibliographic_info"],
+        "external_urls": colav_reg["external_urls"],
+        "subjects": colav_reg["subjects"],
+        "citations_count": colav_reg["citations_count"],
+        "citations_by_year": colav_reg["citations_by_year"],
+        "authors": colav_reg["authors"]
+    }}
+    if bulk_writer:
+        bulk_writer.update(colav_reg["_id"], update)
+    else:
+        collection.update_one({"_id": colav_reg["_id"]}, update)
+
+
+def process_one_insert(oa_reg, resolver, collection, empty_work, es_handler, bulk_writer=None, verbose=0):
     """
     ""
     Function to insert a new register in the database if it is not found in the colav(kahi works) database.
@@ -187,14 +192,16 @@ def process_one_insert(oa_reg, db, collection, empty_work, es_handler, verbose=0
     ----------
     scholar_reg : dict
         Register from the openalex database
-    db : pymongo.database.Database
-        Database where the colav collections are stored, used to search for authors and affiliations.
+    resolver : EntityResolver
+        Cached resolver of the colav entities, used to search for sources, subjects, authors and affiliations.
     collection : pymongo.collection.Collection
         Collection in the database where the register is stored (Collection of works)
     empty_work : dict
         Empty dictionary with the structure of a register in the database
     es_handler : Similarity
         Elasticsearch handler to insert the register in the elasticsearch index, Mohan's Similarity class.
+    bulk_writer : BulkWriter, optional
+        If given, the insertion is buffered and written in batches.
     verbose : int, optional
         Verbosity level. The default is 0
     """
@@ -206,8 +213,7 @@ def process_one_insert(oa_reg, db, collection, empty_work, es_handler, verbose=0
     if entry["source"]:
         if "external_ids" in entry["source"].keys():
             for ext in entry["source"]["external_ids"]:
-                source_db = db["sources"].find_one(
-                    {"external_ids.id": ext["id"]})
+                source_db = resolver.source(ext["id"])
                 if source_db:
                     break
     if source_db:
@@ -237,8 +243,7 @@ def process_one_insert(oa_reg, db, collection, empty_work, es_handler, verbose=0
     for subjects in entry["subjects"]:
         for i, subj in enumerate(subjects["subjects"]):
             for ext in subj["external_ids"]:
-                sub_db = db["subjects"].find_one(
-                    {"external_ids.id": ext["id"]})
+                sub_db = resolver.subject(ext["id"])
                 if sub_db:
                     name = sub_db["names"][0]["name"]
                     for n in sub_db["names"]:
@@ -258,38 +263,27 @@ def process_one_insert(oa_reg, db, collection, empty_work, es_handler, verbose=0
     for i, author in enumerate(entry["authors"]):
         author_db = None
         for ext in author["external_ids"]:  # given priority to scienti person
-            author_db = db["person"].find_one(
-                {"external_ids.id": ext["id"], "updated.source": "scienti"})
+            author_db = resolver.person(ext["id"], "scienti")
             if author_db:
                 break
         if not author_db:  # if not found ids with scienti, let search it with openalex
             for ext in author["external_ids"]:
-                author_db = db["person"].find_one(
-                    {"external_ids.id": ext["id"], "updated.source": "openalex"})
+                author_db = resolver.person(ext["id"], "openalex")
                 if author_db:
                     break
         if not author_db:  # if not found ids with scienti/openalex, let search it with other sources
             for ext in author["external_ids"]:
-                author_db = db["person"].find_one(
-                    {"external_ids.id": ext["id"]})
+                author_db = resolver.person(ext["id"])
                 if author_db:
                     break
         if author_db:
-            sources = [ext["source"]
-                       for ext in author_db["external_ids"]]
-            ids = [ext["id"] for ext in author_db["external_ids"]]
-            for ext in author["external_ids"]:
-                if ext["id"] not in ids:
-                    author_db["external_ids"].append(ext)
-                    sources.append(ext["source"])
-                    ids.append(ext["id"])
             entry["authors"][i] = {
                 "id": author_db["_id"],
                 "full_name": author_db["full_name"],
                 "affiliations": author["affiliations"]
             }
             aff_units = get_units_affiations(
-                db, author_db, author["affiliations"])
+                resolver, author_db, author["affiliations"])
             for aff_unit in aff_units:
                 if aff_unit not in author["affiliations"]:
                     author["affiliations"].append(aff_unit)
@@ -300,24 +294,15 @@ def process_one_insert(oa_reg, db, collection, empty_work, es_handler, verbose=0
             if verbose > 1:
                 print(
                     f"WARNING: author not found in db {author} maybe deleted author in openalex, trying to find by name")
-            author_db = db["person"].find_one(
-                {"full_name": author["full_name"]})
+            author_db = resolver.person_by_name(author["full_name"])
             if author_db:
-                sources = [ext["source"]
-                           for ext in author_db["external_ids"]]
-                ids = [ext["id"] for ext in author_db["external_ids"]]
-                for ext in author["external_ids"]:
-                    if ext["id"] not in ids:
-                        author_db["external_ids"].append(ext)
-                        sources.append(ext["source"])
-                        ids.append(ext["id"])
                 entry["authors"][i] = {
                     "id": author_db["_id"],
                     "full_name": author_db["full_name"],
                     "affiliations": author["affiliations"]
                 }
                 aff_units = get_units_affiations(
-                    db, author_db, author["affiliations"])
+                    resolver, author_db, author["affiliations"])
                 for aff_unit in aff_units:
                     if aff_unit not in author["affiliations"]:
                         author["affiliations"].append(aff_unit)
@@ -336,8 +321,7 @@ def process_one_insert(oa_reg, db, collection, empty_work, es_handler, verbose=0
                     continue
             if "external_ids" in aff.keys():
                 for ext in aff["external_ids"]:
-                    aff_db = db["affiliations"].find_one(
-                        {"external_ids.id": ext["id"]})
+                    aff_db = resolver.affiliation(ext["id"])
                     if aff_db:
                         break
             if aff_db:
@@ -356,8 +340,7 @@ def process_one_insert(oa_reg, db, collection, empty_work, es_handler, verbose=0
                     "types": aff_db["types"]
                 }
             else:
-                aff_db = db["affiliations"].find_one(
-                    {"names.name": aff["name"]})
+                aff_db = resolver.affiliation_by_name(aff["name"])
                 if aff_db:
                     name = aff_db["names"][0]["name"]
                     for n in aff_db["names"]:
@@ -381,31 +364,120 @@ def process_one_insert(oa_reg, db, collection, empty_work, es_handler, verbose=0
                     }
 
     entry["author_count"] = len(entry["authors"])
+    if bulk_writer:
+        # the _id is assigned here to index the work in elasticsearch after the batch is written
+        entry["_id"] = ObjectId()
+        bulk_writer.insert(entry, oa_reg["id"], doi=oa_reg.get("doi"),
+                           es_work=get_es_work(entry) if es_handler else None)
+        return
     # insert in mongo
     response = collection.insert_one(entry)
     # insert in elasticsearch
     if es_handler:
-        work = {}
-        work["title"] = entry["titles"][0]["title"]
-        work["source"] = entry["source"]["name"] if "name" in entry["source"].keys() else ""
-        work["year"] = entry["year_published"]
-        work["volume"] = entry["bibliographic_info"]["volume"] if "volume" in entry["bibliographic_info"].keys() else ""
-        work["issue"] = entry["bibliographic_info"]["issue"] if "issue" in entry["bibliographic_info"].keys() else ""
-        work["first_page"] = entry["bibliographic_info"]["first_page"] if "first_page" in entry["bibliographic_info"].keys() else ""
-        work["last_page"] = entry["bibliographic_info"]["last_page"] if "last_page" in entry["bibliographic_info"].keys() else ""
-        authors = []
-        for author in entry['authors']:
-            if len(authors) >= 5:
-                break
-            if "full_name" in author.keys():
-                authors.append(author["full_name"])
-        work["authors"] = authors
-        work["provenance"] = "openalex"
-
+        work = get_es_work(entry)
         es_handler.insert_work(_id=str(response.inserted_id), work=work)
 
 
-def process_one(oa_reg, config, empty_work, client, es_handler, backend, verbose=0):
+def get_es_work(entry):
+    """
+    Function to build the elasticsearch document of a work entry.
+
+    Parameters
+    ----------
+    entry : dict
+        Work entry in the colav database format.
+
+    Returns
+    -------
+    dict
+        Document for Mohan's Similarity class.
+    """
+    work = {}
+    work["title"] = entry["titles"][0]["title"]
+    work["source"] = entry["source"]["name"] if "name" in entry["source"].keys() else ""
+    work["year"] = entry["year_published"]
+    work["volume"] = entry["bibliographic_info"]["volume"] if "volume" in entry["bibliographic_info"].keys() else ""
+    work["issue"] = entry["bibliographic_info"]["issue"] if "issue" in entry["bibliographic_info"].keys() else ""
+    work["first_page"] = entry["bibliographic_info"]["first_page"] if "first_page" in entry["bibliographic_info"].keys() else ""
+    work["last_page"] = entry["bibliographic_info"]["last_page"] if "last_page" in entry["bibliographic_info"].keys() else ""
+    authors = []
+    for author in entry['authors']:
+        if len(authors) >= 5:
+            break
+        if "full_name" in author.keys():
+            authors.append(author["full_name"])
+    work["authors"] = authors
+    work["provenance"] = "openalex"
+
+    return work
+
+
+def get_worker_resources(config, verbose=0):
+    """
+    Function to get the connections of the current process for the multiprocessing backends.
+
+    The MongoClient, the elasticsearch handler and the entity resolver are created by the
+    first register processed in the worker and reused by the next registers,
+    they are closed when the worker exits.
+
+    Parameters
+    ----------
+    config : dict
+        The configuration dictionary.
+    verbose : int, optional
+        Verbosity level. The default is 0.
+
+    Returns
+    -------
+    tuple
+        MongoClient, Similarity (or None) and EntityResolver of the current process.
+    """
+    pid = getpid()
+    if worker_resources.get("pid") == pid:
+        return worker_resources["client"], worker_resources["es_handler"], worker_resources["resolver"]
+    # the process could be forked from a process that already has resources,
+    # those connections must not be reused.
+    worker_resources.clear()
+    client = MongoClient(config["database_url"])
+    es_handler = None
+    if "es_index" in config["openalex_works"].keys() and "es_url" in config["openalex_works"].keys() and "es_user" in config["openalex_works"].keys() and "es_password" in config["openalex_works"].keys():
+        es_index = config["openalex_works"]["es_index"]
+        es_url = config["openalex_works"]["es_url"]
+        if config["openalex_works"]["es_user"] and config["openalex_works"]["es_password"]:
+            es_auth = (config["openalex_works"]["es_user"],
+                       config["openalex_works"]["es_password"])
+        else:
+            es_auth = None
+        es_handler = Similarity(
+            es_index, es_uri=es_url, es_auth=es_auth, es_req_timeout=300, es_max_retries=5, es_retry_on_timeout=True)
+    else:
+        print("WARNING: No elasticsearch configuration provided")
+    resolver = EntityResolver(
+        client[config["database_name"]],
+        cache_size=config["openalex_works"].get("cache_size", 1000000),
+        preload=config["openalex_works"].get("preload", []),
+        verbose=verbose)
+    worker_resources.update(
+        {"pid": pid, "client": client, "es_handler": es_handler, "resolver": resolver})
+    return client, es_handler, resolver
+
+
+def close_worker_resources():
+    """
+    Function to close the connections of the current process, registered with atexit.
+    """
+    if worker_resources.get("pid") != getpid():
+        return
+    worker_resources["client"].close()
+    if worker_resources["es_handler"]:
+        worker_resources["es_handler"].close()
+    worker_resources.clear()
+
+
+atexit.register(close_worker_resources)
+
+
+def process_one(oa_reg, config, empty_work, client, es_handler, backend, resolver=None, bulk_writer=None, verbose=0):
     """
     Function to process a single register from the scholar database.
     This function is used to insert or update a register in the colav(kahi works) database.
@@ -422,41 +494,37 @@ def process_one(oa_reg, config, empty_work, client, es_handler, backend, verbose
         Empty dictionary with the structure of a register in the database
     es_handler : Similarity
         Elasticsearch handler to insert the register in the elasticsearch index, Mohan's Similarity class.
+    resolver : EntityResolver, optional
+        Cached resolver of the colav entities shared by the threads,
+        if None a resolver is created for this register only.
+        For the multiprocessing backends the resolver of the worker process is used.
+    bulk_writer : BulkWriter, optional
+        Buffer of write operations shared by the threads, if None the register is written immediately.
     verbose : int, optional
         Verbosity level. The default is 0.
     """
     if backend != "threading":
-        client = MongoClient(config["database_url"])
+        client, es_handler, resolver = get_worker_resources(
+            config, verbose=verbose)
     db = client[config["database_name"]]
     collection = db["works"]
-
-    if backend != "threading":
-        es_handler = None
-        if "es_index" in config["openalex_works"].keys() and "es_url" in config["openalex_works"].keys() and "es_user" in config["openalex_works"].keys() and "es_password" in config["openalex_works"].keys():
-            es_index = config["openalex_works"]["es_index"]
-            es_url = config["openalex_works"]["es_url"]
-            if config["openalex_works"]["es_user"] and config["openalex_works"]["es_password"]:
-                es_auth = (config["openalex_works"]["es_user"],
-                           config["openalex_works"]["es_password"])
-            else:
-                es_auth = None
-            es_handler = Similarity(
-                es_index, es_uri=es_url, es_auth=es_auth, es_req_timeout=300, es_max_retries=5, es_retry_on_timeout=True)
-        else:
-            es_handler = None
-            print("WARNING: No elasticsearch configuration provided")
+    if resolver is None:
+        resolver = EntityResolver(db, verbose=verbose)
 
     doi = oa_reg["doi"] if "doi" in oa_reg.keys() else "" 
 
     if doi:
+        if bulk_writer:
+            # a work with the same doi could be waiting in the buffer
+            bulk_writer.sync(doi)
         # is the doi in colavdb?
         colav_reg = collection.find_one({"external_ids.id": doi})
         if colav_reg:  # update the register
             process_one_update(
-                oa_reg, colav_reg, db, collection, empty_work, verbose=verbose)
+                oa_reg, colav_reg, resolver, collection, empty_work, bulk_writer=bulk_writer, verbose=verbose)
         else:  # insert a new register
             process_one_insert(
-                oa_reg, db, collection, empty_work, es_handler, verbose=verbose)
+                oa_reg, resolver, collection, empty_work, es_handler, bulk_writer=bulk_writer, verbose=verbose)
     else:  # does not have a doi identifier
         # elasticsearch section
         if es_handler:
@@ -491,26 +559,22 @@ def process_one(oa_reg, config, empty_work, client, es_handler, backend, verbose
                     colav_reg = collection.find_one(
                         {"_id": ObjectId(response["_id"])})
                     if colav_reg:
-                        process_one_update(oa_reg, colav_reg, db,
-                                           collection, empty_work, verbose=verbose)
+                        process_one_update(oa_reg, colav_reg, resolver,
+                                           collection, empty_work, bulk_writer=bulk_writer, verbose=verbose)
                     else:
                         if verbose > 4:
                             print("Register with {} not found in mongodb".format(
                                 response["_id"]))
                             print(response)
                 else:
-                    process_one_insert(oa_reg, db, collection,
-                                       empty_work, es_handler, verbose=0)
+                    process_one_insert(oa_reg, resolver, collection,
+                                       empty_work, es_handler, bulk_writer=bulk_writer, verbose=0)
 
             else:  # insert new register
                 if verbose > 4:
                     print("INFO: found no register in elasticsearch")
-                process_one_insert(oa_reg, db, collection,
-                                   empty_work, es_handler, verbose=0)
+                process_one_insert(oa_reg, resolver, collection,
+                                   empty_work, es_handler, bulk_writer=bulk_writer, verbose=0)
         else:
             if verbose > 4:
                 print("No elasticsearch index provided")
-    if backend != "threading":
-        client.close()
-        if es_handler:
-            es_handler.close()
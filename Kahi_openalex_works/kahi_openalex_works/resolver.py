@@ -0,0 +1,220 @@
+from collections import OrderedDict
+from threading import Lock
+
+
+# fields needed to link works with the colav entities,
+# the rest of the document is never used by this plugin
+SOURCE_PROJECTION = {"_id": 1, "names": 1, "external_ids.id": 1}
+SUBJECT_PROJECTION = {"_id": 1, "names": 1, "level": 1, "external_ids.id": 1}
+AFFILIATION_PROJECTION = {"_id": 1, "names": 1, "types": 1,
+                          "relations.id": 1, "external_ids.id": 1}
+PERSON_PROJECTION = {"_id": 1, "full_name": 1,
+                     "external_ids": 1, "affiliations": 1}
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Thread safe LRU cache with hit/miss counters.
+
+    Negative results (None) are cached as well, most of the lookups
+    in a full OpenAlex load are misses for the same external ids.
+
+    Parameters
+    ----------
+    maxsize : int
+        Maximum number of keys to keep, if None or 0 the cache is unbounded.
+    """
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            value = self.data.get(key, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            if self.maxsize and len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def __len__(self):
+        return len(self.data)
+
+
+class EntityResolver:
+    """
+    Resolver for the colav entities (sources, subjects, affiliations and person)
+    referenced by external ids in the openalex works.
+
+    Sources, subjects and affiliations can be preloaded from the database,
+    the rest of the lookups are kept in LRU caches.
+
+    Parameters
+    ----------
+    db : pymongo.database.Database
+        Database connection to colav database.
+    cache_size : int, optional
+        Maximum number of entries per LRU cache. The default is 1000000.
+    preload : list, optional
+        Collections to be preloaded, allowed values are "sources", "subjects" and "affiliations".
+        The default is None (lazy lookups only).
+    verbose : int, optional
+        Verbosity level. The default is 0.
+    """
+
+    def __init__(self, db, cache_size=1000000, preload=None, verbose=0):
+        self.db = db
+        self.verbose = verbose
+        self.caches = {
+            "sources": LRUCache(cache_size),
+            "subjects": LRUCache(cache_size),
+            "affiliations": LRUCache(cache_size),
+            "affiliations_id": LRUCache(cache_size),
+            "affiliations_name": LRUCache(cache_size),
+            "person": LRUCache(cache_size),
+            "person_name": LRUCache(cache_size),
+        }
+        self.preloaded = {}
+        if preload:
+            for collection in preload:
+                self.preload(collection)
+
+    def preload(self, collection):
+        """
+        Loads the id->entity map of a whole collection in memory.
+
+        Parameters
+        ----------
+        collection : str
+            Name of the collection, "sources", "subjects" or "affiliations".
+        """
+        projections = {
+            "sources": SOURCE_PROJECTION,
+            "subjects": SUBJECT_PROJECTION,
+            "affiliations": AFFILIATION_PROJECTION
+        }
+        if collection not in projections.keys():
+            raise ValueError(
+                f"Collection {collection} can not be preloaded, allowed values are {list(projections.keys())}")
+        ext_map = {}
+        id_map = {}
+        name_map = {}
+        for reg in self.db[collection].find({}, projections[collection]):
+            for ext in reg.get("external_ids", []):
+                if "id" in ext.keys():
+                    # keeps the first register as find_one does
+                    ext_map.setdefault(ext["id"], reg)
+            if collection == "affiliations":
+                id_map[reg["_id"]] = reg
+                for name in reg.get("names", []):
+                    name_map.setdefault(name["name"], reg)
+        self.preloaded[collection] = ext_map
+        if collection == "affiliations":
+            self.preloaded["affiliations_id"] = id_map
+            self.preloaded["affiliations_name"] = name_map
+        if self.verbose > 0:
+            print(
+                f"INFO: {len(ext_map)} external ids preloaded from {collection}")
+
+    def _lookup(self, cache_name, key, loader):
+        if cache_name in self.preloaded.keys():
+            cache = self.caches[cache_name]
+            value = self.preloaded[cache_name].get(key)
+            with cache.lock:
+                if value is None:
+                    cache.misses += 1
+                else:
+                    cache.hits += 1
+            return value
+        cache = self.caches[cache_name]
+        value = cache.get(key)
+        if value is _MISSING:
+            # the query runs outside the lock, two threads can resolve the same key
+            # at the same time but none of them is blocked by the other.
+            value = loader()
+            cache.put(key, value)
+        return value
+
+    def source(self, ext_id):
+        """
+        Returns the source with the given external id or None.
+        """
+        return self._lookup("sources", ext_id, lambda: self.db["sources"].find_one(
+            {"external_ids.id": ext_id}, SOURCE_PROJECTION))
+
+    def subject(self, ext_id):
+        """
+        Returns the subject with the given external id or None.
+        """
+        return self._lookup("subjects", ext_id, lambda: self.db["subjects"].find_one(
+            {"external_ids.id": ext_id}, SUBJECT_PROJECTION))
+
+    def affiliation(self, ext_id):
+        """
+        Returns the affiliation with the given external id or None.
+        """
+        return self._lookup("affiliations", ext_id, lambda: self.db["affiliations"].find_one(
+            {"external_ids.id": ext_id}, AFFILIATION_PROJECTION))
+
+    def affiliation_by_id(self, _id):
+        """
+        Returns the affiliation with the given _id or None.
+        """
+        return self._lookup("affiliations_id", _id, lambda: self.db["affiliations"].find_one(
+            {"_id": _id}, AFFILIATION_PROJECTION))
+
+    def affiliation_by_name(self, name):
+        """
+        Returns the first affiliation with the given name or None.
+        """
+        return self._lookup("affiliations_name", name, lambda: self.db["affiliations"].find_one(
+            {"names.name": name}, AFFILIATION_PROJECTION))
+
+    def person(self, ext_id, source=None):
+        """
+        Returns the person with the given external id or None.
+
+        Parameters
+        ----------
+        ext_id : str
+            External id of the person.
+        source : str, optional
+            If given, only the person updated by this source is returned.
+        """
+        query = {"external_ids.id": ext_id}
+        if source:
+            query["updated.source"] = source
+        return self._lookup("person", (ext_id, source), lambda: self.db["person"].find_one(
+            query, PERSON_PROJECTION))
+
+    def person_by_name(self, full_name):
+        """
+        Returns the first person with the given full name or None.
+        """
+        return self._lookup("person_name", full_name, lambda: self.db["person"].find_one(
+            {"full_name": full_name}, PERSON_PROJECTION))
+
+    def report(self):
+        """
+        Prints the hit/miss counters of every cache.
+        """
+        for name, cache in self.caches.items():
+            size = len(self.preloaded[name]) if name in self.preloaded.keys() else len(cache)
+            total = cache.hits + cache.misses
+            ratio = cache.hits / total if total else 0
+            print(
+                f"INFO: resolver cache {name}: {cache.hits} hits, {cache.misses} misses ({ratio:.2%} hit ratio), {size} entries")
@@ -25,6 +25,9 @@ class Kahi_post_cleanup_entities(KahiBase):
             post_cleanup_entities: # run this after all works plugins are done
                 num_jobs: 20
                 verbose: 4
+                mode: set # optional, default query
+                dry_run: false # optional, only for set mode
+                batch_size: 1000 # optional, only for set mode
         """
         self.config = config
         self.mongodb_url = config["database_url"]
@@ -40,6 +43,12 @@ class Kahi_post_cleanup_entities(KahiBase):
         ) else 1
         self.verbose = config["post_cleanup_entities"]["verbose"] if "verbose" in config["post_cleanup_entities"].keys(
         ) else 0
+        self.mode = config["post_cleanup_entities"]["mode"] if "mode" in config["post_cleanup_entities"].keys(
+        ) else "query"
+        self.dry_run = config["post_cleanup_entities"]["dry_run"] if "dry_run" in config["post_cleanup_entities"].keys(
+        ) else False
+        self.batch_size = config["post_cleanup_entities"]["batch_size"] if "batch_size" in config["post_cleanup_entities"].keys(
+        ) else 1000
 
     def cleanup_author(self, author):
         """
@@ -72,10 +81,85 @@ class Kahi_post_cleanup_entities(KahiBase):
             return 1
         return 0
 
+    def find_orphans(self, collection, referenced_ids):
+        """
+        find the ids of the collection that are not in the referenced ids
+
+        Parameters:
+        ----------
+        collection : pymongo.collection.Collection
+            collection of the entities
+        referenced_ids : set
+            ids referenced by other collection
+        """
+        return [reg["_id"] for reg in collection.find({}, {"_id": 1}, batch_size=10000)
+                if reg["_id"] not in referenced_ids]
+
+    def delete_orphans(self, collection, orphans):
+        """
+        remove the orphans with batched delete_many, nothing is removed in dry run mode
+
+        Parameters:
+        ----------
+        collection : pymongo.collection.Collection
+            collection of the entities
+        orphans : list
+            ids of the entities to remove
+        """
+        if self.dry_run:
+            if self.verbose > 4:
+                for _id in orphans:
+                    print("INFO: {} orphan {}".format(collection.name, _id))
+            return 0
+        removed = 0
+        for i in range(0, len(orphans), self.batch_size):
+            removed += collection.delete_many(
+                {"_id": {"$in": orphans[i:i + self.batch_size]}}).deleted_count
+        return removed
+
+    def run_set(self):
+        """
+        Run the post cleanup process for authors and affiliations computing the referenced ids
+        in one pass over works and person, the orphans are the anti-join with the entity ids.
+        """
+        authors_ids = set(reg["_id"] for reg in self.works.aggregate([
+            {"$project": {"authors.id": 1}},
+            {"$unwind": "$authors"},
+            {"$group": {"_id": "$authors.id"}}
+        ], allowDiskUse=True))
+        orphan_authors = self.find_orphans(self.person, authors_ids)
+        del authors_ids
+
+        # the affiliations of the orphan authors are not referenced after the authors cleanup
+        orphan_authors_set = set(orphan_authors)
+        affiliations_ids = set()
+        for author in self.person.find({}, {"affiliations.id": 1}, batch_size=10000):
+            if author["_id"] in orphan_authors_set:
+                continue
+            for aff in author.get("affiliations", []):
+                affiliations_ids.add(aff.get("id"))
+        del orphan_authors_set
+        orphan_affiliations = self.find_orphans(
+            self.affiliations, affiliations_ids)
+        del affiliations_ids
+
+        if self.dry_run:
+            print("INFO: Dry run, {} authors and {} affiliations would be removed".format(
+                len(orphan_authors), len(orphan_affiliations)))
+        removed = self.delete_orphans(self.person, orphan_authors)
+        if not self.dry_run:
+            print("INFO: Removed {} authors".format(removed))
+        removed = self.delete_orphans(self.affiliations, orphan_affiliations)
+        if not self.dry_run:
+            print("INFO: Removed {} affiliations".format(removed))
+        return 0
+
     def run(self):
         """
         Run the post cleanup process for authors and affiliations
         """
+        if self.mode == "set":
+            return self.run_set()
         authors = self.person.find({}, {"_id": 1})
         out = Parallel(
             n_jobs=self.n_jobs,
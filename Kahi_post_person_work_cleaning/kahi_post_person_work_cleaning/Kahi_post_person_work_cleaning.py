@@ -1,5 +1,6 @@
 from kahi.KahiBase import KahiBase
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
+from joblib import Parallel, delayed
 
 
 class Kahi_post_person_work_cleaning(KahiBase):
@@ -17,6 +18,13 @@ class Kahi_post_person_work_cleaning(KahiBase):
         self.works = self.db["works"]
         self.person = self.db["person"]
 
+        self.engine = config["post_person_work_cleaning"]["engine"] if "engine" in config["post_person_work_cleaning"].keys(
+        ) else "sequential"
+        self.n_jobs = config["post_person_work_cleaning"]["num_jobs"] if "num_jobs" in config["post_person_work_cleaning"].keys(
+        ) else 1
+        self.verbose = config["post_person_work_cleaning"]["verbose"] if "verbose" in config["post_person_work_cleaning"].keys(
+        ) else 0
+
     def process_one(self, author):
         works = works = list(self.works.find(
             {"authors.id": author["_id"]}, {"authors": 1, "external_ids": 1}))
@@ -52,9 +60,83 @@ class Kahi_post_person_work_cleaning(KahiBase):
                         self.works.update_one({"_id": work['_id']}, {
                                               "$set": {"authors": work["authors"]}})
 
+    def process_one_batch(self, author):
+        """
+        Removes the author id from the works where none of the affiliations of the author
+        in the work is in the affiliations of the person, the checks are done in memory and
+        the edits are written with a single bulk_write using array filters.
+
+        Parameters:
+        ----------
+        author : dict
+            author from the person collection with _id, external_ids and affiliations fields
+
+        Returns:
+        ----------
+        int
+            number of links between the author and the works removed
+        """
+        cod_rh = next((x["id"]["COD_RH"] for x in author["external_ids"] if x["source"] in ("scienti", "minciencias")),
+                      None)
+        affiliations_ids = [aff["id"]
+                            for aff in author.get("affiliations", []) if "id" in aff.keys()]
+        affiliations_set = set(affiliations_ids)
+        ops = []
+        severed = 0
+        for work in self.works.find({"authors.id": author["_id"]}, {"authors.id": 1, "authors.affiliations.id": 1, "external_ids": 1}):
+            cod_rh_work = [
+                x["id"]["COD_RH"]
+                for x in work["external_ids"]
+                if x.get("source") == "scienti" and "COD_RH" in x.get("id", {})
+            ]
+            if cod_rh in cod_rh_work:
+                # The author has the cod_rh in the work
+                continue
+            count = 0
+            for work_author in work["authors"]:
+                if work_author["id"] != author["_id"]:
+                    continue
+                if not work_author.get("affiliations"):
+                    # if not affiliation we assume it is right
+                    continue
+                if not any(aff.get("id") in affiliations_set for aff in work_author["affiliations"]):
+                    count += 1
+            if count:
+                severed += count
+                ops.append(UpdateOne(
+                    {"_id": work["_id"]},
+                    {"$set": {"authors.$[author].id": ""}},
+                    array_filters=[{
+                        "author.id": author["_id"],
+                        "author.affiliations.0": {"$exists": True},
+                        "author.affiliations.id": {"$nin": affiliations_ids}
+                    }]))
+        if ops:
+            self.works.bulk_write(ops, ordered=False)
+        return severed
+
+    def run_batch(self, authors):
+        """
+        Runs the cleaning of the authors in parallel with process_one_batch.
+        """
+        out = Parallel(
+            n_jobs=self.n_jobs,
+            verbose=self.verbose,
+            backend="threading")(
+            delayed(self.process_one_batch)(
+                author
+            ) for author in authors
+        )
+        print("INFO: Removed {} links between authors and works".format(sum(out)))
+
     def run(self):
         # https://github.com/colav/impactu/issues/141
         # only authors from scienti, staff or ciarp
+        if self.engine == "batch":
+            authors = self.person.find({"$or": [{"updated.source": "scienti"}, {
+                "updated.source": "staff"}, {"updated.source": "ciarp"}]}, {"_id": 1, "external_ids": 1, "affiliations.id": 1})
+            self.run_batch(authors)
+            return 0
         authors = list(self.person.find({"$or": [{"updated.source": "scienti"}, {
                        "updated.source": "staff"}, {"updated.source": "ciarp"}]}, {"_id": 1, "external_ids": 1, "affilations": 1}))
         for author in authors:
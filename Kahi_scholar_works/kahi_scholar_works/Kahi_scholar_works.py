@@ -4,6 +4,7 @@ from joblib import Parallel, delayed
 
 from mohan.Similarity import Similarity
 from kahi_scholar_works.process_one import process_one
+from kahi_impactu_utils.Elasticsearch import ElasticsearchSink
 
 
 class Kahi_scholar_works(KahiBase):
@@ -32,6 +33,9 @@ class Kahi_scholar_works(KahiBase):
                 - es_url: The url of the elasticsearch server.
                 - es_user: The user for the elasticsearch server.
                 - es_password: The password for the elasticsearch server.
+                - es_bulk_size: If given, the works are indexed in elasticsearch with _bulk requests of this size.
+                - es_queue_size: Maximum number of works waiting to be indexed in elasticsearch, default 10000.
+                - es_flush_interval: Maximum number of seconds before a work is sent to elasticsearch, default 5.
         """
         self.config = config
 
@@ -81,6 +85,17 @@ class Kahi_scholar_works(KahiBase):
         self.verbose = config["scholar_works"]["verbose"] if "verbose" in config["scholar_works"].keys(
         ) else 0
 
+        self.es_bulk_size = config["scholar_works"]["es_bulk_size"] if "es_bulk_size" in config["scholar_works"].keys(
+        ) else None
+        if self.es_handler and self.es_bulk_size:
+            self.es_handler = ElasticsearchSink(
+                self.es_handler,
+                config["scholar_works"]["es_index"],
+                bulk_size=self.es_bulk_size,
+                queue_size=config["scholar_works"].get("es_queue_size", 10000),
+                flush_interval=config["scholar_works"].get("es_flush_interval", 5),
+                verbose=self.verbose)
+
     def process_scholar(self):
         """
         Method to process the scholar works, and add them to the main database.
@@ -125,4 +140,6 @@ class Kahi_scholar_works(KahiBase):
         Method start the execution of the workflow in parallel.
         """
         self.process_scholar()
+        if isinstance(self.es_handler, ElasticsearchSink):
+            self.es_handler.close()
         return 0
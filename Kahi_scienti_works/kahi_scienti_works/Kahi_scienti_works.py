@@ -3,6 +3,8 @@ from pymongo import MongoClient, TEXT
 from joblib import Parallel, delayed
 from kahi_scienti_works.process_one import process_one
 from mohan.Similarity import Similarity
+from kahi_impactu_utils.Elasticsearch import ElasticsearchSink
+from kahi_impactu_utils.Checkpoint import Checkpoint
 from kahi_impactu_utils.Utils import doi_processor
 import re
 
@@ -34,6 +36,11 @@ class Kahi_scienti_works(KahiBase):
                     - es_url: the URL for the Elasticsearch server
                     - es_user: the username for the Elasticsearch server
                     - es_password: the password for the Elasticsearch server
+                - es_bulk_size: if given, the works are indexed in Elasticsearch with _bulk requests of this size
+                - es_queue_size: the maximum number of works waiting to be indexed, default 10000
+                - es_flush_interval: the maximum number of seconds before a work is sent to Elasticsearch, default 5
+                - checkpoint: if true the progress of every task is saved and a restarted task continues after the last processed record
+                - checkpoint_collection: the collection of the colav database for the checkpoints, default "checkpoints"
         """
         self.config = config
 
@@ -70,6 +77,23 @@ class Kahi_scienti_works(KahiBase):
         ) else 1
         self.verbose = config["scienti_works"]["verbose"] if "verbose" in config["scienti_works"].keys(
         ) else 0
+        self.checkpoint = config["scienti_works"]["checkpoint"] if "checkpoint" in config["scienti_works"].keys(
+        ) else False
+        self.checkpoint_collection = config["scienti_works"]["checkpoint_collection"] if "checkpoint_collection" in config["scienti_works"].keys(
+        ) else "checkpoints"
+        self.doi_chunk_size = config["scienti_works"]["doi_chunk_size"] if "doi_chunk_size" in config["scienti_works"].keys(
+        ) else 100
+
+        self.es_bulk_size = config["scienti_works"]["es_bulk_size"] if "es_bulk_size" in config["scienti_works"].keys(
+        ) else None
+        if self.es_handler and self.es_bulk_size:
+            self.es_handler = ElasticsearchSink(
+                self.es_handler,
+                config["scienti_works"]["es_index"],
+                bulk_size=self.es_bulk_size,
+                queue_size=config["scienti_works"].get("es_queue_size", 10000),
+                flush_interval=config["scienti_works"].get("es_flush_interval", 5),
+                verbose=self.verbose)
 
         # checking if the databases and collections are available
         self.check_databases_and_collections()
@@ -114,11 +138,105 @@ class Kahi_scienti_works(KahiBase):
         verbose : int
             The verbosity level. Default is 0.
         """
+        # one query for the whole group, the records are processed in the order of the group
+        regs = {reg["_id"]: reg for reg in collection_scienti.find(
+            {"_id": {"$in": group["ids"]}})}
         for i in group["ids"]:
-            reg = collection_scienti.find_one({"_id": i})
+            reg = regs.get(i)
+            if reg is None:
+                continue
             process_one(reg, db, collection, empty_work,
                         es_handler, similarity, verbose)
 
+    def process_doi_chunk(self, chunk, **kwargs):
+        """
+        This method processes a chunk of groups of documents with the same DOI (see chunk_doi_groups).
+
+        Parameters
+        ----------
+        chunk : dict
+            A dictionary with the keys _id (the DOI of the last group) and groups (the list of groups).
+        kwargs : dict
+            The rest of the arguments for process_doi_group.
+        """
+        for group in chunk["groups"]:
+            self.process_doi_group(group, **kwargs)
+
+    def chunk_doi_groups(self, groups):
+        """
+        Generator that packs consecutive DOI groups in chunks of about doi_chunk_size records,
+        then every worker receives a similar amount of records no matter the size of the groups.
+        A group is never split, a group bigger than doi_chunk_size is sent alone in its own chunk.
+
+        Parameters
+        ----------
+        groups : iterable
+            The DOI groups, as returned by the $group stage (keys _id and ids).
+        """
+        chunk = []
+        size = 0
+        for group in groups:
+            if chunk and size + len(group["ids"]) > self.doi_chunk_size:
+                yield {"_id": chunk[-1]["_id"], "groups": chunk}
+                chunk = []
+                size = 0
+            chunk.append(group)
+            size += len(group["ids"])
+        if chunk:
+            yield {"_id": chunk[-1]["_id"], "groups": chunk}
+
+    def get_checkpoint(self, db, config, task):
+        """
+        Method to get the checkpoint of a task for a scienti database, None if checkpoints are disabled.
+
+        Parameters:
+        -----------
+        db : Database
+            The MongoDB database where the checkpoints are saved. (colav database genrated by the kahi)
+        config : dict
+            A dictionary with the configuration for the scienti database.
+        task : str
+            The name of the task.
+        """
+        if not self.checkpoint:
+            return None
+        # the queued elasticsearch documents have to be indexed before moving the checkpoint
+        before_save = self.es_handler.flush if isinstance(
+            self.es_handler, ElasticsearchSink) else None
+        return Checkpoint(db[self.checkpoint_collection], "scienti_works",
+                          f'{config["database_name"]}.{config["collection_name"]}/{task}',
+                          before_save=before_save, verbose=self.verbose)
+
+    def run_parallel(self, function, records, checkpoint, **kwargs):
+        """
+        Method to run a function over the records in parallel,
+        when a checkpoint is given the progress is saved while the results are received.
+
+        Parameters:
+        -----------
+        function : callable
+            The function to be run, it receives a record as first argument.
+        records : iterable
+            The records to be processed, sorted by _id if a checkpoint is given.
+        checkpoint : Checkpoint
+            The checkpoint of the task or None.
+        kwargs : dict
+            The rest of the arguments for the function.
+        """
+        parallel_kwargs = {}
+        if checkpoint:
+            records = checkpoint.track(records)
+            parallel_kwargs["return_as"] = "generator"
+        results = Parallel(
+            n_jobs=self.n_jobs,
+            verbose=self.verbose,
+            backend="threading",
+            **parallel_kwargs)(
+            delayed(function)(record, **kwargs) for record in records
+        )
+        if checkpoint:
+            checkpoint.consume(results)
+
     def process_scienti(self, db, collection, config):
         """
         Method to process the scienti database.
@@ -164,22 +282,26 @@ class Kahi_scienti_works(KahiBase):
                 {"$project": {"doi": {"$toLower": "$doi"}}},
                 {"$group": {"_id": "$doi", "ids": {"$push": "$_id"}}}
             ]
+            checkpoint = self.get_checkpoint(db, config, "doi")
+            if checkpoint:
+                # the groups are processed in doi order, resuming after the last processed doi
+                pipeline.append({"$sort": {"_id": 1}})
+                if checkpoint.last_id is not None:
+                    pipeline.append(
+                        {"$match": {"_id": {"$gt": checkpoint.last_id}}})
             paper_group_doi_cursor = scienti.aggregate(
-                pipeline)  # update for doi and not doi
-            Parallel(
-                n_jobs=self.n_jobs,
-                verbose=self.verbose,
-                backend="threading")(
-                delayed(self.process_doi_group)(
-                    doi_group,
-                    db,
-                    collection,
-                    scienti,
-                    self.empty_work(),
-                    self.es_handler,
-                    similarity=False,
-                    verbose=self.verbose
-                ) for doi_group in paper_group_doi_cursor
+                pipeline, allowDiskUse=True)  # update for doi and not doi
+            self.run_parallel(
+                self.process_doi_chunk,
+                self.chunk_doi_groups(paper_group_doi_cursor),
+                checkpoint,
+                db=db,
+                collection=collection,
+                collection_scienti=scienti,
+                empty_work=self.empty_work(),
+                es_handler=self.es_handler,
+                similarity=False,
+                verbose=self.verbose
             )
         else:
             # correr doi processor para TXT_DOI y TXT_WEBSITE*
@@ -198,7 +320,7 @@ class Kahi_scienti_works(KahiBase):
                             "ids": {"$push": "$_id"}}}
             ]
             paper_group_doi_cursor = scienti.aggregate(
-                pipeline)  # update for doi and not doi
+                pipeline, allowDiskUse=True)  # update for doi and not doi
 
             works_nodoi = []
             count = 0
@@ -220,42 +342,45 @@ class Kahi_scienti_works(KahiBase):
                 if not doi:
                     works_nodoi.extend(scienti_reg["ids"])
             print(f"INFO: processing {len(works_nodoi)} records with bad dois")
-            paper_cursor = scienti.find(
-                {"_id": {"$in": works_nodoi}, "TXT_NME_PROD_FILTRO": {"$ne": None}, "TXT_NME_PROD": {"$ne": ' '}, "product_type.COD_TIPO_PRODUCTO": {"$in": types_level0}})
-            Parallel(
-                n_jobs=self.n_jobs,
-                verbose=self.verbose,
-                backend="threading")(
-                delayed(process_one)(
-                    work,
-                    db,
-                    collection,
-                    self.empty_work(),
-                    self.es_handler,
-                    similarity=True,
-                    verbose=self.verbose
-                ) for work in paper_cursor
+            query = {"_id": {"$in": works_nodoi}, "TXT_NME_PROD_FILTRO": {"$ne": None}, "TXT_NME_PROD": {"$ne": ' '}, "product_type.COD_TIPO_PRODUCTO": {"$in": types_level0}}
+            checkpoint = self.get_checkpoint(db, config, "bad_doi")
+            if checkpoint:
+                # the records are processed in _id order, resuming after the last processed record
+                paper_cursor = scienti.find(
+                    checkpoint.query(query), sort=[("_id", 1)])
+            else:
+                paper_cursor = scienti.find(query)
+            self.run_parallel(
+                process_one,
+                paper_cursor,
+                checkpoint,
+                db=db,
+                collection=collection,
+                empty_work=self.empty_work(),
+                es_handler=self.es_handler,
+                similarity=True,
+                verbose=self.verbose
             )
 
-            paper_cursor = scienti.find(
-                {"$or": [{"doi": {"$eq": ""}}, {"doi": {"$eq": None}}], "TXT_NME_PROD_FILTRO": {"$ne": None}, "TXT_NME_PROD": {"$ne": ' '}, "product_type.COD_TIPO_PRODUCTO": {"$in": types_level0}})
-            paper_cursor_count = scienti.count_documents(
-                {"$or": [{"doi": {"$eq": ""}}, {"doi": {"$eq": None}}], "TXT_NME_PROD_FILTRO": {"$ne": None}, "TXT_NME_PROD": {"$ne": ' '}, "product_type.COD_TIPO_PRODUCTO": {"$in": types_level0}})
+            query = {"$or": [{"doi": {"$eq": ""}}, {"doi": {"$eq": None}}], "TXT_NME_PROD_FILTRO": {"$ne": None}, "TXT_NME_PROD": {"$ne": ' '}, "product_type.COD_TIPO_PRODUCTO": {"$in": types_level0}}
+            paper_cursor_count = scienti.count_documents(query)
             print(f"INFO: processing {paper_cursor_count} records without doi")
-
-            Parallel(
-                n_jobs=self.n_jobs,
-                verbose=self.verbose,
-                backend="threading")(
-                delayed(process_one)(
-                    work,
-                    db,
-                    collection,
-                    self.empty_work(),
-                    self.es_handler,
-                    similarity=True,
-                    verbose=self.verbose
-                ) for work in paper_cursor
+            checkpoint = self.get_checkpoint(db, config, "no_doi")
+            if checkpoint:
+                paper_cursor = scienti.find(
+                    checkpoint.query(query), sort=[("_id", 1)])
+            else:
+                paper_cursor = scienti.find(query)
+            self.run_parallel(
+                process_one,
+                paper_cursor,
+                checkpoint,
+                db=db,
+                collection=collection,
+                empty_work=self.empty_work(),
+                es_handler=self.es_handler,
+                similarity=True,
+                verbose=self.verbose
             )
         client.close()
 
@@ -267,4 +392,6 @@ class Kahi_scienti_works(KahiBase):
             if self.verbose > 4:
                 print("Updating already inserted entries")
             self.process_scienti(self.db, self.collection, config)
+        if isinstance(self.es_handler, ElasticsearchSink):
+            self.es_handler.close()
         return 0
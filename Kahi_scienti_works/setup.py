@@ -82,7 +82,7 @@ def main():
         install_requires=[
             'kahi',
             'pymongo',
-            'joblib',
+            'joblib>=1.3',
             'kahi_impactu_utils',
             'mohan'],
     )
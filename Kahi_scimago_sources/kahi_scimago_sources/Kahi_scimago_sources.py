@@ -1,5 +1,6 @@
 from kahi.KahiBase import KahiBase
-from pymongo import MongoClient
+from pymongo import MongoClient, InsertOne, UpdateOne
+from bson import ObjectId
 from datetime import datetime as dt
 from time import time
 from pandas import read_csv
@@ -27,6 +28,13 @@ class Kahi_scimago_sources(KahiBase):
 
         self.scimago_file_paths = self.config["scimago_sources"]["file_path"]
 
+        self.engine = self.config["scimago_sources"]["engine"] if "engine" in self.config["scimago_sources"].keys(
+        ) else "yearly"
+        self.bulk_size = self.config["scimago_sources"]["bulk_size"] if "bulk_size" in self.config["scimago_sources"].keys(
+        ) else 1000
+        self.verbose = self.config["scimago_sources"]["verbose"] if "verbose" in self.config["scimago_sources"].keys(
+        ) else 0
+
         self.already_in_db = []
 
     def _normalize_spaces(self, s: str) -> str:
@@ -108,7 +116,17 @@ class Kahi_scimago_sources(KahiBase):
     def update_scimago(self, sjr, entry):
         _id = entry["_id"]
         del (entry["_id"])
+        self.update_scimago_entry(sjr, entry)
+        self.collection.update_one({"_id": _id}, {"$set": entry})
 
+    def update_scimago_entry(self, sjr, entry):
+        """
+        Updates a source entry with the scimago record of the current year, the entry is modified in place.
+
+        Args:
+            sjr (pd.Series): Scimago journal record.
+            entry (dict): The source entry to update, without the _id.
+        """
         if "scimago" not in [upd["source"] for upd in entry["updated"]]:
             entry["updated"].append(
                 {"source": "scimago", "time": int(time())})
@@ -216,7 +234,119 @@ class Kahi_scimago_sources(KahiBase):
                 "subjects": scimago_subjects
             })
 
-        self.collection.update_one({"_id": _id}, {"$set": entry})
+    def build_scimago_entry(self, sjr, ext_ids):
+        """
+        Builds a new source entry from a scimago record.
+
+        Args:
+            sjr (pd.Series): Scimago journal record.
+            ext_ids (list): The issn external ids of the record.
+        Returns:
+            dict: The source entry.
+        """
+        entry = self.empty_source()
+        entry["updated"] = [{"source": "scimago", "time": int(time())}]
+        entry["types"].append(
+            {"source": "scimago", "type": sjr["Type"]})
+        entry["external_ids"] = ext_ids
+        entry["external_ids"].append(
+            {"source": "scimago", "id": int(sjr["Sourceid"])})
+        entry["names"] = [
+            {"lang": "en", "name": sjr["Title"], "source": "scimago"}]
+        country = None
+        try:
+            if sjr["Country"] == "United States":
+                sjr["Country"] = "United States of America"
+            elif sjr["Country"] == "United Kingdom":
+                sjr["Country"] = "United Kingdom of Great Britain and Northern Ireland"
+            elif sjr["Country"] == "South Korea":
+                sjr["Country"] = "Korea, Republic of"
+            elif sjr["Country"] == "Czech Republic":
+                sjr["Country"] = "Czechia"
+            elif sjr["Country"] == "Taiwan":
+                sjr["Country"] = "Taiwan, Province of China"
+            elif sjr["Country"] == "Iran":
+                sjr["Country"] = "Iran, Islamic Republic of"
+            elif sjr["Country"] == "Moldova":
+                sjr["Country"] = "Moldova, Republic of"
+            elif sjr["Country"] == "Venezuela":
+                sjr["Country"] = "Venezuela, Bolivarian Republic of"
+            elif sjr["Country"] == "Macedonia":
+                sjr["Country"] = "North Macedonia"
+            elif sjr["Country"] == "Palestine":
+                sjr["Country"] = "Palestine, State of"
+            elif sjr["Country"] == "Turkey":
+                sjr["Country"] = "Türkiye"
+            elif sjr["Country"] == "Vatican City State":
+                sjr["Country"] = "Holy See"
+            elif sjr["Country"] == "Tanzania":
+                sjr["Country"] = "Tanzania, United Republic of"
+            elif sjr["Country"] == "Bolivia":
+                sjr["Country"] = "Bolivia, Plurinational State of"
+
+            country = iso3166.countries_by_name.get(
+                sjr["Country"].upper()).alpha2
+        except Exception as e:
+            print(e, sjr["Country"])
+        if country:
+            entry["publisher"] = {
+                "country_code": country, "name": sjr["Publisher"]}
+        entry["ranking"].append({
+            "to_date": 1640995199,
+            "from_date": 1640995199,
+            "rank": sjr["SJR Best Quartile"],
+            "order": int(sjr["Rank"]) if sjr["Rank"] else None,
+            "source": "Scimago Best Quartile"
+        })
+        entry["ranking"].append({
+            "to_date": 1640995199,
+            "from_date": 1640995199,
+            "rank": int(sjr["H index"]),
+            "order": int(sjr["Rank"]) if sjr["Rank"] else None,
+            "source": "Scimago hindex"
+        })
+        if sjr.get("Open Access") and sjr.get("Open Access Diamond"):
+            entry["open_access"].append({
+                "provenance": "scimago",
+                "is_open_access": True if sjr.get("Open Access") == "Yes" else False,
+                "open_access_diamond": True if sjr.get("Open Access Diamond") == "Yes" else False
+            })
+        if sjr["SJR"]:
+            rank = ""
+            if isinstance(sjr["SJR"], str):
+                rank = float(sjr["SJR"].replace(",", "."))
+            else:
+                rank = sjr["SJR"]
+            entry["ranking"].append({
+                "to_date": 1640995199,
+                "from_date": 1640995199,
+                "rank": rank,
+                "order": int(sjr["Rank"]) if sjr["Rank"] else None,
+                "source": "Scimago"
+            })
+
+        # Upsert category rankings
+        self.upsert_scimago_category_rankings(sjr, entry)
+
+        scimago_subjects = []
+        for cat in sjr["Categories"].split(";"):
+            cat_clean = self._normalize_spaces(cat)
+            m = self._CAT_RE.match(cat_clean)
+            if m:
+                cat_name = self._normalize_spaces(m.group("name"))
+            else:
+                cat_name = cat_clean.split(" (")[0].strip()
+            scimago_subjects.append({
+                "id": "",
+                "name": cat_name,
+                "level": None,
+                "external_ids": []
+            })
+        entry["subjects"].append({
+            "source": "Scimago",
+            "subjects": scimago_subjects
+        })
+        return entry
 
     def process_scimago(self):
         for issn_list in self.scimago["Issn"].unique():
@@ -239,120 +369,136 @@ class Kahi_scimago_sources(KahiBase):
                 sjr = sjr.iloc[0]
                 self.update_scimago(sjr, db_reg)
             else:
-                entry = self.empty_source()
-                entry["updated"] = [{"source": "scimago", "time": int(time())}]
                 sjr = self.scimago[self.scimago["Issn"] == issn_list]
                 sjr = sjr.iloc[0]
-                entry["types"].append(
-                    {"source": "scimago", "type": sjr["Type"]})
-                entry["external_ids"] = ext_ids
-                entry["external_ids"].append(
-                    {"source": "scimago", "id": int(sjr["Sourceid"])})
-                entry["names"] = [
-                    {"lang": "en", "name": sjr["Title"], "source": "scimago"}]
-                country = None
-                try:
-                    if sjr["Country"] == "United States":
-                        sjr["Country"] = "United States of America"
-                    elif sjr["Country"] == "United Kingdom":
-                        sjr["Country"] = "United Kingdom of Great Britain and Northern Ireland"
-                    elif sjr["Country"] == "South Korea":
-                        sjr["Country"] = "Korea, Republic of"
-                    elif sjr["Country"] == "Czech Republic":
-                        sjr["Country"] = "Czechia"
-                    elif sjr["Country"] == "Taiwan":
-                        sjr["Country"] = "Taiwan, Province of China"
-                    elif sjr["Country"] == "Iran":
-                        sjr["Country"] = "Iran, Islamic Republic of"
-                    elif sjr["Country"] == "Moldova":
-                        sjr["Country"] = "Moldova, Republic of"
-                    elif sjr["Country"] == "Venezuela":
-                        sjr["Country"] = "Venezuela, Bolivarian Republic of"
-                    elif sjr["Country"] == "Macedonia":
-                        sjr["Country"] = "North Macedonia"
-                    elif sjr["Country"] == "Palestine":
-                        sjr["Country"] = "Palestine, State of"
-                    elif sjr["Country"] == "Turkey":
-                        sjr["Country"] = "Türkiye"
-                    elif sjr["Country"] == "Vatican City State":
-                        sjr["Country"] = "Holy See"
-                    elif sjr["Country"] == "Tanzania":
-                        sjr["Country"] = "Tanzania, United Republic of"
-                    elif sjr["Country"] == "Bolivia":
-                        sjr["Country"] = "Bolivia, Plurinational State of"
-
-                    country = iso3166.countries_by_name.get(
-                        sjr["Country"].upper()).alpha2
-                except Exception as e:
-                    print(e, sjr["Country"])
-                if country:
-                    entry["publisher"] = {
-                        "country_code": country, "name": sjr["Publisher"]}
-                entry["ranking"].append({
-                    "to_date": 1640995199,
-                    "from_date": 1640995199,
-                    "rank": sjr["SJR Best Quartile"],
-                    "order": int(sjr["Rank"]) if sjr["Rank"] else None,
-                    "source": "Scimago Best Quartile"
-                })
-                entry["ranking"].append({
-                    "to_date": 1640995199,
-                    "from_date": 1640995199,
-                    "rank": int(sjr["H index"]),
-                    "order": int(sjr["Rank"]) if sjr["Rank"] else None,
-                    "source": "Scimago hindex"
-                })
-                if sjr.get("Open Access") and sjr.get("Open Access Diamond"):
-                    entry["open_access"].append({
-                        "provenance": "scimago",
-                        "is_open_access": True if sjr.get("Open Access") == "Yes" else False,
-                        "open_access_diamond": True if sjr.get("Open Access Diamond") == "Yes" else False
-                    })
-                if sjr["SJR"]:
-                    rank = ""
-                    if isinstance(sjr["SJR"], str):
-                        rank = float(sjr["SJR"].replace(",", "."))
-                    else:
-                        rank = sjr["SJR"]
-                    entry["ranking"].append({
-                        "to_date": 1640995199,
-                        "from_date": 1640995199,
-                        "rank": rank,
-                        "order": int(sjr["Rank"]) if sjr["Rank"] else None,
-                        "source": "Scimago"
-                    })
-
-                # Upsert category rankings
-                self.upsert_scimago_category_rankings(sjr, entry)
-
-                scimago_subjects = []
-                for cat in sjr["Categories"].split(";"):
-                    cat_clean = self._normalize_spaces(cat)
-                    m = self._CAT_RE.match(cat_clean)
-                    if m:
-                        cat_name = self._normalize_spaces(m.group("name"))
-                    else:
-                        cat_name = cat_clean.split(" (")[0].strip()
-                    scimago_subjects.append({
-                        "id": "",
-                        "name": cat_name,
-                        "level": None,
-                        "external_ids": []
-                    })
-                entry["subjects"].append({
-                    "source": "Scimago",
-                    "subjects": scimago_subjects
-                })
+                entry = self.build_scimago_entry(sjr, ext_ids)
                 self.collection.insert_one(entry)
 
+    def set_scimago_year(self, filename):
+        """
+        Sets the year and the timestamps of the rankings from the name of a scimago file (ex: scimagojr 2020.csv).
+
+        Args:
+            filename (str): Path of the scimago csv.
+        """
+        self.scimago_year = int(
+            filename.replace(".csv", "").split(" ")[-1])
+        self.scimago_start_ts = dt.strptime(
+            "01 01 " + str(self.scimago_year), "%d %m %Y").timestamp()
+        self.scimago_end_ts = dt.strptime(
+            "31 12 " + str(self.scimago_year), "%d %m %Y").timestamp()
+
+    def load_scimago_years(self):
+        """
+        Reads all the scimago files, keeping the first record of every Issn list of every year
+        (the record used by process_scimago).
+
+        Returns:
+            list: (filename, records) for every file in the order of the configuration,
+            records being a list of (issn_list, sjr) in the order of the csv.
+        """
+        years = []
+        for filename in self.scimago_file_paths:
+            scimago = read_csv(filename, sep=";", dtype={"Sourceid": str})
+            first = scimago.groupby("Issn", sort=False).head(1)
+            years.append((filename, [(sjr["Issn"], sjr)
+                         for _, sjr in first.iterrows()]))
+            if self.verbose > 0:
+                print(f"INFO: {len(first)} journals read from {filename}")
+        return years
+
+    def find_scimago_sources(self, years):
+        """
+        Finds the sources of the database that have any of the issns of the scimago files with a single query.
+
+        Args:
+            years (list): Output of load_scimago_years.
+        Returns:
+            tuple: sources (_id -> entry without the _id) and index (issn external id -> _id).
+        """
+        extids = set()
+        for _, records in years:
+            for issn_list, _ in records:
+                for issn in issn_list.split(","):
+                    issn = issn.strip()
+                    extids.add(issn[:4] + "-" + issn[4:])
+        sources = {}
+        index = {}
+        for reg in self.collection.find({"external_ids.id": {"$in": list(extids)}}):
+            _id = reg.pop("_id")
+            sources[_id] = reg
+            for ext in reg["external_ids"]:
+                if ext["id"] in extids:
+                    index.setdefault(ext["id"], _id)
+        return sources, index
+
+    def write_scimago_sources(self, sources, inserted, updated):
+        """
+        Writes the final state of the sources with bulk_write, one operation per source.
+
+        Args:
+            sources (dict): _id -> entry without the _id.
+            inserted (set): _ids of the new sources.
+            updated (set): _ids of the sources of the database that were updated.
+        """
+        ops = [InsertOne({"_id": _id, **sources[_id]}) for _id in inserted]
+        ops.extend(UpdateOne({"_id": _id}, {"$set": sources[_id]})
+                   for _id in updated)
+        for i in range(0, len(ops), self.bulk_size):
+            self.collection.bulk_write(
+                ops[i:i + self.bulk_size], ordered=False)
+        if self.verbose > 0:
+            print(
+                f"INFO: {len(inserted)} sources inserted and {len(updated)} updated")
+
+    def process_scimago_years(self):
+        """
+        Processes all the scimago files in one pass, the issns of all the years are resolved
+        with a single query and the years are applied in order over the sources kept in memory,
+        then every source is written once with bulk_write.
+        The sources obtained are the same of processing the files one by one with process_scimago.
+        """
+        years = self.load_scimago_years()
+        sources, index = self.find_scimago_sources(years)
+        inserted = set()
+        updated = set()
+        for filename, records in years:
+            self.set_scimago_year(filename)
+            for issn_list, sjr in records:
+                _id = None
+                ext_ids = []
+                found_issn = None
+                for issn in issn_list.split(","):
+                    issn = issn.strip()
+                    extid = issn[:4] + "-" + issn[4:]
+                    _id = index.get(extid)
+                    if _id:
+                        found_issn = issn
+                        break
+                    ext_ids.append({"source": "issn", "id": extid})
+                if _id:
+                    self.already_in_db.append(found_issn)
+                    self.update_scimago_entry(sjr, sources[_id])
+                    if _id not in inserted:
+                        updated.add(_id)
+                else:
+                    _id = ObjectId()
+                    sources[_id] = self.build_scimago_entry(sjr, ext_ids)
+                    inserted.add(_id)
+                # the issns added to the source are found by the next years
+                for ext in sources[_id]["external_ids"]:
+                    if isinstance(ext["id"], str):
+                        index.setdefault(ext["id"], _id)
+            if self.verbose > 0:
+                print(f"INFO: {filename} processed")
+        self.write_scimago_sources(sources, inserted, updated)
+
     def run(self):
+        if self.engine == "multi_year":
+            self.process_scimago_years()
+            return 0
         for filename in self.scimago_file_paths:
-            self.scimago_year = int(
-                filename.replace(".csv", "").split(" ")[-1])
-            self.scimago_start_ts = dt.strptime(
-                "01 01 " + str(self.scimago_year), "%d %m %Y").timestamp()
-            self.scimago_end_ts = dt.strptime(
-                "31 12 " + str(self.scimago_year), "%d %m %Y").timestamp()
+            self.set_scimago_year(filename)
             self.scimago = read_csv(filename,
                                     sep=";", dtype={"Sourceid": str})
             self.process_scimago()
@@ -2,6 +2,8 @@ from kahi.KahiBase import KahiBase
 from pymongo import MongoClient, TEXT
 from time import time
 from joblib import Parallel, delayed
+from kahi_impactu_utils.Checkpoint import Checkpoint
+from kahi_scopus_works.parser import parse_scopus_chunks
 from math import isnan
 from re import split, UNICODE
 from kahi_impactu_utils.Utils import doi_processor, lang_poll
@@ -129,10 +131,16 @@ def parse_scopus(reg, empty_work, verbose=0):
     return entry
 
 
-def process_one(scopus_reg, db, collection, empty_work, verbose=0):
+def process_one(scopus_reg, db, collection, empty_work, verbose=0, entry=None):
     doi = None
     # register has doi
-    if scopus_reg["DOI"]:
+    if entry is not None:
+        # already parsed by the columnar parser, the doi was processed there
+        for ext in entry["external_ids"]:
+            if ext["source"] == "doi":
+                doi = ext["id"]
+                break
+    elif scopus_reg["DOI"]:
         if isinstance(scopus_reg["DOI"], str):
             doi = doi_processor(scopus_reg["DOI"])
     if doi:
@@ -145,8 +153,9 @@ def process_one(scopus_reg, db, collection, empty_work, verbose=0):
                     # client.close()
                     return None  # Register already on db
                     # Could be updated with new information when scopus database changes
-            entry = parse_scopus(
-                scopus_reg, empty_work.copy(), verbose=verbose)
+            if entry is None:
+                entry = parse_scopus(
+                    scopus_reg, empty_work.copy(), verbose=verbose)
             colav_reg["updated"].append(
                 {"source": "scopus", "time": int(time())})
             # titles
@@ -194,8 +203,9 @@ def process_one(scopus_reg, db, collection, empty_work, verbose=0):
             )
         else:  # insert a new register
             # parse
-            entry = parse_scopus(
-                scopus_reg, empty_work.copy(), verbose=verbose)
+            if entry is None:
+                entry = parse_scopus(
+                    scopus_reg, empty_work.copy(), verbose=verbose)
             # link
             source_db = None
             if "external_ids" in entry["source"].keys():
@@ -371,27 +381,71 @@ class Kahi_scopus_works(KahiBase):
         ) else 1
         self.verbose = config["scopus_works"]["verbose"] if "verbose" in config["scopus_works"].keys(
         ) else 0
+        self.checkpoint = config["scopus_works"]["checkpoint"] if "checkpoint" in config["scopus_works"].keys(
+        ) else False
+        self.checkpoint_collection = config["scopus_works"]["checkpoint_collection"] if "checkpoint_collection" in config["scopus_works"].keys(
+        ) else "checkpoints"
+        self.parser = config["scopus_works"]["parser"] if "parser" in config["scopus_works"].keys(
+        ) else "row"
+        self.parse_chunk_size = config["scopus_works"]["parse_chunk_size"] if "parse_chunk_size" in config["scopus_works"].keys(
+        ) else 10000
 
         self.client.close()
 
     def process_scopus(self):
-        paper_list = list(self.scopus_collection.find())
         with MongoClient(self.mongodb_url) as client:
             db = client[self.config["database_name"]]
             collection = db["works"]
 
-            Parallel(
-                n_jobs=self.n_jobs,
-                verbose=self.verbose,
-                backend="threading")(
-                delayed(process_one)(
-                    paper,
-                    db,
-                    collection,
-                    self.empty_work(),
-                    verbose=self.verbose
-                ) for paper in paper_list
-            )
+            checkpoint = None
+            parallel_kwargs = {}
+            cursor = None
+            if self.checkpoint:
+                checkpoint = Checkpoint(
+                    db[self.checkpoint_collection],
+                    "scopus_works",
+                    f'{self.config["scopus_works"]["database_name"]}.{self.config["scopus_works"]["collection_name"]}',
+                    verbose=self.verbose)
+                # the records are processed in _id order, resuming after the last processed record
+                cursor = self.scopus_collection.find(
+                    checkpoint.query({}), sort=[("_id", 1)], no_cursor_timeout=True)
+                paper_list = checkpoint.track(cursor)
+                parallel_kwargs["return_as"] = "generator"
+            elif self.parser == "columnar":
+                cursor = self.scopus_collection.find(
+                    no_cursor_timeout=True, batch_size=self.parse_chunk_size)
+                paper_list = cursor
+            else:
+                paper_list = list(self.scopus_collection.find())
+
+            try:
+                if self.parser == "columnar":
+                    # the checkpoint tracks the records when they are read, there is one task per record in the same order
+                    papers = parse_scopus_chunks(
+                        paper_list, self.empty_work(), self.parse_chunk_size, self.verbose)
+                else:
+                    papers = ((paper, None) for paper in paper_list)
+
+                results = Parallel(
+                    n_jobs=self.n_jobs,
+                    verbose=self.verbose,
+                    backend="threading",
+                    **parallel_kwargs)(
+                    delayed(process_one)(
+                        paper,
+                        db,
+                        collection,
+                        self.empty_work(),
+                        verbose=self.verbose,
+                        entry=entry
+                    ) for paper, entry in papers
+                )
+                if checkpoint:
+                    checkpoint.consume(results)
+            finally:
+                # the cursors have no timeout, they have to be closed even if a worker fails
+                if cursor is not None:
+                    cursor.close()
 
     def run(self):
         self.process_scopus()
@@ -0,0 +1,291 @@
+from kahi_impactu_utils.Utils import doi_processor, lang_poll
+from copy import deepcopy
+from time import time
+import pandas as pd
+import re
+
+# author and affiliation of every entry of "Authors with affiliations", ex: "Doe, J., Universidad de Antioquia, Medellín, Colombia"
+AUTHOR_AFFILIATION_REGEX = re.compile(
+    r'(^[\w\-\s\.]+,\s+[\w\s\.\-]+,\s)', re.UNICODE)
+
+
+def normalize_frame(df):
+    """
+    Returns the DataFrame with the NaN values of every column replaced by None.
+    """
+    return df.astype(object).where(df.notna(), None)
+
+
+def is_string(series):
+    """
+    Mask of the non empty strings of a column.
+    """
+    return series.map(lambda x: isinstance(x, str) and x != "")
+
+
+def present(series):
+    """
+    Mask of the values that are not None nor empty (the reg[key] and reg[key] == reg[key] checks of parse_scopus).
+    """
+    return series.notna() & series.astype(bool)
+
+
+def column(df, name, mask=None, values=None):
+    """
+    Returns the values of a column as a list with None where the mask is False,
+    or None if the column is not in the DataFrame.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Normalized chunk of records.
+    name : str
+        Name of the column.
+    mask : pandas.Series, optional
+        Values to keep, by default all of them.
+    values : pandas.Series, optional
+        Transformed values of the column, by default the column itself.
+    """
+    if name not in df.columns:
+        return None
+    if values is None:
+        values = df[name]
+    if mask is not None:
+        values = values.astype(object).where(mask, None)
+    return values.tolist()
+
+
+def parse_authors(authors_affiliations, authors_ids, doi, verbose=0):
+    """
+    Parses the authors of a record from the list of "Authors with affiliations" and the list of "Author(s) ID".
+
+    Parameters
+    ----------
+    authors_affiliations : list
+        Entries of "Authors with affiliations" split by "; ".
+    authors_ids : list
+        Entries of "Author(s) ID" split by ";" or None.
+    doi : str
+        DOI of the record, used in the messages.
+    verbose : int
+        Verbosity level.
+    """
+    authors = []
+    for i, auwaf in enumerate(authors_affiliations):
+        auaf = AUTHOR_AFFILIATION_REGEX.split(auwaf)
+        if len(auaf) == 1:
+            author = auaf[0]
+            aff_name = ""
+        else:
+            author = auaf[1]
+            affiliations = auaf[-1].split(",")
+            aff_name = affiliations[-3].strip() if len(
+                affiliations) > 2 else auaf[-1].strip()
+        author_entry = {
+            "full_name": author.replace("-", " ").strip(),
+            "types": [],
+            "affiliations": [{"name": aff_name}],
+            "external_ids": []
+        }
+        if authors_ids:
+            if i < len(authors_ids):
+                author_entry["external_ids"] = [
+                    {"source": "scopus", "id": authors_ids[i]}] if authors_ids[i] else []
+            else:
+                print("Not all authors have ids in doi ", doi)
+        authors.append(author_entry)
+    return authors
+
+
+def parse_scopus_frame(df, empty_work, verbose=0):
+    """
+    Parses a chunk of scopus records into work entries, the same entries of parse_scopus.
+
+    The NaN values are normalized, and the ISSNs, DOIs, keywords and languages of the titles
+    are computed for the whole chunk with column operations (the DOIs and languages once per distinct value),
+    then the entries are assembled from the columns.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        Chunk of records of the scopus collection.
+    empty_work : dict
+        A template for the work entry. Structure is defined in the schema.
+    verbose : int
+        Verbosity level.
+
+    Returns
+    -------
+    list
+        Work entries in the order of the rows.
+    """
+    df = normalize_frame(df)
+    n = len(df)
+    now = int(time())
+
+    titles = df["Title"].tolist()
+    langs = {title: lang_poll(title) for title in set(titles)}
+
+    def keywords(name):
+        if name not in df.columns:
+            return None
+        values = df[name]
+        return column(df, name, present(values), values.where(is_string(values)).str.lower().str.split("; "))
+
+    index_keywords = keywords("Index Keywords")
+    author_keywords = keywords("Author Keywords")
+
+    raw_dois = column(df, "DOI")
+    dois = None
+    if "DOI" in df.columns:
+        valid = is_string(df["DOI"])
+        processed = {doi: doi_processor(doi)
+                     for doi in df["DOI"][valid].unique()}
+        dois = column(df, "DOI", valid, df["DOI"].map(processed))
+
+    issns = None
+    if "ISSN" in df.columns:
+        valid = is_string(df["ISSN"])
+        issn = df["ISSN"].where(valid)
+        issns = column(df, "ISSN", valid, issn.str[:4] + "-" + issn.str[4:])
+
+    authors_ids = None
+    if "Author(s) ID" in df.columns:
+        authors_ids = column(df, "Author(s) ID", is_string(df["Author(s) ID"]),
+                             df["Author(s) ID"].where(is_string(df["Author(s) ID"])).str.split(";"))
+    authors_affiliations = None
+    if "Authors with affiliations" in df.columns:
+        values = df["Authors with affiliations"]
+        authors_affiliations = column(df, "Authors with affiliations", present(values) & is_string(values),
+                                      values.where(is_string(values)).str.split("; "))
+
+    cited_by = None
+    if "Cited by" in df.columns:
+        values = df["Cited by"]
+        strings = values.map(lambda x: isinstance(x, str))
+        if verbose > 4:
+            for doi in df["DOI"][strings] if "DOI" in df.columns else []:
+                print("Error parsing citations count in doi ", doi)
+                print("Cited by is a string instead of a integer")
+        counts = pd.to_numeric(values.where(~strings), errors="coerce")
+        cited_by = column(df, "Cited by", counts.notna(), counts)
+
+    columns = {
+        "Abstract": column(df, "Abstract", present(df["Abstract"])) if "Abstract" in df.columns else None,
+        "Year": column(df, "Year"),
+        "Document Type": column(df, "Document Type"),
+        "EID": column(df, "EID"),
+        "Pubmed ID": column(df, "Pubmed ID"),
+        "ISBN": column(df, "ISBN", is_string(df["ISBN"])) if "ISBN" in df.columns else None,
+        "Link": column(df, "Link"),
+        "Source title": column(df, "Source title", present(df["Source title"])) if "Source title" in df.columns else None,
+        "CODEN": column(df, "CODEN", is_string(df["CODEN"])) if "CODEN" in df.columns else None,
+    }
+    bibliographic_info = [(name, key, column(df, name, present(df[name])))
+                          for name, key in [("Volume", "volume"), ("Issue", "issue"),
+                                            ("Page start", "start_page"), ("Page end", "end_page")]
+                          if name in df.columns]
+
+    entries = []
+    for i in range(n):
+        entry = deepcopy(empty_work)
+        entry["updated"] = [{"source": "scopus", "time": now}]
+        entry["titles"].append(
+            {"title": titles[i], "lang": langs[titles[i]], "source": "scopus"})
+        if columns["Abstract"] and columns["Abstract"][i] is not None:
+            entry["abstract"] = columns["Abstract"][i]
+        if columns["Year"]:
+            entry["year_published"] = columns["Year"][i]
+
+        if columns["Document Type"]:
+            entry["types"].append(
+                {"source": "scopus", "type": columns["Document Type"][i]})
+        if index_keywords and index_keywords[i] is not None:
+            entry["keywords"].extend(index_keywords[i])
+        if author_keywords and author_keywords[i] is not None:
+            entry["keywords"].extend(author_keywords[i])
+
+        if dois:
+            entry["external_ids"].append({"source": "doi", "id": dois[i]})
+        if columns["EID"]:
+            entry["external_ids"].append(
+                {"source": "scopus", "id": columns["EID"][i]})
+        if columns["Pubmed ID"]:
+            entry["external_ids"].append(
+                {"source": "pubmed", "id": columns["Pubmed ID"][i]})
+        if columns["ISBN"] and columns["ISBN"][i] is not None:
+            entry["external_ids"].append(
+                {"source": "isbn", "id": columns["ISBN"][i]})
+
+        if columns["Link"]:
+            entry["external_urls"].append(
+                {"source": "scopus", "url": columns["Link"][i]})
+
+        for _, key, values in bibliographic_info:
+            if values[i] is not None:
+                entry["bibliographic_info"][key] = values[i]
+
+        if cited_by and cited_by[i] is not None:
+            entry["citations_count"].append(
+                {"source": "scopus", "count": int(cited_by[i])})
+
+        source = {"external_ids": []}
+        if columns["Source title"] and columns["Source title"][i] is not None:
+            source["name"] = columns["Source title"][i]
+        if issns:
+            if issns[i] is not None:
+                source["external_ids"].append(
+                    {"source": "issn", "id": issns[i]})
+            if columns["CODEN"] and columns["CODEN"][i] is not None:
+                source["external_ids"].append(
+                    {"source": "coden", "id": columns["CODEN"][i]})
+        entry["source"] = source
+
+        if authors_affiliations and authors_affiliations[i] is not None:
+            entry["authors"] = parse_authors(
+                authors_affiliations[i],
+                authors_ids[i] if authors_ids else None,
+                raw_dois[i] if raw_dois else None,
+                verbose=verbose)
+        entries.append(entry)
+    return entries
+
+
+def parse_scopus_chunks(records, empty_work, chunk_size=10000, verbose=0):
+    """
+    Generator that reads the records in chunks, parses every chunk with parse_scopus_frame
+    and yields the records with their work entries.
+
+    The frames are built with the object dtype, then the values keep the types of the records
+    (ex: a Year or a Pubmed ID is not cast to float when other records of the chunk do not have it).
+
+    Parameters
+    ----------
+    records : iterable
+        Records of the scopus collection (ex: a cursor).
+    empty_work : dict
+        A template for the work entry. Structure is defined in the schema.
+    chunk_size : int
+        Number of records per chunk.
+    verbose : int
+        Verbosity level.
+
+    Yields
+    ------
+    tuple
+        (record, entry)
+    """
+    chunk = []
+    count = 0
+    start = time()
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            yield from zip(chunk, parse_scopus_frame(pd.DataFrame(chunk, dtype=object), empty_work, verbose=verbose))
+            count += len(chunk)
+            chunk = []
+            if verbose > 4:
+                print(
+                    f"INFO: {count} scopus records parsed in {time() - start:.0f}s")
+    if chunk:
+        yield from zip(chunk, parse_scopus_frame(pd.DataFrame(chunk, dtype=object), empty_work, verbose=verbose))
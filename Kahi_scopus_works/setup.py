@@ -82,8 +82,9 @@ def main():
         install_requires=[
             'kahi',
             'pymongo',
-            'joblib',
+            'joblib>=1.3',
             'kahi_impactu_utils',
+            'pandas',
         ],
     )
 
@@ -4,9 +4,58 @@ from joblib import Parallel, delayed
 from kahi.KahiBase import KahiBase
 from bson import ObjectId
 from time import time
+from unicodedata import normalize, combining
 import copy
 
 
+# fields used to compare the authors of a DOI
+AUTHOR_PROJECTION = {"first_names": 1, "last_names": 1, "full_name": 1,
+                     "updated": 1, "external_ids": 1, "initials": 1}
+
+
+def normalize_token(token):
+    """
+    Returns the token in lower case without accents.
+    """
+    return "".join(c for c in normalize("NFKD", token) if not combining(c)).lower().strip()
+
+
+def blocking_keys(author):
+    """
+    Returns the blocking keys of an author, the initials of the normalized last names
+    (or the initials of the full name if the last names are not available),
+    the scienti, scopus, orcid and scholar ids, and the normalized full name,
+    then the pairs that compare_author matches by a shared id or an equal name share a block.
+    An empty set means that the author has to be compared with all the authors.
+    """
+    names = author.get("last_names") or []
+    if not any(name for name in names if isinstance(name, str) and name.strip()):
+        names = (author.get("full_name") or "").split()
+    keys = {("initial", normalize_token(name)[:1]) for name in names
+            if isinstance(name, str) and normalize_token(name)}
+    if not keys:
+        return keys
+    for ext in author.get("external_ids") or []:
+        if ext.get("source") in ["scienti", "scopus", "orcid", "scholar"] and ext.get("id"):
+            keys.add(("id", ext["source"], str(ext["id"])))
+    full_name = author.get("full_name")
+    if isinstance(full_name, str) and full_name.strip():
+        keys.add(("name", " ".join(normalize_token(full_name).split())))
+    return keys
+
+
+def find_root(parents, idx):
+    """
+    Returns the root of the set of idx in the union-find structure, compressing the path.
+    """
+    root = idx
+    while parents[root] != root:
+        root = parents[root]
+    while parents[idx] != root:
+        parents[idx], idx = root, parents[idx]
+    return root
+
+
 class Kahi_unicity_person(KahiBase):
 
     config = {}
@@ -44,6 +93,11 @@ class Kahi_unicity_person(KahiBase):
         self.verbose = config["unicity_person"][
             "verbose"] if "verbose" in config["unicity_person"].keys() else 0
 
+        self.doi_engine = config["unicity_person"]["doi_engine"] if "doi_engine" in config["unicity_person"].keys(
+        ) else "pairwise"
+        self.doi_batch_size = config["unicity_person"]["doi_batch_size"] if "doi_batch_size" in config["unicity_person"].keys(
+        ) else 100
+
     # Function to merge affiliations
 
     def merge_affiliations(self, target_doc, doc):
@@ -124,6 +178,11 @@ class Kahi_unicity_person(KahiBase):
             The target document where information will be merged.
         collection : Collection
             The MongoDB collection to be used.
+
+        Returns:
+        ----------
+        list
+            The ids of the documents merged into the target document.
         """
         target_id = target_doc["_id"]
         other_docs = []
@@ -165,6 +224,7 @@ class Kahi_unicity_person(KahiBase):
                     "Error: The target document and the other document have the same id")
         # Update the target document in the collection
         self.collection.update_one({"_id": target_id}, {"$set": target_doc})
+        return [other_doc["_id"] for other_doc in other_docs]
 
     # Find the target document based on the 'provenance' of 'external_ids'
     def find_target_doc(self, author_docs, _id):
@@ -309,6 +369,109 @@ class Kahi_unicity_person(KahiBase):
             self.collection_merged_sets.insert_one(
                 {"source": "doi", "doi": reg["_id"], "target_author": {"_id": target_doc["_id"], "full_name": target_doc["full_name"]}, "set": author_found})
 
+    def doi_candidate_sets(self, author_docs, n_authors):
+        """
+        Finds the sets of authors to be merged among the authors of a DOI.
+
+        The candidates are blocked by the initials of the last names, the external ids and the full name (see blocking_keys),
+        every unordered pair is compared once, and only if one of the authors comes from
+        staff, scienti, minciencias or scholar (that author is the first argument of compare_author).
+        The matches are merged with a union-find structure.
+
+        Parameters:
+        ----------
+        self : object
+            The object instance.
+        author_docs : list
+            The author documents of the DOI.
+        n_authors : int
+            The number of authors of the DOI.
+
+        Returns:
+        ----------
+        list
+            List of lists of author ids to be merged.
+        """
+        eligible = [any(updt["source"] in ['staff', 'scienti', 'minciencias', "scholar"]
+                        for updt in author["updated"]) for author in author_docs]
+        if not any(eligible):
+            return []
+        blocks = {}
+        wildcard = []
+        for i, author in enumerate(author_docs):
+            keys = blocking_keys(author)
+            if not keys:
+                wildcard.append(i)
+            for key in keys:
+                blocks.setdefault(key, []).append(i)
+        pairs = set()
+        for block in blocks.values():
+            for x, i in enumerate(block):
+                for j in block[x + 1:]:
+                    pairs.add((i, j) if i < j else (j, i))
+        for i in wildcard:
+            for j in range(len(author_docs)):
+                if i != j:
+                    pairs.add((i, j) if i < j else (j, i))
+
+        parents = list(range(len(author_docs)))
+        for i, j in sorted(pairs):
+            if eligible[i]:
+                author, other_author = author_docs[i], author_docs[j]
+            elif eligible[j]:
+                author, other_author = author_docs[j], author_docs[i]
+            else:
+                continue
+            root_i, root_j = find_root(parents, i), find_root(parents, j)
+            if root_i == root_j:
+                continue
+            if compare_author(author, other_author, n_authors):
+                parents[root_j] = root_i
+
+        sets = {}
+        for i, author in enumerate(author_docs):
+            sets.setdefault(find_root(parents, i), []).append(author["_id"])
+        return [author_set for author_set in sets.values() if len(author_set) > 1]
+
+    def doi_unicity_batch(self, regs, verbose=0):
+        """
+        Checks unicity by DOI for a batch of groups of author documents,
+        the authors of all the groups are fetched with a single query.
+
+        Parameters:
+        ----------
+        self : object
+            The object instance.
+        regs : list
+            A list of registries of aggregated author documents by DOI.
+        """
+        author_ids = set()
+        for reg in regs:
+            author_ids.update(reg["authors"])
+        docs = {doc["_id"]: doc for doc in self.collection.find(
+            {"_id": {"$in": list(author_ids)}}, AUTHOR_PROJECTION)}
+        for reg in regs:
+            author_docs = [docs[_id] for _id in reg["authors"] if _id in docs]
+            if len(author_docs) < 2:
+                continue
+            for author_found in self.doi_candidate_sets(author_docs, len(reg["authors"])):
+                author_docs_ = list(self.collection.find(
+                    {"_id": {"$in": author_found}}))
+                if not author_docs_:
+                    continue
+
+                target_doc = self.find_target_doc(author_docs_, "doi")
+                merged_ids = []
+                if target_doc:
+                    merged_ids = self.merge_documents(author_docs_, target_doc)
+                self.collection_merged_sets.insert_one(
+                    {"source": "doi", "doi": reg["_id"], "target_author": {"_id": target_doc["_id"], "full_name": target_doc["full_name"]}, "set": author_found})
+                # the next groups of the batch see the merged documents
+                for _id in merged_ids:
+                    docs.pop(_id, None)
+                docs[target_doc["_id"]] = {key: target_doc.get(key) for key in [
+                    "_id"] + list(AUTHOR_PROJECTION.keys())}
+
     def process_authors(self):
         """
         Processes authors' information including checking unicity by ORCID id and DOI among author documents.
@@ -379,15 +542,23 @@ class Kahi_unicity_person(KahiBase):
             # different dois can have the same authors and this can produce that the target author in one doi can not be the target in another doi
             # then all the authors similar can be deleted
             # at the moment jobs were hardcode to 1
-            Parallel(
-                n_jobs=1,
-                verbose=self.verbose,
-                backend="threading")(
-                delayed(self.doi_unicity)(
-                    reg,
-                    self.verbose
-                ) for reg in authors_cursor
-            )
+            if self.doi_engine == "blocking":
+                for i in range(0, len(authors_cursor), self.doi_batch_size):
+                    self.doi_unicity_batch(
+                        authors_cursor[i:i + self.doi_batch_size], self.verbose)
+                    if self.verbose > 4:
+                        print("INFO: {} of {} groups of authors processed".format(
+                            min(i + self.doi_batch_size, len(authors_cursor)), len(authors_cursor)))
+            else:
+                Parallel(
+                    n_jobs=1,
+                    verbose=self.verbose,
+                    backend="threading")(
+                    delayed(self.doi_unicity)(
+                        reg,
+                        self.verbose
+                    ) for reg in authors_cursor
+                )
             if self.verbose > 1:
                 print("DOI unicity for {} groups of authors is done!".format(
                     len(authors_cursor)))
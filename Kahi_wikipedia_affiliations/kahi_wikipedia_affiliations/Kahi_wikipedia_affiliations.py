@@ -5,9 +5,34 @@ import requests
 from urllib.parse import unquote
 from thefuzz import fuzz
 from joblib import Parallel, delayed
+from kahi_wikipedia_affiliations.client import WikipediaClient
 
 
-def get_wikipedia_names(url="", name="", lang="en", verbose=0):
+def wikipedia_query(lang, params, client=None):
+    '''
+    Sends a query to the wikipedia API.
+
+    Parameters
+    ----------
+    lang : str
+        The iso-639 lang code of the wikipedia endpoint
+    params : dict
+        The params of the query
+    client : WikipediaClient
+        The client used to send the query, if None a plain request is sent
+
+    Returns
+    -------
+    data : dict
+        The json response
+    '''
+    if client:
+        return client.get(lang, params)
+    base = 'https://' + lang + '.wikipedia.org/w/api.php'
+    return requests.get(base, params=params).json()
+
+
+def get_wikipedia_names(url="", name="", lang="en", verbose=0, client=None):
     '''
     Find the different possible names of a wikipedia entity.
     Right now it is only tested on organizations gotten from ror db
@@ -20,6 +45,8 @@ def get_wikipedia_names(url="", name="", lang="en", verbose=0):
         The name of keywords to do the search over wikipedia api
     lang : str
         The iso-639 lang code to fix the language endpooint of the search language
+    client : WikipediaClient
+        The client used to send the queries, if None plain requests are sent
 
     Returns
     -------
@@ -34,7 +61,6 @@ def get_wikipedia_names(url="", name="", lang="en", verbose=0):
     else:
         return {"response": [], "names": []}
 
-    base = 'https://' + lang + '.wikipedia.org/w/api.php'
     # searching entire wikipedia
     if verbose > 4:
         print("Searching ", subject)
@@ -45,7 +71,7 @@ def get_wikipedia_names(url="", name="", lang="en", verbose=0):
         'srsearch': subject
     }
 
-    data = requests.get(base, params=params).json()
+    data = wikipedia_query(lang, params, client)
     entry = ""
     pageid = ""
     if "query" not in data.keys():
@@ -82,14 +108,13 @@ def get_wikipedia_names(url="", name="", lang="en", verbose=0):
             # 'explaintext': True,
         }
 
-        response = requests.get(base, params=params)
-        data = response.json()
+        data = wikipedia_query(lang, params, client)
         return data
     else:
         return None
 
 
-def get_logo_wikipedia(url="", name="", lang="en", verbose=5):
+def get_logo_wikipedia(url="", name="", lang="en", verbose=5, client=None):
     '''
     Find and image of a wikipedia page.
     Right now it is only tested for the logos of organizations gotten from ror db
@@ -102,6 +127,8 @@ def get_logo_wikipedia(url="", name="", lang="en", verbose=5):
         The name of keywords to do the search over wikipedia api
     lang : str
         The iso-639 lang code to fix the language endpooint of the search language
+    client : WikipediaClient
+        The client used to send the queries, if None plain requests are sent
 
     Returns
     -------
@@ -116,7 +143,6 @@ def get_logo_wikipedia(url="", name="", lang="en", verbose=5):
     else:
         return {"response": [], "names": []}
 
-    base = 'https://' + lang + '.wikipedia.org/w/api.php'
     # searching entire wikipedia
     if verbose > 5:
         print("Searching ", subject)
@@ -127,7 +153,7 @@ def get_logo_wikipedia(url="", name="", lang="en", verbose=5):
         'srsearch': subject
     }
 
-    data = requests.get(base, params=params).json()
+    data = wikipedia_query(lang, params, client)
     # print(data)
     entry = ""
     pageid = ""
@@ -161,8 +187,7 @@ def get_logo_wikipedia(url="", name="", lang="en", verbose=5):
             'prop': 'images'
         }
 
-        response = requests.get(base, params=params)
-        data = response.json()
+        data = wikipedia_query(lang, params, client)
         try:
             title = ""
             for img in data["query"]["pages"][str(pageid)]["images"]:
@@ -183,8 +208,7 @@ def get_logo_wikipedia(url="", name="", lang="en", verbose=5):
                 'prop': 'imageinfo',
                 'iiprop': "url"
             }
-            response = requests.get(base, params=params)
-            data = response.json()
+            data = wikipedia_query(lang, params, client)
             return data
         except Exception as e:
             if verbose > 5:
@@ -196,14 +220,11 @@ def get_logo_wikipedia(url="", name="", lang="en", verbose=5):
         return None
 
 
-def process_one_wikipedia_name(inst, url, db_name, verbose=0):
+def process_one_wikipedia_name(inst, url, db_name, verbose=0, client=None):
     for name in inst["names"]:
         if name["source"] == "wikipedia":
             return
 
-    client = MongoClient(url)
-    db = client[db_name]
-    collection = db["affiliations"]
     wikipedia_url = ""
     wikipedia_name = ""
     for ext in inst["external_urls"]:
@@ -221,9 +242,11 @@ def process_one_wikipedia_name(inst, url, db_name, verbose=0):
     result = {}
     res = []
     if wikipedia_url:
-        res = get_wikipedia_names(url=wikipedia_url, verbose=verbose)
+        res = get_wikipedia_names(
+            url=wikipedia_url, verbose=verbose, client=client)
     elif wikipedia_name:
-        res = get_wikipedia_names(name=wikipedia_name, verbose=verbose)
+        res = get_wikipedia_names(
+            name=wikipedia_name, verbose=verbose, client=client)
     try:
         k = list(res["query"]["pages"].keys())[0]
         result = {"response": res,
@@ -239,10 +262,10 @@ def process_one_wikipedia_name(inst, url, db_name, verbose=0):
         result = {"response": res, "names": []}
         if wikipedia_url:
             res = get_wikipedia_names(
-                url=wikipedia_url, lang="es", verbose=verbose)
+                url=wikipedia_url, lang="es", verbose=verbose, client=client)
         elif wikipedia_name:
             res = get_wikipedia_names(
-                name=wikipedia_name, lang="es", verbose=verbose)
+                name=wikipedia_name, lang="es", verbose=verbose, client=client)
         try:
             k = list(res["query"]["pages"].keys())[0]
             result = {"response": res,
@@ -266,23 +289,26 @@ def process_one_wikipedia_name(inst, url, db_name, verbose=0):
                 names.append(
                     {"name": nam["*"], "lang": nam["lang"], "source": "wikipedia"})
         inst["updated"].append({"source": "wikipedia", "time": int(time())})
-        collection.update_one({"_id": inst["_id"]}, {
-                              "$set": {"names": names, "updated": inst["updated"]}})
+        # the mongo client is only opened to write the result
+        with MongoClient(url) as mongo_client:
+            collection = mongo_client[db_name]["affiliations"]
+            collection.update_one({"_id": inst["_id"]}, {
+                                  "$set": {"names": names, "updated": inst["updated"]}})
 
 
-def process_one_wikipedia_logo(inst, url, db_name, verbose=0):
-    client = MongoClient(url)
+def process_one_wikipedia_logo(inst, url, db_name, verbose=0, client=None):
+    mongo_client = MongoClient(url)
 
-    db = client[db_name]
+    db = mongo_client[db_name]
     collection = db["affiliations"]
 
     logo_url = None
-    url = None
+    wikipedia_url = None
     for ext in inst["external_urls"]:
         if ext["source"] == "wikipedia":
-            url = ext["url"]
-    if url:
-        logo_url = get_logo_wikipedia(url=url)
+            wikipedia_url = ext["url"]
+    if wikipedia_url:
+        logo_url = get_logo_wikipedia(url=wikipedia_url, client=client)
     else:
         name = None
         lang = None
@@ -292,7 +318,8 @@ def process_one_wikipedia_logo(inst, url, db_name, verbose=0):
                 lang = n["lang"]
                 break
         if name and lang:
-            logo_url = get_logo_wikipedia(name=name, lang=lang)
+            logo_url = get_logo_wikipedia(
+                name=name, lang=lang, client=client)
         if not logo_url:
             for n in inst["names"]:
                 if n["lang"] == "es":
@@ -300,7 +327,8 @@ def process_one_wikipedia_logo(inst, url, db_name, verbose=0):
                     lang = n["lang"]
                     break
             if name and lang:
-                logo_url = get_logo_wikipedia(name=name, lang=lang)
+                logo_url = get_logo_wikipedia(
+                    name=name, lang=lang, client=client)
     if logo_url:
         try:
             logo_url = logo_url["query"]["pages"][list(logo_url["query"]["pages"].keys())[
@@ -311,6 +339,7 @@ def process_one_wikipedia_logo(inst, url, db_name, verbose=0):
             if verbose > 4:
                 print(inst["_id"])
                 print(e)
+    mongo_client.close()
 
 
 class Kahi_wikipedia_affiliations(KahiBase):
@@ -336,7 +365,21 @@ class Kahi_wikipedia_affiliations(KahiBase):
 
         self.wikipedia_updated = []
 
+        self.client_config = config["wikipedia_affiliations"]["client"] if "client" in config["wikipedia_affiliations"].keys(
+        ) else {}
+
     def process_wikipedia(self):
+        # the client is shared by the threads of both tasks
+        wikipedia_client = WikipediaClient(
+            api_url=self.client_config.get(
+                "api_url", "https://{lang}.wikipedia.org/w/api.php"),
+            cache_path=self.client_config.get("cache_path", None),
+            max_concurrency=self.client_config.get(
+                "max_concurrency", self.n_jobs),
+            rate_limit=self.client_config.get("rate_limit", None),
+            retries=self.client_config.get("retries", 5),
+            backoff=self.client_config.get("backoff", 1),
+            timeout=self.client_config.get("timeout", 30))
         for task in self.tasks:
             if task == "names":
                 if self.verbose > 0:
@@ -351,7 +394,8 @@ class Kahi_wikipedia_affiliations(KahiBase):
                     inst,
                     self.config["database_url"],
                     self.config["database_name"],
-                    self.verbose
+                    self.verbose,
+                    wikipedia_client
                 ) for inst in institutions)
             elif task == "logos":
                 if self.verbose > 0:
@@ -360,14 +404,16 @@ class Kahi_wikipedia_affiliations(KahiBase):
                     {"updated.source": "ror", "_id": {"$nin": self.wikipedia_updated}}))
                 Parallel(
                     n_jobs=self.n_jobs,
-                    backend="multiprocessing",
+                    backend="threading",
                     verbose=10
                 )(delayed(process_one_wikipedia_logo)(
                     inst,
                     self.config["database_url"],
                     self.config["database_name"],
-                    self.verbose
+                    self.verbose,
+                    wikipedia_client
                 ) for inst in institutions)
+        wikipedia_client.close()
 
     def run(self):
         self.process_wikipedia()
@@ -0,0 +1,156 @@
+from threading import BoundedSemaphore, Lock
+from time import monotonic, sleep, time
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import requests
+import sqlite3
+import json
+
+
+class ResponseCache:
+    """
+    On-disk cache of the responses of the wikipedia API, saved in a sqlite database
+    and keyed by (lang, title, prop).
+
+    Parameters
+    ----------
+    path : str
+        Path of the sqlite file, it is created if it does not exist.
+    """
+
+    def __init__(self, path):
+        self.lock = Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses (lang TEXT, title TEXT, prop TEXT, response TEXT, time INTEGER, PRIMARY KEY (lang, title, prop))")
+            self.connection.commit()
+
+    def get(self, key):
+        """
+        Returns the cached response of the key or None.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT response FROM responses WHERE lang=? AND title=? AND prop=?", key).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, data):
+        """
+        Saves the response of the key.
+        """
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)", (*key, json.dumps(data), int(time())))
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class WikipediaClient:
+    """
+    Client of the wikipedia API with a pooled requests.Session, bounded concurrency, rate limit
+    and retries with exponential backoff. If cache_path is given the responses are saved on disk.
+
+    Parameters
+    ----------
+    api_url : str, optional
+        Url of the API with a {lang} placeholder. The default is "https://{lang}.wikipedia.org/w/api.php",
+        a local server could be used instead (ex: for tests).
+    cache_path : str, optional
+        Path of the sqlite file of the cache, if None the responses are not cached.
+    max_concurrency : int, optional
+        Maximum number of requests at the same time. The default is 10.
+    rate_limit : float, optional
+        Maximum number of requests per second, if None the requests are not limited.
+    retries : int, optional
+        Maximum number of retries of a request. The default is 5.
+    backoff : float, optional
+        Backoff factor of the retries, the retry n waits backoff * 2 ** (n - 1) seconds. The default is 1.
+    timeout : float, optional
+        Timeout of the requests in seconds. The default is 30.
+    """
+
+    def __init__(self, api_url="https://{lang}.wikipedia.org/w/api.php", cache_path=None, max_concurrency=10,
+                 rate_limit=None, retries=5, backoff=1, timeout=30):
+        self.api_url = api_url
+        self.cache = ResponseCache(cache_path) if cache_path else None
+        self.timeout = timeout
+
+        retry = Retry(total=retries, backoff_factor=backoff,
+                      status_forcelist=[429, 500, 502, 503, 504], respect_retry_after_header=True)
+        adapter = HTTPAdapter(pool_connections=max_concurrency,
+                              pool_maxsize=max_concurrency, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(
+            {"User-Agent": "kahi_wikipedia_affiliations (http://colav.udea.edu.co/)"})
+
+        self.semaphore = BoundedSemaphore(max_concurrency)
+        self.min_interval = 1 / rate_limit if rate_limit else 0
+        self.rate_lock = Lock()
+        self.next_request = monotonic()
+
+    @staticmethod
+    def cache_key(lang, params):
+        """
+        Returns the key (lang, title, prop) of the request.
+        """
+        if "srsearch" in params.keys():
+            return (lang, str(params["srsearch"]), "search")
+        title = params["pageids"] if "pageids" in params.keys() else params.get("titles", "")
+        return (lang, str(title), params.get("prop", ""))
+
+    def wait(self):
+        """
+        Waits the time needed to keep the rate limit.
+        """
+        if not self.min_interval:
+            return
+        with self.rate_lock:
+            now = monotonic()
+            delay = self.next_request - now
+            self.next_request = max(now, self.next_request) + self.min_interval
+        if delay > 0:
+            sleep(delay)
+
+    def get(self, lang, params):
+        """
+        Sends a query to the wikipedia API of the language, or returns the cached response.
+
+        Parameters
+        ----------
+        lang : str
+            The iso-639 lang code of the wikipedia endpoint.
+        params : dict
+            The params of the query.
+
+        Returns
+        -------
+        data : dict
+            The json response.
+        """
+        key = self.cache_key(lang, params)
+        if self.cache:
+            data = self.cache.get(key)
+            if data is not None:
+                return data
+        with self.semaphore:
+            self.wait()
+            response = self.session.get(self.api_url.format(
+                lang=lang), params=params, timeout=self.timeout)
+        data = response.json()
+        if self.cache and "error" not in data.keys():
+            self.cache.set(key, data)
+        return data
+
+    def close(self):
+        """
+        Closes the session and the cache.
+        """
+        self.session.close()
+        if self.cache:
+            self.cache.close()
@@ -84,7 +84,8 @@ def main():
             'pymongo',
             'joblib',
             'datetime',
-            'thefuzz'
+            'thefuzz',
+            'requests'
         ],
     )
 
@@ -2,11 +2,102 @@ from kahi.KahiBase import KahiBase
 from pymongo import MongoClient, TEXT
 from time import time
 from joblib import Parallel, delayed
-from thefuzz import fuzz
+from rapidfuzz import fuzz, process
+from rapidfuzz.utils import default_process
+import numpy as np
 
 from kahi_impactu_utils.Utils import doi_processor, lang_poll
 
 
+# fields of the wos records used by process_one and parse_wos
+WOS_PROJECTION = {key: 1 for key in ["AB", "AF", "BN", "BP", "C1", "DI", "DT", "EI", "EP",
+                                     "IS", "OI", "PY", "RI", "SN", "SO", "TI", "UT", "VL", "Z9"]}
+
+
+def full_process(text):
+    """
+    Preprocessing of the token based scorers, same as thefuzz full_process with force_ascii.
+    """
+    return default_process("".join(c for c in text if ord(c) < 128))
+
+
+def parse_name_ids(ids_list, source, doi):
+    """
+    Splits the entries name/id of the RI or OI fields.
+
+    Parameters
+    ----------
+    ids_list : list
+        List of strings with the format name/id.
+    source : str
+        Name of the id (researcherid or orcid) for the error messages.
+    doi : str
+        Doi of the register for the error messages.
+
+    Returns
+    -------
+    list
+        List of tuples (name, id).
+    """
+    candidates = []
+    for res in ids_list:
+        try:
+            name, rid = res.split("/")[-2:]
+        except Exception as e:
+            print(f"""{doi} does not provide {source}""")
+            print(e)
+            continue
+        candidates.append((name, rid))
+    return candidates
+
+
+def match_name_ids(authors, candidates):
+    """
+    Matches every author with the first candidate that passes the scores cascade
+    (partial_ratio > 90, or token_set_ratio > 90, or partial_token_set_ratio > 95,
+    each score is checked only if the previous one is greater than 50).
+    The scores of all the authors and candidates are computed at once with rapidfuzz cdist.
+
+    Parameters
+    ----------
+    authors : list
+        Names of the authors.
+    candidates : list
+        List of tuples (name, id), see parse_name_ids.
+
+    Returns
+    -------
+    list
+        The id matched for every author, or None.
+    """
+    if not authors or not candidates:
+        return [None] * len(authors)
+    names = [name for name, _ in candidates]
+    processed_authors = [full_process(author) for author in authors]
+    processed_names = [full_process(name) for name in names]
+    partial = np.round(process.cdist(
+        authors, names, scorer=fuzz.partial_ratio, dtype=np.float64))
+    token_set = np.round(process.cdist(
+        processed_authors, processed_names, scorer=fuzz.token_set_ratio, dtype=np.float64))
+    partial_token_set = np.round(process.cdist(
+        processed_authors, processed_names, scorer=fuzz.partial_token_set_ratio, dtype=np.float64))
+    matches = []
+    for i in range(len(authors)):
+        match = None
+        for j, (_, rid) in enumerate(candidates):
+            if partial[i, j] > 90:
+                match = rid
+            elif partial[i, j] > 50:
+                if token_set[i, j] > 90:
+                    match = rid
+                elif token_set[i, j] > 50 and partial_token_set[i, j] > 95:
+                    match = rid
+            if match is not None:
+                break
+        matches.append(match)
+    return matches
+
+
 def parse_wos(reg, empty_work, verbose=0):
     entry = empty_work.copy()
     entry["updated"] = [{"source": "wos", "time": int(time())}]
@@ -93,6 +184,10 @@ def parse_wos(reg, empty_work, verbose=0):
                 if reg["OI"] and reg["OI"] == reg["OI"]:
                     orcid_list = reg["OI"].rstrip().replace(
                         "; ", ";").split(";")
+            doi = reg["DI"] if "DI" in reg.keys() else None
+            researcherid_list = parse_name_ids(
+                researcherid_list, "researcherid", doi)
+            orcid_list = parse_name_ids(orcid_list, "orcid", doi)
             for auwaf in reg["C1"].strip().replace(".", "").split("\n"):
                 aulen = len(auwaf.split(";"))
                 if aulen == 1:
@@ -117,56 +212,16 @@ def parse_wos(reg, empty_work, verbose=0):
                             f"""Institution name could not be extracted for {reg["DI"]}""")
                         print(e)
                     instname = ""
-                for author in authors:
+                authors = list(authors)
+                researcherids = match_name_ids(authors, researcherid_list)
+                orcids = match_name_ids(authors, orcid_list)
+                for author, researcherid, orcid in zip(authors, researcherids, orcids):
                     entry_ext = []
-                    for res in researcherid_list:
-                        try:
-                            name, rid = res.split("/")[-2:]
-                        except Exception as e:
-                            print(
-                                f"""{reg["DI"]} does not provide researcherid """)
-                            print(e)
-                        ratio = fuzz.partial_ratio(name, author)
-                        if ratio > 90:
-                            entry_ext.append(
-                                {"source": "researcherid", "id": rid})
-                            break
-                        elif ratio > 50:
-                            ratio = fuzz.token_set_ratio(name, author)
-                            if ratio > 90:
-                                entry_ext.append(
-                                    {"source": "researcherid", "id": rid})
-                                break
-                            elif ratio > 50:
-                                ratio = fuzz.partial_token_set_ratio(
-                                    name, author)
-                                if ratio > 95:
-                                    entry_ext.append(
-                                        {"source": "researcherid", "id": rid})
-                                    break
-                    for res in orcid_list:
-                        try:
-                            name, rid = res.split("/")[-2:]
-                        except Exception as e:
-                            print(f"""{reg["DI"]} does not provide orcid""")
-                            print(e)
-                        ratio = fuzz.partial_ratio(name, author)
-                        if ratio > 90:
-                            entry_ext.append({"source": "orcid", "id": rid})
-                            break
-                        elif ratio > 50:
-                            ratio = fuzz.token_set_ratio(name, author)
-                            if ratio > 90:
-                                entry_ext.append(
-                                    {"source": "orcid", "id": rid})
-                                break
-                            elif ratio > 50:
-                                ratio = fuzz.partial_token_set_ratio(
-                                    name, author)
-                                if ratio > 95:
-                                    entry_ext.append(
-                                        {"source": "orcid", "id": rid})
-                                    break
+                    if researcherid is not None:
+                        entry_ext.append(
+                            {"source": "researcherid", "id": researcherid})
+                    if orcid is not None:
+                        entry_ext.append({"source": "orcid", "id": orcid})
                     author_entry = {
                         "full_name": author,
                         "types": [],
@@ -433,26 +488,40 @@ class Kahi_wos_works(KahiBase):
         ) else 1
         self.verbose = config["wos_works"]["verbose"] if "verbose" in config["wos_works"].keys(
         ) else 0
+        self.stream = config["wos_works"]["stream"] if "stream" in config["wos_works"].keys(
+        ) else False
+        self.cursor_batch_size = config["wos_works"]["cursor_batch_size"] if "cursor_batch_size" in config["wos_works"].keys(
+        ) else 1000
 
     def process_wos(self):
-        paper_list = list(self.wos_collection.find())
-
-        with MongoClient(self.mongodb_url) as client:
-            db = client[self.config["database_name"]]
-            collection = db["works"]
-
-            Parallel(
-                n_jobs=self.n_jobs,
-                verbose=self.verbose,
-                backend="threading")(
-                delayed(process_one)(
-                    paper,
-                    db,
-                    collection,
-                    self.empty_work(),
-                    verbose=self.verbose
-                ) for paper in paper_list
-            )
+        if self.stream:
+            # the records are read in batches while the workers process them
+            paper_list = self.wos_collection.find(
+                {}, WOS_PROJECTION, no_cursor_timeout=True, batch_size=self.cursor_batch_size)
+        else:
+            paper_list = list(self.wos_collection.find())
+
+        try:
+            with MongoClient(self.mongodb_url) as client:
+                db = client[self.config["database_name"]]
+                collection = db["works"]
+
+                Parallel(
+                    n_jobs=self.n_jobs,
+                    verbose=self.verbose,
+                    backend="threading")(
+                    delayed(process_one)(
+                        paper,
+                        db,
+                        collection,
+                        self.empty_work(),
+                        verbose=self.verbose
+                    ) for paper in paper_list
+                )
+        finally:
+            # the cursor has no timeout, it has to be closed even if a worker fails
+            if self.stream:
+                paper_list.close()
 
     def run(self):
         self.process_wos()
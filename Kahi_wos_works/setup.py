@@ -83,7 +83,8 @@ def main():
             'kahi',
             'pymongo',
             'joblib',
-            'thefuzz',
+            'rapidfuzz',
+            'numpy',
             'kahi_impactu_utils',
         ],
     )